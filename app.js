@@ -0,0 +1,326 @@
+// Client for the single-page output of code-extract.py --app.
+//
+// The data bundle lives in data/ as small script files, each of which calls
+// QCV.receive(key, data) when loaded, so the app also works when opened
+// straight from disk. data/index.js holds the codes, interviews and speakers;
+// interview, code and speaker shards are only loaded when a view needs them:
+//
+//   index                     {project, codes: [[name, quotes, interviews, [speaker ids]]],
+//                              threads: [[title, quotes]], speakers: [name]}
+//   threads/<interview id>    [[postID, speaker id, text, [code ids]]]
+//   codes/<code id>           {posts: [[interview id, post index]], threads: [[interview id, count]]}
+//   speakers/<speaker id>     {codes: [[code id, count]], threads: [interview id],
+//                              posts: [[interview id, post index]]}
+
+var QCV = (function () {
+  var shards = {};
+  var waiting = {};
+  var index = null;
+
+  function receive(key, data) {
+    shards[key] = data;
+    var callbacks = waiting[key] || [];
+    delete waiting[key];
+    callbacks.forEach(function (callback) { callback(data); });
+  }
+
+  function load(key, callback) {
+    if (key in shards) {
+      callback(shards[key]);
+      return;
+    }
+    if (key in waiting) {
+      waiting[key].push(callback);
+      return;
+    }
+    waiting[key] = [callback];
+    var script = document.createElement('script');
+    script.src = 'data/' + key + '.js';
+    document.head.appendChild(script);
+  }
+
+  function loadAll(keys, callback) {
+    var results = {};
+    var remaining = keys.length;
+    if (remaining === 0) {
+      callback(results);
+      return;
+    }
+    keys.forEach(function (key) {
+      load(key, function (data) {
+        results[key] = data;
+        remaining -= 1;
+        if (remaining === 0) {
+          callback(results);
+        }
+      });
+    });
+  }
+
+  // Loads the interview shards that posts, a list of [interview id, post index], refer to
+  function loadPosts(refs, callback) {
+    var keys = [];
+    refs.forEach(function (ref) {
+      var key = 'threads/' + ref[0];
+      if (keys.indexOf(key) < 0) {
+        keys.push(key);
+      }
+    });
+    loadAll(keys, function (threads) {
+      callback(refs.map(function (ref) {
+        return [ref[0], threads['threads/' + ref[0]][ref[1]]];
+      }));
+    });
+  }
+
+  //////////////////////////////////////////////////////////////////////////////
+  // DOM helpers
+  //////////////////////////////////////////////////////////////////////////////
+
+  function el(tag, attrs, children) {
+    var node = document.createElement(tag);
+    Object.keys(attrs || {}).forEach(function (name) {
+      node.setAttribute(name, attrs[name]);
+    });
+    (children || []).forEach(function (child) {
+      node.appendChild(typeof child === 'string' || typeof child === 'number' ?
+        document.createTextNode(String(child)) : child);
+    });
+    return node;
+  }
+
+  function link(text, route) {
+    return el('a', {href: '#/' + route}, [text]);
+  }
+
+  function separator() {
+    return document.createTextNode('  -  ');
+  }
+
+  function show(title, nodes) {
+    var app = document.getElementById('app');
+    app.innerHTML = '';
+    document.title = title;
+    app.appendChild(el('div', {id: 'index-header'}, [
+      el('h1', {}, [title]),
+      el('div', {id: 'index-menu'}, [link('index', ''), separator(), link('histograms', 'histograms')])
+    ]));
+    nodes.forEach(function (node) { app.appendChild(node); });
+  }
+
+  function submenu(items) {
+    var children = [];
+    items.forEach(function (item, i) {
+      if (i > 0) {
+        children.push(separator());
+      }
+      children.push(link(item[0], item[1]));
+    });
+    return el('div', {'class': 'submenu'}, children);
+  }
+
+  function headerRow(names) {
+    return el('tr', {'class': 'table-header'}, names.map(function (name) { return el('th', {}, [name]); }));
+  }
+
+  // A quote row, with its codes linking to all quotes or to quotes in the same interview
+  function postRow(threadId, post, codesInInterview) {
+    var codes = [];
+    post[3].forEach(function (codeId, i) {
+      if (i > 0) {
+        codes.push(el('br'));
+        codes.push(el('br'));
+      }
+      codes.push(link(index.codes[codeId][0], codesInInterview ?
+        'code/' + codeId + '/interview/' + threadId : 'code/' + codeId));
+    });
+    return el('tr', {id: 'post-' + threadId + '-' + post[0]}, [
+      el('td', {}, [link(index.speakers[post[1]], 'speaker/' + post[1])]),
+      el('td', {}, [link(post[2], 'interview/' + threadId + '/' + post[0])]),
+      el('td', {}, codes)
+    ]);
+  }
+
+  function postTable(posts, codesInInterview) {
+    var table = el('table', {style: 'width: 100%; table-layout: fixed; max-width: 90vw'},
+      [headerRow(['speaker', 'quote', 'codes'])]);
+    posts.forEach(function (post) {
+      table.appendChild(postRow(post[0], post[1], codesInInterview));
+    });
+    return table;
+  }
+
+  //////////////////////////////////////////////////////////////////////////////
+  // Views
+  //////////////////////////////////////////////////////////////////////////////
+
+  function byInterviewsDesc(codeIds) {
+    return codeIds.slice().sort(function (a, b) { return index.codes[b][2] - index.codes[a][2]; });
+  }
+
+  function indexView() {
+    var codeIds = byInterviewsDesc(index.codes.map(function (code, i) { return i; }));
+    var codeCell = el('td', {'class': 'index-codes'});
+    codeIds.forEach(function (codeId) {
+      var code = index.codes[codeId];
+      codeCell.appendChild(el('div', {'class': 'index-code'}, [
+        link(code[0], 'code/' + codeId),
+        '  (quotes=' + code[1] + ', interviews=' + code[2] + ')'
+      ]));
+    });
+
+    var numPosts = 0;
+    var threadIds = index.threads.map(function (thread, i) {
+      numPosts += thread[1];
+      return i;
+    });
+    threadIds.sort(function (a, b) {
+      return index.threads[a][0] < index.threads[b][0] ? -1 : index.threads[a][0] > index.threads[b][0] ? 1 : 0;
+    });
+    var threadCell = el('td', {'class': 'index-threads'});
+    threadIds.forEach(function (threadId) {
+      threadCell.appendChild(link(index.threads[threadId][0], 'interview/' + threadId));
+      threadCell.appendChild(el('br'));
+    });
+
+    show(index.project + ': Coded Transcripts', [el('table', {style: 'width: 100%'}, [
+      el('tr', {}, [el('td', {'class': 'index-header'}, [el('h1', {}, ['codes (n=' + codeIds.length + ')'])])]),
+      el('tr', {}, [codeCell]),
+      el('tr', {}, [el('td', {'class': 'index-header'}, [
+        el('h1', {}, ['interviews (n=' + threadIds.length + ', quotes=' + numPosts + ')'])])]),
+      el('tr', {}, [threadCell])
+    ])]);
+  }
+
+  function histogramsView() {
+    var table = el('table', {style: 'width: 100%', id: 'histograms-table'}, [
+      headerRow(['code', '# distinct interviews', '# distinct quotes', '# distinct speakers', 'speakers'])
+    ]);
+    byInterviewsDesc(index.codes.map(function (code, i) { return i; })).forEach(function (codeId) {
+      var code = index.codes[codeId];
+      table.appendChild(el('tr', {}, [
+        el('td', {}, [link(code[0], 'code/' + codeId)]),
+        el('td', {}, [code[2]]),
+        el('td', {}, [code[1]]),
+        el('td', {}, [code[3].length]),
+        el('td', {'class': 'histogram-posters'}, code[3].map(function (speakerId) {
+          return link(index.speakers[speakerId], 'speaker/' + speakerId);
+        }))
+      ]));
+    });
+    show(index.project + ': Histograms', [table]);
+  }
+
+  function codeView(codeId, tab, threadId) {
+    var name = index.codes[codeId][0];
+    load('codes/' + codeId, function (code) {
+      if (tab === 'interviews') {
+        var table = el('table', {style: 'width: 100%; table-layout: fixed; max-width: 90vw'},
+          [headerRow(['interview', '# quotes with this code'])]);
+        code.threads.forEach(function (pair) {
+          table.appendChild(el('tr', {}, [
+            el('td', {}, [link(index.threads[pair[0]][0], 'code/' + codeId + '/interview/' + pair[0])]),
+            el('td', {}, [pair[1]])
+          ]));
+        });
+        show('All threads in ' + index.project + ' tagged with ' + name, [
+          submenu([['quotes', 'code/' + codeId], ['interviews (n=' + code.threads.length + ')', 'code/' + codeId + '/interviews']]),
+          table
+        ]);
+        return;
+      }
+
+      var refs = code.posts;
+      if (tab === 'interview') {
+        refs = refs.filter(function (ref) { return ref[0] === threadId; });
+      }
+      loadPosts(refs, function (posts) {
+        if (tab === 'interview') {
+          show('All references to ' + name + ' in interview ' + index.threads[threadId][0], [postTable(posts, false)]);
+        } else {
+          show('All quotes in ' + index.project + ' tagged with ' + name, [
+            submenu([['quotes', 'code/' + codeId], ['interviews', 'code/' + codeId + '/interviews']]),
+            postTable(posts, false)
+          ]);
+        }
+      });
+    });
+  }
+
+  function interviewView(threadId, postID) {
+    load('threads/' + threadId, function (posts) {
+      show(index.threads[threadId][0], [
+        el('div', {'class': 'num_posts'}, ['quotes=' + posts.length]),
+        postTable(posts.map(function (post) { return [threadId, post]; }), true)
+      ]);
+      var row = postID !== undefined && document.getElementById('post-' + threadId + '-' + postID);
+      if (row) {
+        row.scrollIntoView();
+      }
+    });
+  }
+
+  function speakerView(speakerId, tab) {
+    var name = index.speakers[speakerId];
+    var title = 'All coded activity for poster ' + name;
+    var menu = submenu([
+      ['codes', 'speaker/' + speakerId],
+      ['interviews', 'speaker/' + speakerId + '/interviews'],
+      ['quotes', 'speaker/' + speakerId + '/quotes']
+    ]);
+    load('speakers/' + speakerId, function (speaker) {
+      var table = el('table', {style: 'width: 100%; table-layout: fixed'});
+      if (tab === 'quotes') {
+        loadPosts(speaker.posts, function (posts) {
+          show(title, [menu, el('h1', {}, ['quotes (n=' + posts.length + ')']), postTable(posts, true)]);
+        });
+        return;
+      }
+      if (tab === 'interviews') {
+        speaker.threads.forEach(function (threadId) {
+          table.appendChild(el('tr', {'class': 'poster-thread'}, [
+            el('td', {}, [link(index.threads[threadId][0], 'interview/' + threadId)])
+          ]));
+        });
+        show(title, [menu, el('h1', {}, ['interviews (n=' + speaker.threads.length + ')']), table]);
+        return;
+      }
+      table.appendChild(headerRow(['code', 'count']));
+      speaker.codes.forEach(function (pair) {
+        table.appendChild(el('tr', {'class': 'poster-code'}, [
+          el('td', {}, [link(index.codes[pair[0]][0], 'code/' + pair[0])]),
+          el('td', {}, [pair[1]])
+        ]));
+      });
+      show(title, [menu, el('h1', {}, ['codes (n=' + speaker.codes.length + ')']), table]);
+    });
+  }
+
+  // Routes are #/, #/histograms, #/code/<id>[/interviews|/interview/<id>],
+  // #/interview/<id>[/<postID>] and #/speaker/<id>[/interviews|/quotes]
+  function route() {
+    var parts = window.location.hash.replace(/^#\/?/, '').split('/');
+    var id = parseInt(parts[1], 10);
+    if (parts[0] === 'histograms') {
+      histogramsView();
+    } else if (parts[0] === 'code' && index.codes[id]) {
+      codeView(id, parts[2], parseInt(parts[3], 10));
+    } else if (parts[0] === 'interview' && index.threads[id]) {
+      interviewView(id, parts[2]);
+    } else if (parts[0] === 'speaker' && id in index.speakers) {
+      speakerView(id, parts[2]);
+    } else {
+      indexView();
+    }
+  }
+
+  function start() {
+    load('index', function (data) {
+      index = data;
+      window.addEventListener('hashchange', route);
+      route();
+    });
+  }
+
+  return {receive: receive, start: start};
+})();
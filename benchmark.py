@@ -0,0 +1,219 @@
+#!/usr/bin/python3
+import sys
+
+if sys.version_info[0] != 3:
+    print("This script requires Python version 3")
+    sys.exit(1)
+
+"""
+benchmark.py
+------------
+
+Times the whole pipeline end to end on a synthetic corpus. Writes raw
+transcripts with synthetic.py, then runs each stage in turn the way
+reformat.py and code-extract.py would: reformatting, parsing, the counts, and
+each family of generated pages. For every stage it records the wall time and
+the peak memory of the process so far, and writes them to a JSON report.
+
+Save a report from each version to compare, then pass --compare with the
+older report to print how each stage changed.
+
+"""
+
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import platform
+import resource
+import tempfile
+import time
+from collections import defaultdict
+
+import reformat
+import synthetic
+from output import setSink, flushOutput, closeOutput, ThreadedSink
+from util import urlSafe, CodeMatcher, CodeCorrections
+from generators import genIndex, genHistograms, genCodeCounts, genCooccurrenceHTML, genCooccurrenceCSV
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def load_extractor():
+    """ Imports code-extract.py, whose name isn't a module name """
+    spec = importlib.util.spec_from_file_location('code_extract', os.path.join(HERE, 'code-extract.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def peak_memory_kb():
+    """ Returns the peak resident memory of this process so far, in KB """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux kilobytes
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+class Stages(object):
+    """ Times stages run one after another, collecting a result for each """
+
+    def __init__(self):
+        self.results = []
+
+    @contextlib.contextmanager
+    def stage(self, name, **counts):
+        print('{}...'.format(name), end=' ', flush=True)
+        start = time.perf_counter()
+        # The stages print progress of their own, which would swamp the report
+        with contextlib.redirect_stdout(io.StringIO()):
+            yield
+        seconds = time.perf_counter() - start
+        result = dict(stage=name, seconds=round(seconds, 4), peak_memory_kb=peak_memory_kb())
+        result.update(counts)
+        self.results.append(result)
+        print('{:.3f}s'.format(seconds))
+
+
+def run(args, work_dir):
+    """ Writes the corpus to work_dir and runs every stage on it, returns the report """
+    extract = load_extractor()
+    raw_dir = os.path.join(work_dir, 'raw') + '/'
+    reformatted_dir = os.path.join(work_dir, 'reformatted') + '/'
+    outputdir = os.path.join(work_dir, 'output')
+    for directory in (reformatted_dir, outputdir + '/html', outputdir + '/csv'):
+        os.makedirs(directory)
+
+    codes = synthetic.make_codes(args['codes'], args['seed'])
+    codebook = os.path.join(work_dir, 'codebook.csv')
+    synthetic.write_codebook(codebook, codes)
+    num_quotes = synthetic.write_raw_corpus(raw_dir, codes, args['interviews'], args['quotes'],
+                                            args['codes_per_quote'], args['misspell_rate'], args['seed'])
+    codes = [urlSafe(code) for code in codes]
+    project_title = 'Benchmark'
+    stages = Stages()
+
+    corrections = CodeCorrections()
+    with stages.stage('reformat'):
+        reformat.reformat(raw_dir, reformatted_dir, CodeMatcher(codes), corrections)
+    transcripts = sorted(reformatted_dir + name for name in os.listdir(reformatted_dir))
+
+    with stages.stage('parse'):
+        matcher = CodeMatcher(codes)
+        threads = [extract.readOriginalCSV(transcript, matcher, outputdir, CodeCorrections()) for transcript in transcripts]
+
+    code_counts = {code: {'posters': set(), 'threads': set(), 'posts': 0} for code in codes}
+    posters = {}
+    code_posts = defaultdict(list)
+    with stages.stage('stats'):
+        extract.tallyThreads(threads, code_counts, posters, code_posts)
+        cooccurrences = extract.countCooccurrences(threads, codes)
+
+    extract.initRenderer({
+        'outputdir': outputdir,
+        'project_title': project_title,
+        'pageSize': 0,
+        'renderThreads': threads,
+        'posters': posters,
+        'threads': threads,
+        'codePosts': code_posts,
+        'codeIds': extract.CODE_IDS,
+        'speakerIds': extract.SPEAKER_IDS,
+    })
+    families = [
+        ('posters', [('poster', name) for name in posters]),
+        ('threads', [('thread', i) for i in range(len(threads))]),
+        ('codes', [('code', code) for code in codes]),
+        ('code per interview', [('codePerTrans', code) for code in codes]),
+    ]
+    # Pages are written as code-extract.py -w writes them, and each stage waits for its pages to be on disk
+    if args['writers'] > 0:
+        setSink(ThreadedSink(args['writers']))
+    for name, jobs in families:
+        with stages.stage(name, pages=len(jobs)):
+            for kind, key in jobs:
+                extract.renderPage(kind, key)
+            flushOutput()
+
+    with stages.stage('summaries'):
+        genHistograms(threads, outputdir, code_counts, project_title)
+        genCooccurrenceHTML(cooccurrences, outputdir, project_title)
+        genCodeCounts(code_counts, outputdir)
+        genCooccurrenceCSV(cooccurrences, outputdir)
+        genIndex(threads, outputdir, code_counts, project_title)
+
+    with stages.stage('csv'):
+        extract.genCSVs(threads, outputdir, codes, threads, outputdir + '/csv/master.csv')
+        closeOutput()
+
+    output_files = 0
+    output_bytes = 0
+    for directory, subdirectories, filenames in os.walk(outputdir):
+        output_files += len(filenames)
+        output_bytes += sum(os.path.getsize(os.path.join(directory, filename)) for filename in filenames)
+
+    return {
+        'config': {key: args[key] for key in ('codes', 'interviews', 'quotes', 'codes_per_quote', 'misspell_rate', 'seed')},
+        'writers': args['writers'],
+        'python': platform.python_version(),
+        'numpy': importlib.util.find_spec('numpy') is not None,
+        'scipy': importlib.util.find_spec('scipy') is not None,
+        'tool_version': extract.toolVersion(),
+        'quotes': num_quotes,
+        'corrections': len(corrections),
+        'stages': stages.results,
+        'total_seconds': round(sum(result['seconds'] for result in stages.results), 4),
+        'peak_memory_kb': peak_memory_kb(),
+        'output_files': output_files,
+        'output_bytes': output_bytes,
+    }
+
+
+def compare(report, old_report):
+    """ Prints each stage's time in report against old_report's """
+    old_stages = {result['stage']: result for result in old_report['stages']}
+    if old_report['config'] != report['config']:
+        print('\nwarning: the reports were run on different corpora')
+    print('\n{:<20} {:>10} {:>10} {:>8}'.format('stage', 'old (s)', 'new (s)', 'ratio'))
+    rows = [(result['stage'], old_stages.get(result['stage'], {}).get('seconds'), result['seconds']) for result in report['stages']]
+    rows.append(('total', old_report['total_seconds'], report['total_seconds']))
+    for stage, old, new in rows:
+        if old is None:
+            print('{:<20} {:>10} {:>10.3f}'.format(stage, '-', new))
+        else:
+            print('{:<20} {:>10.3f} {:>10.3f} {:>7.2f}x'.format(stage, old, new, old / new if new > 0 else float('inf')))
+    print('peak memory: {} KB -> {} KB'.format(old_report['peak_memory_kb'], report['peak_memory_kb']))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Time every stage of the pipeline on a synthetic corpus.')
+    parser.add_argument('-c', '--codes', type=int, default=100, help="codes in the codebook (default: 100)")
+    parser.add_argument('-n', '--interviews', type=int, default=50, help="number of interviews (default: 50)")
+    parser.add_argument('-q', '--quotes', type=int, default=500, help="quotes per interview (default: 500)")
+    parser.add_argument('--codes-per-quote', type=int, default=3, help="most codes tagged on a quote (default: 3)")
+    parser.add_argument('--misspell-rate', type=float, default=0.05, help="fraction of tags misspelled, for reformat.py to correct (default: 0.05)")
+    parser.add_argument('--seed', type=int, default=0, help="seed for the corpus (default: 0)")
+    parser.add_argument('-w', '--writers', type=int, default=0, help="number of background threads writing the pages out, as code-extract.py -w (default: 0)")
+    parser.add_argument('-o', '--output', type=str, default='benchmark.json', help="where to write the JSON report (default: benchmark.json)")
+    parser.add_argument('--keep', type=str, help="write the corpus and output to this directory and keep them, instead of a temporary one")
+    parser.add_argument('--compare', type=str, help="an earlier JSON report to compare this run against")
+    args = vars(parser.parse_args())
+
+    if args['keep']:
+        if os.path.exists(args['keep']):
+            parser.error('{} already exists'.format(args['keep']))
+        os.makedirs(args['keep'])
+        report = run(args, args['keep'])
+    else:
+        with tempfile.TemporaryDirectory() as work_dir:
+            report = run(args, work_dir)
+
+    with open(args['output'], 'w') as outfile:
+        json.dump(report, outfile, indent=1)
+    print('{} quotes, {:.3f}s in total, peak memory {} KB. Report written to {}'.format(
+        report['quotes'], report['total_seconds'], report['peak_memory_kb'], args['output']))
+
+    if args['compare']:
+        with open(args['compare']) as old_file:
+            compare(report, json.load(old_file))
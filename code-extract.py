@@ -7,7 +7,7 @@ if sys.version_info[0] != 3:
 
 # Some simple code to parse CSV files from coding.
 # Usage is:
-#    code-extract.py [update] outputdir codebook.csv [master.csv] [transcript1.csv transcript2.csv ...]
+#    code-extract.py [-u master.csv] project outputdir codebook.csv [transcript1.csv transcript2.csv ...]
 #
 # update is optional, and specifies that the transcripts are already processed by code-extract.py previously. This will regenerate
 # output HTML and CSVs by updating based on the CSVs included. All CSVs should be included if one wants to update.
@@ -34,16 +34,47 @@ if sys.version_info[0] != 3:
 
 
 import os
-import errno
 import csv
+import hashlib
+import json
 import argparse
-from collections import namedtuple, defaultdict
+import io
+import shutil
+import tempfile
+import time
+from array import array
+from bisect import bisect_right
+from collections import namedtuple, defaultdict, Counter
 import markup
 import operator
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
 
-from util import urlSafe, stripQuotesSpace, mergeCodes
-from generators import genIndex, genHistograms, genCodeHTML, genCodeCounts, genCodeCSV, genCodePerTransHTML, genHeaderMenu, genPosterHTML, genStylesheet
+import profiling
+from incidence import Incidence
+from output import openOutput, setSink, flushOutput, closeOutput, takeOutput, replayOutput, ThreadedSink, ArchiveSink, CollectingSink
+from profiling import profiled
+from spill import SortedRuns, RowReader
+from store import DatasetStore
+from util import urlSafe, stripQuotesSpace, mergeCodes, CodeMatcher, CodeCorrections, codebookHash, Interner
+from generators import genIndex, genHistograms, genCodeHTML, genCodeCounts, genCodeCSV, genCSVs, genCodePerTransHTML, genHeaderMenu, genPosterHTML, genStylesheet, genAppBundle, genCooccurrenceHTML, genCooccurrenceCSV, genSearchIndex, removeSearchIndex, setSearchLink, paginate, pageFileBase, genPageLinks, removeExtraPages
+
+
+# The build manifest is kept here in the output directory, for incremental builds
+MANIFEST = 'manifest.json'
+
+# Archive builds pack their pages into this file in the output directory, named with the format as its extension
+ARCHIVE = 'site'
+
+# The SQLite store that --store keeps the dataset in, in place of csv/master.csv
+MASTER_DB = 'master.db'
+
+# Source files whose contents make up the tool version recorded in the manifest
+TOOL_SOURCES = ['code-extract.py', 'generators.py', 'incidence.py', 'markup.py', 'search.py', 'spill.py', 'store.py', 'util.py']
+
+# Codes and speakers are interned here, so that posts only hold integer ids
+CODE_IDS = Interner()
+SPEAKER_IDS = Interner()
 
 
 ################################################################################
@@ -55,20 +86,37 @@ class Post(object):
       Attributes:
         thread <Thread>: the thread in which the post is contained
         postID <int>: the ID of the post within the thread, used for internal linking
-        poster <Post>: the person who posted
+        poster <str>: the person who posted, stored as an id in SPEAKER_IDS
         text <str>: the actual content of the post
-        note <str>: any special markers made during coding
-        codes <list>: list of codes
+        codes <tuple>: tuple of codes, stored as a shared tuple of ids in CODE_IDS
   """
 
-  def __init__(self, thread, postID, poster=' ', text=' ', codes=[]):
+  __slots__ = ('thread', 'postID', 'posterId', 'text', 'codeIds')
+
+  def __init__(self, thread, postID, poster=' ', text=' ', codes=()):
     """ Returns a Post object """
 
     self.thread = thread
     self.postID = postID
     self.poster = poster
     self.text = text
-    self.codes = codes  # Should be a tuple
+    self.codes = codes
+
+  @property
+  def poster(self):
+    return SPEAKER_IDS.strings[self.posterId]
+
+  @poster.setter
+  def poster(self, poster):
+    self.posterId = SPEAKER_IDS.id(poster)
+
+  @property
+  def codes(self):
+    return CODE_IDS.names(self.codeIds)
+
+  @codes.setter
+  def codes(self, codes):
+    self.codeIds = CODE_IDS.ids(codes)
 
   def printHTML(self, page, codeLinkTo='all' ):
     """ Prints a table row for a post """
@@ -79,7 +127,7 @@ class Post(object):
     page.a(self.poster, href="{}.html".format(urlSafe(self.poster)))
     page.td.close()
     page.td( )
-    page.a( self.text, href=self.thread.outFileBase + '.html#' + str(self.postID) )
+    page.a( self.text, href=self.thread.postPage(self) + '.html#' + str(self.postID) )
     page.td.close()
     page.td(  )
     for i, code in enumerate(self.codes):
@@ -107,14 +155,18 @@ class Thread(object):
       Attributes:
         title <str>: the title of the thread
         posts <list>: a list of triples: (note, post, codes)
+        pageSize <int>: the number of posts per HTML page, 0 to put them all on one page
   """
 
-  def __init__(self, title, outFileDir ):
+  __slots__ = ('title', 'outFileDir', 'outFileBase', 'pageSize', 'posts', 'codeHistogram')
+
+  def __init__(self, title, outFileDir, pageSize=0 ):
     """ Returns a Thread object whose title is title, whose output files have path prefix outFileDir, and whose basename should be outFileBase """
 
     self.title = urlSafe(title)
     self.outFileDir = outFileDir
     self.outFileBase = urlSafe(title)
+    self.pageSize = pageSize
     self.posts = []
     self.codeHistogram = defaultdict(int)
 
@@ -123,46 +175,55 @@ class Thread(object):
 
     self.posts.append(post)
 
+  def postPage(self, post):
+    """ Returns the basename of the HTML page of this thread that post is on. Posts are numbered from 1 within the thread """
+
+    if( self.pageSize <= 0 ):
+      return self.outFileBase
+    return pageFileBase( self.outFileBase, (int(post.postID) - 1) // self.pageSize + 1 )
+
+  @profiled
   def toHTML(self):
-    """ Prints HTML for this thread to a file in output directory """
-    filename = "{}/html/{}.html".format(self.outFileDir, self.outFileBase)
-    print('writing interview: ', filename)
-    with open( filename, 'w' ) as outFile:   # Should be of form, e.g., Johnson.html
-      header = self.outFileBase
-      page = markup.page()
-      page = genHeaderMenu(page, header)
+    """ Prints HTML for this thread to a file in output directory, split into pages of pageSize posts """
+    pages = paginate( self.posts, self.pageSize )
+    for pageNumber, pagePosts in enumerate(pages, 1):
+      filename = "{}/html/{}.html".format(self.outFileDir, pageFileBase(self.outFileBase, pageNumber))
+      print('writing interview: ', filename)
+      with openOutput( filename, 'w' ) as outFile:   # Should be of form, e.g., Johnson.html
+        header = self.outFileBase
+        page = markup.page(stream=outFile)
+        page = genHeaderMenu(page, header)
+
+        page.div(class_="num_posts")
+        page.add("quotes={}".format(len(self.posts)))
+        page.div.close()
 
-      page.div(class_="num_posts")
-      page.add("quotes={}".format(len(self.posts)))
-      page.div.close()
+        genPageLinks( page, self.outFileBase, pageNumber, len(pages) )
 
-      page.table( style="width: 100%" )
+        page.table( style="width: 100%" )
 
-      page.tr(class_="table-header")
-      page.th('speaker')
-      page.th('quote')
-      page.th('codes')
-      page.tr.close()
+        page.tr(class_="table-header")
+        page.th('speaker')
+        page.th('quote')
+        page.th('codes')
+        page.tr.close()
 
-      for post in self.posts:
-        post.printHTML(page, 'this_interview')
+        for post in pagePosts:
+          post.printHTML(page, 'this_interview')
 
-      page.table.close()
+        page.table.close()
 
-      #outFile.write( unicode(page, encoding='utf-8') )
-      outFile.write( str(page) )
+        genPageLinks( page, self.outFileBase, pageNumber, len(pages) )
+
+        #outFile.write( unicode(page, encoding='utf-8') )
+        page.finish()
+
+    removeExtraPages( self.outFileDir, self.outFileBase, len(pages) )
 
   def toCSV(self):
-    """ Prints CSV for this interview to a file in output directory """
+    """ Prints CSV for this interview to a file in output directory. Builds write these along with the other CSVs, in genCSVs """
 
-    with open( self.outFileDir + '/csv/' + self.outFileBase + '.csv', 'w' ) as outFile:   # Should be of form, e.g.,  Johnson.html
-      fields = ['interview','postID','poster','text','code']
-      writer = csv.writer( outFile, dialect='excel' )
-      writer.writerow(fields)
-      for post in self.posts:
-        row = [post.name, post.postID, post.poster, post.text]
-        row.extend(post.codes)
-        writer.writerow(row)
+    genCSVs( [self], self.outFileDir, csvThreads=[self] )   # Should be of form, e.g.,  interviews/Johnson.csv
 
 ################################################################################
 # Class Poster
@@ -180,6 +241,8 @@ class Poster(object):
           }
   """
 
+  __slots__ = ('name', 'threads', 'posts', 'codes')
+
   def __init__(self, name=' '):
     """ Returns a Poster object """
     self.name = name
@@ -199,26 +262,12 @@ class Poster(object):
 
 
 ################################################################################
-# Generate and read master CSVs. These contain all posts from all posts
-# previously processed
+# Read master CSVs. These contain all posts from all posts previously
+# processed, and are written by genCSVs along with the other CSVs
 ################################################################################
 
-def genMasterCSV( masterFilename, threads ):
-  """ Generates a single CSV with all posts from all threads """
-
-  with open(masterFilename, 'w') as outFile:
-    fields = ['threadTitle', 'postID', 'poster', 'text']
-    writer = csv.writer(outFile, dialect='excel')
-    writer.writerow(fields)
-    for thread in threads:
-      for post in thread.posts:
-        row = [thread.title, post.postID, post.poster, post.text]
-        row.extend(post.codes)
-        writer.writerow(row)
-
-
 def readMasterCSV( masterFilename, outputdir ):
-  """ Reads master CSV in to initiate update. TODO """
+  """ Reads master CSV in to initiate update. Returns {thread title: Thread}, in the order the threads were written """
 
   with open(masterFilename, 'r') as inFile:
     threads = {}
@@ -231,119 +280,976 @@ def readMasterCSV( masterFilename, outputdir ):
         threads[threadTitle] = Thread( threadTitle, outputdir )
 
       if 'codes' in row:
-        post = Post( threads[threadTitle], row['postID'], row['poster'], row['text'], row['codes'] )
+        post = Post( threads[threadTitle], int(row['postID']), row['poster'], row['text'], row['codes'] )
       else:
-        post = Post( threads[threadTitle], row['postID'], row['poster'], row['text'] )
+        post = Post( threads[threadTitle], int(row['postID']), row['poster'], row['text'] )
 
       threads[threadTitle].addPost( post )
 
     return threads
 
 
+@profiled
+def genMasterDB( masterFilename, threads, changed=None ):
+  """ Saves all posts from all threads to an SQLite store. If changed is given, only the posts of
+      those threads are rewritten and the others are assumed to be in the store already
+  """
+
+  with DatasetStore( masterFilename ) as dataset:
+    dataset.saveThreads( threads, changed )
+
+
+def readMasterDB( masterFilename, outputdir, titles=None ):
+  """ Reads the threads with the given titles, or all of them, from an SQLite store in the
+      same form as readMasterCSV
+  """
+
+  threads = {}
+  with DatasetStore( masterFilename ) as dataset:
+    for threadTitle, postID, poster, text, codes in dataset.threadRows( titles ):
+      if( threadTitle not in threads ):
+        threads[threadTitle] = Thread( threadTitle, outputdir )
+      threads[threadTitle].addPost( Post( threads[threadTitle], postID, poster, text, codes ) )
+  return threads
+
+
+@profiled
+def readMaster( masterFilename, outputdir, titles=None ):
+  """ Reads a master CSV, or an SQLite store if masterFilename ends in .db """
+
+  if( masterFilename.endswith('.db') ):
+    return readMasterDB( masterFilename, outputdir, titles )
+  return readMasterCSV( masterFilename, outputdir )
+
+
+@profiled
+def readCodePosts( dataset, code, outputdir, pageSize=0 ):
+  """ Loads just the posts tagged with code from an SQLite store, for rendering that code's pages.
+      Returns (threads, posts), where threads are stand-ins for the threads the posts are in, in
+      build order, whose codeHistogram only counts code
+  """
+
+  threads = {}
+  posts = []
+  for threadTitle, postID, poster, text, codes in dataset.codeRows( code ):
+    if( threadTitle not in threads ):
+      threads[threadTitle] = Thread( threadTitle, outputdir, pageSize )
+    thread = threads[threadTitle]
+    thread.codeHistogram[code] += codes.count(code)
+    post = Post( thread, postID, poster, text, codes )
+    thread.addPost( post )
+    posts.append( post )
+  return list(threads.values()), posts
+
+
+@profiled
+def readThreadPosts( dataset, title, outputdir, pageSize=0 ):
+  """ Loads just the thread titled title from an SQLite store, for rendering its pages """
+
+  thread = Thread( title, outputdir, pageSize )
+  for threadTitle, postID, poster, text, codes in dataset.threadRows( [title] ):
+    thread.addPost( Post( thread, postID, poster, text, codes ) )
+  return thread
+
+
+@profiled
+def readPosterPosts( dataset, name, outputdir, pageSize=0 ):
+  """ Loads just the posts of the poster called name from an SQLite store, for rendering their
+      pages. Returns the Poster, tallied post by post in build order as tallyThreads would. The
+      threads of its posts are stand-ins, like those of readCodePosts, holding only its posts
+  """
+
+  threads = {}
+  poster = Poster(name)
+  for threadTitle, postID, posterName, text, codes in dataset.speakerRows( name ):
+    if( threadTitle not in threads ):
+      threads[threadTitle] = Thread( threadTitle, outputdir, pageSize )
+    thread = threads[threadTitle]
+    post = Post( thread, postID, posterName, text, codes )
+    thread.addPost( post )
+    poster.addToPosts( post )
+    poster.addToThreads( thread.title )
+    poster.addToCodeCounts( post.codes )
+  return poster
+
+
 ################################################################################
 # Reading CSVs and generating internal data structures
 ################################################################################
-def readGeneratedCSVs( masterFilename, threads, codes, outputdir, codeCountsPerPoster ):
-  """ Reads in generated CSVs as output by genCodeCSV() TODO """
+def indexPosts( threads ):
+  """ Returns {(thread title, postID): post} for every post in threads """
+
+  return {(thread.title, int(post.postID)): post for thread in threads for post in thread.posts}
+
+
+def isPostCSV( filename ):
+  """ Returns whether filename is a CSV of posts as output by genCSVs(), a row per post starting
+      with its thread, postID, speaker and text, rather than one of the summary CSVs of a build
+  """
+
+  with open(filename, 'r') as inFile:
+    header = next(csv.reader( inFile, dialect='excel' ), [])
+  return len(header) >= 4 and header[1] == 'postID'
+
+
+@profiled
+def readGeneratedCSV( generatedCSV, postIndex, allCodes, allCodeCorrections, original ):
+  """ Applies the rows of a CSV as output by genCSVs() to the posts they
+      refer to, looked up in postIndex. A post appears in the CSV of every code it has, so a row
+      only counts as an edit if it differs from the post as it was in the master, which is
+      recorded in original, {post: (poster, text, codes)}, the first time a post is edited.
+  """
+
+  with open(generatedCSV, 'r') as transFile:
+    transReader = csv.DictReader( transFile, dialect='excel', fieldnames=['threadTitle','postID','poster','text'], restkey='codes' )
+    next(transReader)
+    for row in transReader:
+      try:
+        post = postIndex[(row['threadTitle'], int(row['postID']))]
+      except (KeyError, ValueError):
+        print("Error: couldn't find post {} of interview {} for entry in {}".format(row['postID'], row['threadTitle'], generatedCSV))
+        continue
+
+      codes = cleanCodes( row.get('codes', []), allCodes, allCodeCorrections, generatedCSV )
+      edit = (row['poster'], row['text'], tuple(codes))
+      before = original.get(post, (post.poster, post.text, post.codes))
+      if( edit == before ):
+        continue
+      if( post in original and edit != (post.poster, post.text, post.codes) ):
+        print("Warning: post {} of interview {} is edited more than once, using the entry in {}".format(row['postID'], row['threadTitle'], generatedCSV))
+      original[post] = before
+      post.poster, post.text, post.codes = edit
+
+
+def retallyPosts( original, threads, codeCounts, allPosters, codePosts ):
+  """ Moves edited posts from what they were to what they are now in codeCounts, the threads'
+      codeHistograms, the posters and the code -> posts index, touching only the aggregates that
+      involve them. original maps the edited posts to their (poster, text, codes) before the edit.
+      Returns (threads, codes, poster names) that changed, with threads in build order, and
+      {thread: codes it had before}.
+  """
+
+  threadOrder = {thread: i for i, thread in enumerate(threads)}
+  postOrder = lambda post: (threadOrder[post.thread], int(post.postID))
+  oldThreadCodes = {}
+  staleCodes = set()
+  postersGained = defaultdict(list)
+  codesGained = defaultdict(list)
+
+  for post, (oldPoster, oldText, oldCodes) in original.items():
+    thread = post.thread
+    if( thread not in oldThreadCodes ):
+      oldThreadCodes[thread] = set(thread.codeHistogram)
+    for code in oldCodes:
+      codeCounts[code]['posts'] -= 1
+      thread.codeHistogram[code] -= 1
+      if( thread.codeHistogram[code] == 0 ):
+        del thread.codeHistogram[code]
+    for code in post.codes:
+      codeCounts[code]['posts'] += 1
+      thread.codeHistogram[code] += 1
+    staleCodes.update(oldCodes)
+    staleCodes.update(post.codes)
+    for code in set(post.codes) - set(oldCodes):
+      codesGained[code].append( post )
+    postersGained[post.poster].append( post )
+    postersGained.setdefault(oldPoster, [])
+
+  # Rebuild the stale posters from the posts they keep and the ones they gained
+  stalePosters = set(postersGained)
+  for name, gained in postersGained.items():
+    kept = [post for post in allPosters[name].posts if post.poster == name and post not in original] if name in allPosters else []
+    poster = Poster(name)
+    for post in sorted(kept + gained, key=postOrder):
+      poster.addToPosts(post)
+      poster.addToThreads(post.thread.title)
+      poster.addToCodeCounts(post.codes)
+    if( poster.posts ):
+      allPosters[name] = poster
+    else:
+      allPosters.pop(name, None)
+
+  # Refill the sets of a stale code from its posts, in the order tallyThreads adds to them
+  for code in staleCodes:
+    codePosts[code] = sorted([post for post in codePosts[code] if code in post.codes] + codesGained[code], key=postOrder)
+    codeCounts[code]['posters'] = set(post.poster for post in codePosts[code])
+    codeCounts[code]['threads'] = set(post.thread.title for post in codePosts[code])
+
+  changedThreads = sorted(oldThreadCodes, key=threadOrder.get)
+  addCollidingThreads( changedThreads, threads, stalePosters )
+  return changedThreads, staleCodes, stalePosters, oldThreadCodes
 
-  threads = readMasterCSV(masterFilename, outputdir)
 
-  # numInterviews = 0
-  # numQuotes = 0
-  # lastPerson = ''
+def recodeThreads( threads, allCodes, allCodeCorrections, masterFilename ):
+  """ Merges the codes of the posts of threads read from a master into the codebook, as the codes
+      of edited rows are, in case it has dropped codes since the master was written. Returns
+      {thread: codes it had before}, for the threads that had codes that aren't in it
+  """
+
+  oldThreadCodes = {}
   for thread in threads:
-    with open(thread,'r') as transFile:
-      # Read in thread, populate new Interview object and codeDict
-      #transReader = unicodecsv.reader( transFile, dialect='excel', encoding='utf-8' )
-      transReader = csv.DictReader( transFile, dialect='excel', fieldnames=['threadTitle','postID','poster','text'], restkey='codes' )
-      next(transReader)
-      for row in transReader:
-        threadTitle = row['threadTitle']
-        if( threadTitle not in threads ):
-          print("Error: couldn't find interview {} for entry in {}".format(threadTitle, thread.title))
-        else:
-          # Find post within thread
-          found = False
-          for post in threads[threadTitle].posts:
-            if( post.postID == row['postID'] ):
-              found = True
-              post.poster = row['poster']
-              post.text = row['text']
-              if( 'codes' in row ):
-                post.codes = row['codes']
-              else:
-                post.codes = []
-          if( not found ):
-            print("Error: couldn't find post " + row['postID'] + " for entry in " + thread.title)
-
-  threadList = sorted(threads.values(), key=lambda x: x.title)
-
-  return threadList
-
-
-def readOriginalCSVs( originalCSVs, allCodes, outputdir, codeCounts ):
-  """ Reads in CSVs in their original post-Google spreadsheet form """
-
-  numThreads = 0
-  numPosts = 0
+    for post in thread.posts:
+      if( all(code in allCodes for code in post.codes) ):
+        continue
+      oldThreadCodes.setdefault(thread, set()).update(post.codes)
+      post.codes = cleanCodes( post.codes, allCodes, allCodeCorrections, masterFilename )
+  return oldThreadCodes
+
+
+def readGeneratedCSVs( masterFilename, generatedCSVs, allCodes, outputdir, codeCounts, allCodeCorrections=None ):
+  """ Reads in generated CSVs as output by genCSVs(), and updates the posts of the master CSV
+      or store with them. allCodes is a CodeMatcher over the codebook. Returns (threads,
+      codeCounts, posters, codePosts) like readOriginalCSVs, followed by what retallyPosts
+      returns for the posts that changed. If the master has codes the codebook doesn't, every
+      thread, code and poster is returned as changed.
+  """
+
+  if( allCodeCorrections is None ):
+    allCodeCorrections = CodeCorrections()
+  threads = list(readMaster( masterFilename, outputdir ).values())
+  recodedThreadCodes = recodeThreads( threads, allCodes, allCodeCorrections, masterFilename )
+  allPosters = {}
+  codePosts = defaultdict(list)
+  tallyThreads( threads, codeCounts, allPosters, codePosts )
+
+  postIndex = indexPosts( threads )
+  original = {}
+  for generatedCSV in generatedCSVs:
+    readGeneratedCSV( generatedCSV, postIndex, allCodes, allCodeCorrections, original )
+  print("Updating {} posts".format(len(original)))
+
+  changedThreads, staleCodes, stalePosters, oldThreadCodes = retallyPosts( original, threads, codeCounts, allPosters, codePosts )
+  # Every page may show a code that is gone from the codebook
+  if( recodedThreadCodes ):
+    print("The master has codes that aren't in the codebook, regenerating every page")
+    for thread, codes in recodedThreadCodes.items():
+      oldThreadCodes.setdefault(thread, set()).update(codes)
+    changedThreads = list(threads)
+    staleCodes = set(codeCounts)
+    stalePosters = stalePosters | set(allPosters)
+
+  return (threads, codeCounts, allPosters, codePosts, changedThreads, staleCodes, stalePosters, oldThreadCodes)
+
+
+def indexCodePosts( threads ):
+  """ Builds the code -> posts index consumed by the per-code generators.
+
+      Posts are listed in thread order, then post order, and each post appears at
+      most once per code. The thread of each entry is available as post.thread.
+  """
+
+  codePosts = defaultdict(list)
+  for thread in threads:
+    for post in thread.posts:
+      for code in set(post.codes):
+        codePosts[code].append( post )
+  return codePosts
+
+
+def cleanCodes( post_codes, allCodes, allCodeCorrections, fileName ):
+  """ Returns the codes of a post with blanks dropped and unrecognized codes merged into the codebook """
+
+  strippedCodes = []
+  for code in post_codes:
+    strippedCode = urlSafe(stripQuotesSpace( code ))
+    if( strippedCode == '' ):
+      continue
+    if( strippedCode not in allCodes):
+      correctedCode, allCodeCorrections = mergeCodes( strippedCode, allCodes, allCodeCorrections, skip=True ) #set skip to false to correct codes to nearest code by edit distance
+      if( correctedCode == '' ):
+        print("Skipping unrecognized code in '" + strippedCode + "' in file " + fileName + " that could not be merged")
+        continue
+      strippedCode = correctedCode
+    strippedCodes.append( strippedCode )
+  return strippedCodes
+
+
+@profiled
+def readOriginalCSV( originalCSV, allCodes, outputdir, allCodeCorrections ):
+  """ Reads a single CSV in its original post-Google spreadsheet form into a new Thread. Posts
+      are numbered from 1 within the thread, so a thread's postIDs don't depend on the other
+      transcripts in the build. Counting is left to tallyThreads.
+  """
+
+  with open(originalCSV, 'r') as transFile:
+    threadFileName = os.path.splitext(os.path.basename(originalCSV))[0]
+
+    # Read in thread, populate new Thread object
+    thread = Thread(threadFileName, outputdir)
+    numPosts = 0
+
+    for line in transFile:
+      # Our reformatted threads have the format:
+      # speaker =DELIM= utterance =DELIM= tag, tag, tag, ...
+      (poster, text, tags) = line.split('=DELIM=')
+      if (text != ''):
+        numPosts += 1
+
+        # Process post codes
+        strippedCodes = cleanCodes( tags.split(', '), allCodes, allCodeCorrections, thread.title )
+
+        post = Post(thread, numPosts, poster, text, strippedCodes)
+        thread.addPost(post)
+
+  return thread
+
+
+@profiled
+def tallyThreads( threads, codeCounts, allPosters, codePosts ):
+  """ Adds the posts of parsed threads to codeCounts, the threads' codeHistograms, the posters and
+      the code -> posts index. The counts are reductions of the post x code incidence matrix of
+      all the posts at once; see incidence.py
+  """
+
+  incidence = Incidence( threads )
+  posts = [post for thread in threads for post in thread.posts]
+  entryThread = incidence.entries( incidence.postThread )
+  entrySpeaker = incidence.entries( incidence.postSpeaker )
+  codeNames = CODE_IDS.strings
+  speakerNames = SPEAKER_IDS.strings
+
+  # Posters are created in the order they first speak
+  for speaker, count in incidence.counts( incidence.postSpeaker ):
+    if( speakerNames[speaker] not in allPosters ):
+      allPosters[speakerNames[speaker]] = Poster(speakerNames[speaker])
+  for post in posts:
+    allPosters[post.poster].addToPosts(post)
+  for speaker, thread, count in incidence.pairCounts( incidence.postSpeaker, incidence.postThread ):
+    allPosters[speakerNames[speaker]].addToThreads(threads[thread].title)
+  # A pair first appears at the same entry whichever way round it is counted, so each of these
+  # also fills the code's sets in the order a post by post tally would
+  for speaker, code, count in incidence.pairCounts( entrySpeaker, incidence.entryCode ):
+    allPosters[speakerNames[speaker]].codes[codeNames[code]] += count
+    # Add the poster to the set of people who have said something with this code
+    codeCounts[codeNames[code]]['posters'].add( speakerNames[speaker] )
+  for thread, code, count in incidence.pairCounts( entryThread, incidence.entryCode ):
+    # Add this code to the thread's code histogram
+    threads[thread].codeHistogram[codeNames[code]] += count
+    # Add the thread to the set of threads that have used this code
+    codeCounts[codeNames[code]]['threads'].add( threads[thread].title )
+
+  for code, count in incidence.counts( incidence.entryCode ):
+    # Increment the counter of posts with this code
+    codeCounts[codeNames[code]]['posts'] += count
+  for code, post, count in incidence.pairCounts( incidence.entryCode, incidence.entryPost ):
+    codePosts[codeNames[code]].append( posts[post] )
+
+
+@profiled
+def countCooccurrences( threads, codes ):
+  """ Counts the pairs of codes that appear together on a quote, and in an interview, from the
+      post x code incidence matrix. Returns [(code, other code, # quotes with both, # interviews
+      with both)] for every pair that shares an interview, with code before other code in the
+      codebook, and the pairs sharing the most quotes first.
+  """
+
+  incidence = Incidence( threads )
+  quotes = incidence.cooccurrence( incidence.entryPost )
+  interviews = incidence.cooccurrence( incidence.entries( incidence.postThread ) )
+  return listCooccurrences( quotes, interviews, codes )
+
+
+def listCooccurrences( quotes, interviews, codes ):
+  """ Returns the list countCooccurrences does from the pair counts of Incidence.cooccurrence,
+      {(code id, other code id): count}, over quotes and over interviews
+  """
+
+  # Codes sharing a quote share its interview too
+  codeOrder = {code: i for i, code in enumerate(codes)}
+  codeNames = CODE_IDS.strings
+  cooccurrences = []
+  for pair, interviewCount in interviews.items():
+    code, other = sorted((codeNames[pair[0]], codeNames[pair[1]]), key=codeOrder.get)
+    cooccurrences.append( (code, other, quotes.get(pair, 0), interviewCount) )
+  cooccurrences.sort( key=lambda row: (-row[2], -row[3], codeOrder[row[0]], codeOrder[row[1]]) )
+  return cooccurrences
+
+
+def readOriginalCSVs( originalCSVs, allCodes, outputdir, codeCounts, allCodeCorrections=None, knownThreads=None ):
+  """ Reads in CSVs in their original post-Google spreadsheet form. allCodes is a CodeMatcher
+      over the codebook, and allCodeCorrections the CodeCorrections to merge unrecognized codes
+      with. Also returns the code -> posts index (see indexCodePosts) built as posts are read.
+
+      knownThreads optionally maps CSVs that don't need re-reading to their already parsed
+      Thread, for incremental builds.
+  """
+
   threads = []
-  allCodeCorrections = {}
+  if( allCodeCorrections is None ):
+    allCodeCorrections = CodeCorrections()
+  if( knownThreads is None ):
+    knownThreads = {}
   allPosters = {}
+  codePosts = defaultdict(list)
 
   for originalCSV in originalCSVs:
-    with open(originalCSV, 'r') as transFile:
-      threadFileName = os.path.splitext(os.path.basename(originalCSV))[0]
-
-      # Read in thread, populate new Thread object
-      numThreads += 1
-      thread = Thread(threadFileName, outputdir)
-
-      for line in transFile:
-        # Our reformatted threads have the format:
-        # speaker =DELIM= utterance =DELIM= tag, tag, tag, ...
-        (poster, text, tags) = line.split('=DELIM=')
-        if (text != ''):
-          numPosts += 1
-
-          # Process post codes
-          post_codes = tags.split(', ')
-          strippedCodes = []
-          for code in post_codes:
-            strippedCode = urlSafe(stripQuotesSpace( code ))
-            if( strippedCode == '' ):
-              continue
-            if( strippedCode not in allCodes):
-              correctedCode, allCodeCorrections = mergeCodes( strippedCode, allCodes, allCodeCorrections, skip=True ) #set skip to false to correct codes to nearest code by edit distance
-              if( correctedCode == '' ):
-                print("Skipping unrecognized code in '" + strippedCode + "' in file " + thread.title + " that could not be merged")
-                continue
-              strippedCode = correctedCode
-            strippedCodes.append( strippedCode )
-            # Add the poster to the set of people who have said something with this code
-            codeCounts[strippedCode]['posters'].add( poster )
-            # Add the thread to the set of threads that have used this code
-            codeCounts[strippedCode]['threads'].add( thread.title )
-            # Increment the counter of posts with this code
-            codeCounts[strippedCode]['posts'] += 1
-            # Add this code to the thread's code histogram
-            thread.codeHistogram[strippedCode] += 1
-
-          post = Post(thread, numPosts, poster, text, strippedCodes)
-          thread.addPost(post)
-
-          # Process poster
-          if poster not in allPosters:
-            allPosters[poster] = Poster(poster)
-
-          allPosters[poster].addToPosts(post)
-          allPosters[poster].addToThreads(thread.title)
-          allPosters[poster].addToCodeCounts(strippedCodes)
-
-      threads.append(thread)
-
-    transFile.close()
-
-  return threads, codeCounts, allPosters
+    if( originalCSV in knownThreads ):
+      thread = knownThreads[originalCSV]
+    else:
+      thread = readOriginalCSV( originalCSV, allCodes, outputdir, allCodeCorrections )
+    threads.append(thread)
+  tallyThreads( threads, codeCounts, allPosters, codePosts )
+
+  return threads, codeCounts, allPosters, codePosts
+
+
+################################################################################
+# Streamed builds, for corpora whose posts don't fit in memory. Transcripts are
+# read and tallied one at a time, their posts written straight to the master
+# CSV and then only kept as the offsets of their rows in it, spilled to disk
+# under their codes and speaker. Pages read their posts back from the master
+################################################################################
+
+class PostRows(object):
+  """ A read-only sequence of the posts whose rows start at offsets in the master CSV of a
+      streamed build. Posts are read back as the sequence is iterated, and slicing it gives
+      another PostRows, so that only the posts of the page being written are in memory.
+
+      Attributes:
+        corpus <StreamedCorpus>: the build the posts belong to
+        offsets <array int>: the byte offsets of the posts' rows, in increasing order
+  """
+
+  __slots__ = ('corpus', 'offsets')
+
+  def __init__( self, corpus, offsets ):
+    self.corpus = corpus
+    self.offsets = offsets
+
+  def __len__( self ):
+    return len(self.offsets)
+
+  def __getitem__( self, index ):
+    if( isinstance(index, slice) ):
+      return PostRows( self.corpus, self.offsets[index] )
+    return self.corpus.post( self.offsets[index] )
+
+  def __iter__( self ):
+    for offset in self.offsets:
+      yield self.corpus.post( offset )
+
+
+class StreamedCorpus(object):
+  """ What a streamed build keeps of its posts once they have been read and tallied.
+
+      Attributes:
+        masterFilename <str>: the master CSV the posts were written to
+        threads <list Thread>: the threads, in build order, whose posts are PostRows
+        threadStarts <array int>: the offset of the first row of each thread in the master CSV
+        codeRuns <SortedRuns>: (code id, offset) of the row of each post, for each of its codes
+        speakerRuns <SortedRuns>: (speaker id, offset) of the row of each post
+        quotePairs <Counter>: {(code id, other code id): # quotes with both}
+        interviewPairs <Counter>: {(code id, other code id): # interviews with both}
+  """
+
+  def __init__( self, masterFilename, spillDir, budget ):
+    """ Spills post offsets to spillDir, keeping up to budget bytes of them in memory """
+
+    self.masterFilename = masterFilename
+    self.spillDir = spillDir
+    self.threads = []
+    self.threadStarts = array( 'q' )
+    self.codeRuns = SortedRuns( spillDir, budget // 2, 'codes' )
+    self.speakerRuns = SortedRuns( spillDir, budget // 2, 'speakers' )
+    self.quotePairs = Counter()
+    self.interviewPairs = Counter()
+    self._rows = None
+
+  def posts( self, offsets ):
+    return PostRows( self, offsets )
+
+  def post( self, offset ):
+    """ Reads back the post whose row starts at offset """
+
+    if( self._rows is None ):
+      self._rows = RowReader( self.masterFilename )
+    row = self._rows.row( offset )
+    thread = self.threads[bisect_right( self.threadStarts, offset ) - 1]
+    return Post( thread, int(row[1]), row[2], row[3], row[4:] )
+
+  def close( self ):
+    """ Deletes the spilled runs """
+
+    if( self._rows is not None ):
+      self._rows.close()
+    self.codeRuns.remove()
+    self.speakerRuns.remove()
+    shutil.rmtree( self.spillDir, ignore_errors=True )
+
+
+def streamOriginalCSVs( originalCSVs, allCodes, outputdir, codeCounts, allCodeCorrections, masterFilename, budget ):
+  """ Reads in CSVs in their original post-Google spreadsheet form like readOriginalCSVs, but one
+      at a time, writing their posts to the master CSV as it goes. Once a thread is tallied, its
+      posts are only kept as the offsets of their rows, with at most budget bytes of them in memory
+      and the rest spilled to a directory in outputdir. Returns threads, codeCounts, allPosters,
+      whose posts are left empty, and the StreamedCorpus of the posts
+  """
+
+  corpus = StreamedCorpus( masterFilename, tempfile.mkdtemp( prefix='spill-', dir=outputdir ), budget )
+  threads = corpus.threads
+  allPosters = {}
+
+  try:
+    with open(masterFilename, 'wb') as masterFile:
+      # Rows are written as genCSVs writes them, but as bytes so that their offsets are known
+      rowBuffer = io.StringIO()
+      writer = csv.writer( rowBuffer, dialect='excel' )
+      def writeRow( row ):
+        rowBuffer.seek( 0 )
+        rowBuffer.truncate()
+        writer.writerow( row )
+        masterFile.write( rowBuffer.getvalue().encode('utf-8') )
+
+      writeRow( ['threadTitle', 'postID', 'poster', 'text'] )
+      for originalCSV in originalCSVs:
+        thread = readOriginalCSV( originalCSV, allCodes, outputdir, allCodeCorrections )
+        threadCodePosts = defaultdict(list)
+        tallyThreads( [thread], codeCounts, allPosters, threadCodePosts )
+        incidence = Incidence( [thread] )
+        corpus.quotePairs.update( incidence.cooccurrence( incidence.entryPost ) )
+        corpus.interviewPairs.update( incidence.cooccurrence( incidence.entries( incidence.postThread ) ) )
+
+        corpus.threadStarts.append( masterFile.tell() )
+        offsets = array( 'q' )
+        for post in thread.posts:
+          offsets.append( masterFile.tell() )
+          corpus.speakerRuns.add( post.posterId, offsets[-1] )
+          row = [thread.title, post.postID, post.poster, post.text]
+          row.extend(post.codes)
+          writeRow( row )
+        postOffsets = dict(zip( thread.posts, offsets ))
+        for code, posts in threadCodePosts.items():
+          for post in posts:
+            corpus.codeRuns.add( CODE_IDS.id(code), postOffsets[post] )
+
+        # Let go of the posts
+        for poster in allPosters.values():
+          poster.posts = []
+        thread.posts = corpus.posts( offsets )
+        threads.append( thread )
+  except BaseException:
+    # Nothing is left to delete the spilled runs if they aren't handed back
+    corpus.close()
+    raise
+
+  return threads, codeCounts, allPosters, corpus
+
+
+################################################################################
+# Build manifests. These record what each transcript contributed to the last
+# build so that incremental builds only re-render the pages that depend on the
+# transcripts that changed
+################################################################################
+
+def hashFile( filename ):
+  """ Returns a SHA-256 hex digest of a file's contents, so edits that keep its size and mtime still count as changes """
+
+  digest = hashlib.sha256()
+  with open(filename, 'rb') as inFile:
+    for block in iter(lambda: inFile.read(1 << 16), b''):
+      digest.update(block)
+  return digest.hexdigest()
+
+
+def toolVersion():
+  """ Returns a hex digest of the source files that shape the output, so that any change to them forces a full rebuild """
+
+  toolDir = os.path.dirname(os.path.abspath(__file__))
+  digest = hashlib.sha256()
+  for source in TOOL_SOURCES:
+    digest.update(source.encode('utf-8'))
+    with open(os.path.join(toolDir, source), 'rb') as sourceFile:
+      digest.update(sourceFile.read())
+  return digest.hexdigest()
+
+
+def makeManifest( project_title, codebookKey, pageSize, originalCSVs, transcriptHashes, threads ):
+  """ Returns the manifest for a build. threads are in the same order as originalCSVs """
+
+  transcripts = {}
+  for originalCSV, thread in zip(originalCSVs, threads):
+    transcripts[originalCSV] = {
+      'hash': transcriptHashes[originalCSV],
+      'thread': thread.title,
+      'codes': sorted(thread.codeHistogram),
+      'posters': sorted(set(post.poster for post in thread.posts)),
+    }
+
+  return {
+    'version': toolVersion(),
+    'project': project_title,
+    'codebook': codebookKey,
+    'pageSize': pageSize,
+    'transcripts': transcripts,
+  }
+
+
+def writeManifest( manifestFilename, manifest ):
+  """ Writes manifest in place of the last one in one step, so it is never left half written """
+  tempFilename = manifestFilename + '.tmp'
+  with open(tempFilename, 'w') as outFile:
+    json.dump(manifest, outFile, indent=1, sort_keys=True)
+  os.replace( tempFilename, manifestFilename )
+
+
+def removeManifest( manifestFilename ):
+  """ Deletes the manifest of the last build once this one starts changing its output, so that
+      if this build doesn't finish, the next incremental build doesn't trust the pages it left
+  """
+  if( os.path.exists(manifestFilename) ):
+    os.remove( manifestFilename )
+
+
+def refreshManifest( manifestFilename, threads ):
+  """ Returns the manifest of the last build, with the codes and posters it lists for each
+      transcript brought up to date with threads after an update, so that a later incremental
+      build knows which pages they are on. Returns None if there is no manifest
+  """
+
+  manifest = readManifest( manifestFilename )
+  if( manifest is None ):
+    return None
+  threadsByTitle = {thread.title: thread for thread in threads}
+  for entry in manifest['transcripts'].values():
+    thread = threadsByTitle.get(entry['thread'])
+    if( thread is not None ):
+      entry['codes'] = sorted(thread.codeHistogram)
+      entry['posters'] = sorted(set(post.poster for post in thread.posts))
+  return manifest
+
+
+def readManifest( manifestFilename ):
+  """ Returns the manifest of the last build, or None if there isn't a readable one """
+
+  try:
+    with open(manifestFilename, 'r') as inFile:
+      manifest = json.load(inFile)
+  except (OSError, ValueError):
+    return None
+  if( not isinstance(manifest, dict) or not isinstance(manifest.get('transcripts'), dict) ):
+    return None
+  return manifest
+
+
+def checkManifest( manifest, project_title, codebookKey, pageSize ):
+  """ Returns whether an incremental build can start from manifest, or if every page has to be regenerated """
+
+  if( manifest is None ):
+    print("No usable manifest from a previous build, doing a full build")
+    return False
+  if( manifest.get('version') != toolVersion() ):
+    print("The code has changed since the last build, doing a full build")
+    return False
+  if( manifest.get('project') != project_title or manifest.get('codebook') != codebookKey or manifest.get('pageSize') != pageSize ):
+    print("The project title, codebook or page size has changed since the last build, doing a full build")
+    return False
+  return True
+
+
+def readUnchangedThreads( manifest, transcriptHashes, masterFilename, outputdir ):
+  """ Loads the threads of transcripts whose contents haven't changed since the last build
+      from its master CSV or store, so they don't have to be parsed again. Returns
+      {transcript: Thread}, or None if the master CSV or store is missing.
+  """
+
+  if( not os.path.isfile(masterFilename) ):
+    print("No master CSV or store at {}, doing a full build".format(masterFilename))
+    return None
+
+  unchanged = {}
+  for originalCSV, transcriptHash in transcriptHashes.items():
+    entry = manifest['transcripts'].get(originalCSV)
+    if( entry is not None and entry['hash'] == transcriptHash ):
+      unchanged[originalCSV] = entry['thread']
+
+  # A store only has to load the unchanged threads
+  masterThreads = readMaster( masterFilename, outputdir, set(unchanged.values()) )
+  knownThreads = {}
+  for originalCSV, threadTitle in unchanged.items():
+    # Threads without any posts don't appear in the master CSV
+    knownThreads[originalCSV] = masterThreads.get(threadTitle, Thread(threadTitle, outputdir))
+  return knownThreads
+
+
+def findStalePages( manifest, originalCSVs, knownThreads, threads ):
+  """ Works out what an incremental build has to re-render: the threads that changed, and the
+      codes and posters that appear in either their old or their new version.
+      Returns (threads, codes, poster names), with threads in build order.
+  """
+
+  changedThreads = [thread for originalCSV, thread in zip(originalCSVs, threads) if originalCSV not in knownThreads]
+  staleCodes = set()
+  stalePosters = set()
+  for thread in changedThreads:
+    staleCodes.update(thread.codeHistogram)
+    stalePosters.update(post.poster for post in thread.posts)
+  for originalCSV, entry in manifest['transcripts'].items():
+    if( originalCSV not in knownThreads ):
+      staleCodes.update(entry['codes'])
+      stalePosters.update(entry['posters'])
+
+  addCollidingThreads( changedThreads, threads, stalePosters )
+  return changedThreads, staleCodes, stalePosters
+
+
+def addCollidingThreads( changedThreads, threads, stalePosters ):
+  """ A poster's codes page and a thread's page share a filename when the names match. Threads are
+      written after posters, so adds those threads to changedThreads, keeping it in build order, to
+      keep the page a full build would produce
+  """
+
+  staleUsernames = set(urlSafe(name) for name in stalePosters)
+  changedThreads.extend(thread for thread in threads if thread.outFileBase in staleUsernames and thread not in changedThreads)
+  changedThreads.sort(key=threads.index)
+
+
+def removeDeletedPages( manifest, originalCSVs, threads, posters, outputdir ):
+  """ Deletes the pages listed in the manifest of the last build that this build doesn't write:
+      those of transcripts and posters that are gone, along with the CSVs of those transcripts,
+      and the code-per-interview pages of codes an interview no longer uses
+  """
+
+  titles = set(thread.title for thread in threads)
+  currentThreads = dict(zip(originalCSVs, threads))
+  oldPosters = set()
+  deleted = []
+  for originalCSV, entry in manifest['transcripts'].items():
+    oldPosters.update(entry['posters'])
+    if( originalCSV not in currentThreads and entry['thread'] not in titles ):
+      deleted.append(entry['thread'] + '.html')
+      removeExtraPages( outputdir, entry['thread'], 1 )
+      try:
+        os.remove(outputdir + '/csv/interviews/' + entry['thread'] + '.csv')
+      except FileNotFoundError:
+        pass
+      deleted.extend(urlSafe(code) + '_' + entry['thread'] + '.html' for code in entry['codes'])
+    elif( originalCSV in currentThreads and currentThreads[originalCSV].title == entry['thread'] ):
+      codeHistogram = currentThreads[originalCSV].codeHistogram
+      deleted.extend(urlSafe(code) + '_' + entry['thread'] + '.html' for code in entry['codes'] if code not in codeHistogram)
+  removePages( outputdir, deleted )
+  removePosterPages( outputdir, oldPosters, posters )
+
+
+def removeUpdatedPages( oldThreadCodes, oldPosters, posters, outputdir ):
+  """ Deletes the pages an update doesn't write anymore: the code-per-interview pages of codes an
+      interview no longer uses, and the pages of posters that are gone
+  """
+
+  deleted = []
+  for thread, codes in oldThreadCodes.items():
+    deleted.extend(urlSafe(code) + '_' + thread.title + '.html' for code in codes if code not in thread.codeHistogram)
+  removePages( outputdir, deleted )
+  removePosterPages( outputdir, oldPosters, posters )
+
+
+def removePosterPages( outputdir, oldPosters, posters ):
+  """ Deletes the pages of the posters in oldPosters that aren't in posters """
+
+  deleted = []
+  for name in oldPosters:
+    if( name not in posters ):
+      username = urlSafe(name)
+      deleted.extend([username + '.html', username + '_interviews.html', username + '_quotes.html'])
+      removeExtraPages( outputdir, username + '_quotes', 1 )
+  removePages( outputdir, deleted )
+
+
+def removePages( outputdir, filenames ):
+  """ Deletes the given pages from the html output directory, if they exist """
+
+  for filename in filenames:
+    try:
+      os.remove(outputdir + '/html/' + filename)
+    except FileNotFoundError:
+      pass
+
+
+################################################################################
+# Page rendering. Pages are rendered in phases, in the order a serial build
+# writes them, so that pages sharing a filename end up the same either way.
+# Within a phase, pages are independent and can be spread over worker processes
+################################################################################
+
+# The model the pages are rendered from, set in each worker process by initRenderer
+renderState = {}
+
+
+def initRenderer( state ):
+  """ Sets the model for renderPage in this process """
+
+  renderState.update(state)
+  # Processes that don't fork from the one that read the posts need its ids
+  CODE_IDS.load( state['codeIds'] )
+  SPEAKER_IDS.load( state['speakerIds'] )
+
+
+def initWorker( state ):
+  """ Sets up a worker process to render pages, with writer threads of its own, or handing its
+      pages back to be packed when building an archive, and recording a profile of its own when
+      profiling
+  """
+
+  initRenderer( state )
+  if( state.get('archive') ):
+    setSink( CollectingSink() )
+  elif( state['writers'] > 0 ):
+    setSink( ThreadedSink( state['writers'] ) )
+  if( state.get('profile') ):
+    profiling.enable()
+
+
+def renderPage( kind, key ):
+  """ Renders one page job from renderState. key is a poster name, an index into the threads to
+      render, or a code. When renderState has a store, it only holds the titles of the threads to
+      render and no posters, and each page is rendered from just the posts of its code, thread or
+      poster queried from the store
+  """
+
+  state = renderState
+  if( 'store' in state and 'dataset' not in state ):
+    # Each process opens its own connection the first time it needs one
+    state['dataset'] = DatasetStore( state['store'] )
+  if( kind in ('code', 'codeCSV', 'codePerTrans') and 'store' in state ):
+    threads, codePosts = readCodePosts( state['dataset'], key, state['outputdir'], state['pageSize'] )
+    renderTitles = set(state['renderTitles'])
+    renderThreads = [thread for thread in threads if thread.title in renderTitles]
+  elif( kind in ('code', 'codeCSV', 'codePerTrans') ):
+    threads, codePosts, renderThreads = state['threads'], state['codePosts'][key], state['renderThreads']
+  elif( kind in ('thread', 'threadCSV') and 'store' in state ):
+    thread = readThreadPosts( state['dataset'], state['renderTitles'][key], state['outputdir'], state['pageSize'] )
+  elif( kind in ('thread', 'threadCSV') ):
+    thread = state['renderThreads'][key]
+
+  if( kind == 'poster' ):
+    if( 'store' in state ):
+      poster = readPosterPosts( state['dataset'], key, state['outputdir'], state['pageSize'] )
+    else:
+      poster = state['posters'][key]
+    genPosterHTML( {key: poster}, state['outputdir'], state['pageSize'] )
+  elif( kind == 'thread' ):
+    thread.toHTML()
+  elif( kind == 'threadCSV' ):
+    thread.toCSV()
+  elif( kind == 'code' ):
+    genCodeHTML( threads, codePosts, state['outputdir'], key, state['project_title'], state['pageSize'] )
+  elif( kind == 'codeCSV' ):
+    genCodeCSV( codePosts, state['outputdir'], key )
+  elif( kind == 'codePerTrans' ):
+    genCodePerTransHTML( renderThreads, codePosts, state['outputdir'], key )
+  else:
+    raise NameError('invalid page job: ' + kind)
+
+
+def renderJob( kind, key ):
+  """ Renders one page job in a worker process, and waits for its files to be written so that an
+      error writing them is raised with the job. Returns the files for the main process to write
+      out, if the worker is collecting them for an archive
+  """
+
+  renderPage( kind, key )
+  flushOutput()
+  return takeOutput()
+
+
+def profilePage( kind, key ):
+  """ Renders one page job in a worker process like renderJob, returning the time it took, the
+      calls that profiling recorded while rendering it and the files renderJob returned
+  """
+
+  start = time.perf_counter()
+  files = renderJob( kind, key )
+  return time.perf_counter() - start, profiling.PROFILE.takeCalls(), files
+
+
+def pageName( kind, key ):
+  """ Returns the name of the page job's page, for the profile """
+
+  if( kind in ('thread', 'threadCSV') and 'store' in renderState ):
+    return renderState['renderTitles'][key]
+  if( kind in ('thread', 'threadCSV') ):
+    return renderState['renderThreads'][key].title
+  return key
+
+
+def renderTimedPage( kind, key ):
+  """ Renders one page job, recording the time it took when profiling """
+
+  start = time.perf_counter()
+  renderPage( kind, key )
+  profiling.page( kind, pageName( kind, key ), time.perf_counter() - start )
+
+
+def renderPages( phases, state, jobs=1 ):
+  """ Renders phases, a list of lists of (cost, kind, key) page jobs, one phase after another.
+
+      With jobs > 1 each phase is spread over a pool of that many worker processes, starting with
+      the most costly pages so that a big page isn't left running alone at the end of a phase.
+      Any error raised while rendering a page is raised here. Pages that workers hand back for an
+      archive are packed into it as their jobs finish, in the order the jobs were started.
+
+      When profiling, the time each page took is recorded, along with the calls recorded by the
+      workers that rendered them.
+  """
+
+  initRenderer( state )
+  profile = profiling.PROFILE
+  if( jobs <= 1 ):
+    for phase in phases:
+      for cost, kind, key in phase:
+        renderTimedPage( kind, key )
+    return
+
+  state = dict(state, profile=profile is not None)
+  with ProcessPoolExecutor( max_workers=jobs, initializer=initWorker, initargs=(state,) ) as executor:
+    for phase in phases:
+      largestFirst = sorted( phase, key=lambda job: job[0], reverse=True )
+      if( profile is None ):
+        futures = [executor.submit( renderJob, kind, key ) for cost, kind, key in largestFirst]
+        for future in futures:
+          replayOutput( future.result() )
+        continue
+
+      futures = [executor.submit( profilePage, kind, key ) for cost, kind, key in largestFirst]
+      for (cost, kind, key), future in zip(largestFirst, futures):
+        seconds, calls, files = future.result()
+        replayOutput( files )
+        profile.page( kind, pageName( kind, key ), seconds )
+        profile.mergeCalls( calls )
+
+
+def renderStreamed( corpus, codes, state ):
+  """ Renders the pages of a streamed build, in the phases renderPages would, in this process.
+      The posts of each speaker and code are merged from the runs they were spilled to, one
+      speaker or code at a time, and read back from the master CSV as they are written out.
+  """
+
+  initRenderer( state )
+  posters = renderState['posters']
+  codePosts = renderState['codePosts']
+
+  for speaker, offsets in corpus.speakerRuns.groups():
+    poster = posters[SPEAKER_IDS.strings[speaker]]
+    poster.posts = corpus.posts( offsets )
+    renderTimedPage( 'poster', poster.name )
+    poster.posts = []
+
+  for i in range(len(renderState['renderThreads'])):
+    renderTimedPage( 'thread', i )
+
+  for kind in ('code', 'codePerTrans'):
+    unseen = set(codes)
+    for code, offsets in corpus.codeRuns.groups():
+      code = CODE_IDS.strings[code]
+      unseen.discard( code )
+      codePosts[code] = corpus.posts( offsets )
+      renderTimedPage( kind, code )
+      del codePosts[code]
+    # Codes nobody used still get their (empty) pages
+    for code in codes:
+      if( code in unseen ):
+        codePosts[code] = []
+        renderTimedPage( kind, code )
+        del codePosts[code]
 
 
 ################################################################################
@@ -352,12 +1258,31 @@ def readOriginalCSVs( originalCSVs, allCodes, outputdir, codeCounts ):
 def main():
   parser = argparse.ArgumentParser(description='Process coded transcripts given a codebook.')
   parser.add_argument('-u', '--update', type=str, help="update the indicated master.csv")
+  parser.add_argument('-j', '--jobs', type=int, default=1, help="number of worker processes to render pages with (default: 1)")
+  parser.add_argument('-p', '--page-size', type=int, default=0, help="split code, interview and speaker quote pages into pages of this many quotes (default: 0, no splitting)")
+  parser.add_argument('-i', '--incremental', action='store_true', help="only re-read transcripts that changed since the last build, and only regenerate the pages that depend on them")
+  parser.add_argument('-s', '--store', action='store_true', help="keep the dataset in an SQLite store, outputdir/" + MASTER_DB + ", instead of csv/master.csv, and render code pages from it")
+  parser.add_argument('-a', '--app', action='store_true', help="write a single-page app backed by a data bundle to outputdir/app, instead of one HTML page per code, interview and speaker")
+  parser.add_argument('-w', '--writers', type=int, default=0, help="number of background threads writing the pages out while the next ones render, holding at most 8MB of pages for them, 0 to write each page as it is rendered (default: 0)")
+  parser.add_argument('-z', '--archive', choices=ArchiveSink.FORMATS, help="pack the pages into a single archive, outputdir/" + ARCHIVE + ".zip or outputdir/" + ARCHIVE + ".tar, written in one stream, instead of loose files")
+  parser.add_argument('-m', '--memory-budget', type=float, metavar='MB', help="stream the transcripts in one at a time, keeping at most MB megabytes of references to their posts in memory and spilling the rest to disk, for corpora too big to read in at once. These builds have no search page, so their pages don't link to one")
+  parser.add_argument('--profile', type=str, metavar='REPORT', help="time each stage, generator and page of the build, and write the timings to this JSON file")
+  parser.add_argument('--profile-slowest', type=int, default=10, metavar='N', help="number of slowest pages to list in the --profile report (default: 10)")
+  parser.add_argument('--cprofile', type=str, metavar='STATS', help="with --profile, also run the build under cProfile and dump its stats to this file. Pages rendered by -j workers aren't included")
   parser.add_argument('project', metavar="project", help="name of project")
   parser.add_argument('outputdir', metavar='outputdir', help="directory where outputs will be sent. If it doesn't exist it will be created")
   parser.add_argument('codebook', metavar='codebook', help='the codebook CSV file')
   parser.add_argument('transcripts', metavar='transcripts', help='one or more transcript CSV files, or a directory', nargs='+')
 #parser.add_argument('output', metavar='output', help='the output, processed CSV file')
   args = vars(parser.parse_args())
+  if( args['app'] and args['incremental'] ):
+    parser.error("--app builds can't be incremental")
+  if( args['memory_budget'] is not None and (args['update'] or args['incremental'] or args['store'] or args['app'] or args['jobs'] > 1) ):
+    parser.error("--memory-budget builds can't be combined with -u, -i, -s, -a or -j")
+  if( args['archive'] and (args['update'] or args['incremental'] or args['memory_budget'] is not None) ):
+    parser.error("--archive builds write every page afresh, so can't be combined with -u, -i or -m")
+  if( args['cprofile'] and not args['profile'] ):
+    parser.error("--cprofile needs --profile")
 
   outputdir = args['outputdir']
   if outputdir[-1] == '/':
@@ -365,16 +1290,42 @@ def main():
 
   project_title = args['project']
 
-  # Check outputdir, make subfolders
+  if( args['profile'] ):
+    profiling.enable( outputdir, args['profile_slowest'], args['cprofile'] )
+
+  # Streamed builds write their pages as they go, rather than hold them for the writers. They never
+  # hold the whole corpus to index it either, so their pages don't link to a search page
+  writers = args['writers']
+  if( args['memory_budget'] is not None ):
+    writers = 0
+    setSearchLink( False )
+  profiling.stage( 'read' )
+
+  if( args['store'] ):
+    masterFilename = outputdir + '/' + MASTER_DB
+  else:
+    masterFilename = outputdir + '/csv/master.csv'
+
+  # Check outputdir, make subfolders. Archive builds only write the master CSV as a loose file
+  subfolders = ['/html/', '/csv/']
+  if( args['archive'] ):
+    subfolders = [] if args['store'] else ['/csv/']
   try:
-    os.makedirs(outputdir + '/html/')
-    os.makedirs(outputdir + '/csv/')
-  except OSError as exception:
-    if exception.errno != errno.EEXIST:
-      if( not os.path.isdir(outputdir) ):
-        print("Error: outputdir specified as", outputdir, "exists but is not a directory")
-        raise
-
+    os.makedirs(outputdir, exist_ok=True)
+    for subfolder in subfolders:
+      os.makedirs(outputdir + subfolder, exist_ok=True)
+  except OSError:
+    if( not os.path.isdir(outputdir) ):
+      print("Error: outputdir specified as", outputdir, "exists but is not a directory")
+    raise
+
+  # Pages are written to a single archive, or as loose files
+  archiveFilename = None
+  if( args['archive'] ):
+    archiveFilename = outputdir + '/' + ARCHIVE + '.' + args['archive']
+    setSink( ArchiveSink( archiveFilename, outputdir, args['archive'] ) )
+  elif( writers > 0 ):
+    setSink( ThreadedSink( writers ) )
 
   codes = []
   codeCounts = {}
@@ -392,57 +1343,202 @@ def main():
           'posts': 0
         }
 
-    # Is this an update?
-    if( args['update'] ):
-      threads = readGeneratedCSVs( args['update'], args['transcripts'], codes, outputdir, codeCounts )
-    else:
-      transcripts_path = Path(args['transcripts'][0])
-      # Are we analyzing an entire directory?
-      if transcripts_path.is_dir():
-        originalCSVs = [args['transcripts'][0] + path.name for path in Path(args['transcripts'][0]).glob('*.csv')]
-        print('Processing directory: ', originalCSVs)
+    # The posts of a streamed build, spilled to disk
+    corpus = None
+    # The manifest of this build, written once all of its output is
+    manifestFilename = outputdir + '/' + MANIFEST
+    nextManifest = None
+
+    # A streamed build spills its posts to a directory in outputdir, deleted however the build ends
+    try:
+      # Is this an update?
+      if( args['update'] ):
+        generatedCSVs = args['transcripts']
+        # Are we updating from an entire directory?
+        if( Path(generatedCSVs[0]).is_dir() ):
+          # Only the CSVs of posts, in it and in directories in it like csv/codes and csv/interviews,
+          # leaving out the summaries written alongside them and the master being updated
+          generatedCSVs = [str(path) for path in sorted(Path(generatedCSVs[0]).rglob('*.csv'))
+                           if isPostCSV( str(path) ) and os.path.abspath(str(path)) != os.path.abspath(args['update'])]
+          print('Processing directory: ', generatedCSVs)
+
+        threads, codeCounts, posters, codePosts, renderThreads, staleCodes, stalePosters, oldThreadCodes = readGeneratedCSVs(
+          args['update'], generatedCSVs, CodeMatcher(codes), outputdir, codeCounts )
+
+        renderCodes = [code for code in codes if code in staleCodes]
+        renderPosters = {name: poster for name, poster in posters.items() if name in stalePosters}
+        print("Update: regenerating {} interviews, {} codes and {} speakers".format(len(renderThreads), len(renderCodes), len(renderPosters)))
+        # Only the threads that changed have to be saved again, if the store being updated is this build's
+        changedThreads = None
+        if( os.path.abspath(args['update']) == os.path.abspath(masterFilename) ):
+          changedThreads = renderThreads
+
+        if( not args['app'] ):
+          removeUpdatedPages( oldThreadCodes, stalePosters, posters, outputdir )
+          nextManifest = refreshManifest( manifestFilename, threads )
+          removeManifest( manifestFilename )
       else:
-        originalCSVs = args['transcripts']
-
-      # Read the original CSVs
-      threads, codeCounts, posters = readOriginalCSVs( originalCSVs, codes, outputdir, codeCounts )
-
-      # Generate a histogram HTML page
-      genHistograms( threads, outputdir, codeCounts, project_title )
+        transcripts_path = Path(args['transcripts'][0])
+        # Are we analyzing an entire directory?
+        if transcripts_path.is_dir():
+          originalCSVs = [args['transcripts'][0] + path.name for path in Path(args['transcripts'][0]).glob('*.csv')]
+          print('Processing directory: ', originalCSVs)
+        else:
+          originalCSVs = args['transcripts']
+
+        # Read the original CSVs. Unrecognized codes are dropped rather than corrected (cleanCodes
+        # skips them), so unlike reformat.py there are no corrections to learn or cache between runs
+        codebookKey = codebookHash(codes)
+        codeCorrections = CodeCorrections()
+
+        # Find the transcripts that haven't changed since the last build
+        transcriptHashes = {originalCSV: hashFile(originalCSV) for originalCSV in originalCSVs}
+        oldManifest = readManifest( manifestFilename )
+        manifest = None
+        knownThreads = {}
+        if( args['incremental'] and checkManifest( oldManifest, project_title, codebookKey, args['page_size'] ) ):
+          knownThreads = readUnchangedThreads( oldManifest, transcriptHashes, masterFilename, outputdir )
+          if( knownThreads is None ):
+            knownThreads = {}
+          else:
+            manifest = oldManifest
+
+        if( args['memory_budget'] is not None ):
+          threads, codeCounts, posters, corpus = streamOriginalCSVs( originalCSVs, CodeMatcher(codes), outputdir, codeCounts, codeCorrections, masterFilename, int(args['memory_budget'] * 2**20) )
+          codePosts = defaultdict(list)
+        else:
+          threads, codeCounts, posters, codePosts = readOriginalCSVs( originalCSVs, CodeMatcher(codes), outputdir, codeCounts, codeCorrections, knownThreads )
 
-      # Write code_counts.csv
+        if( manifest is None ):
+          renderThreads, renderCodes, renderPosters = threads, codes, posters
+          changedThreads = None
+        else:
+          renderThreads, staleCodes, stalePosters = findStalePages( manifest, originalCSVs, knownThreads, threads )
+          renderCodes = [code for code in codes if code in staleCodes]
+          renderPosters = {name: poster for name, poster in posters.items() if name in stalePosters}
+          print("Incremental build: {} of {} transcripts changed, regenerating {} interviews, {} codes and {} speakers".format(
+            len(threads) - len(knownThreads), len(threads), len(renderThreads), len(renderCodes), len(renderPosters)))
+          changedThreads = [thread for originalCSV, thread in zip(originalCSVs, threads) if originalCSV not in knownThreads]
+        # The manifest describes the loose HTML pages, which app and archive builds leave alone
+        if( not args['app'] and not args['archive'] ):
+          if( oldManifest is not None ):
+            removeDeletedPages( oldManifest, originalCSVs, threads, posters, outputdir )
+          nextManifest = makeManifest( project_title, codebookKey, args['page_size'], originalCSVs, transcriptHashes, threads )
+          removeManifest( manifestFilename )
+
+      profiling.stage( 'summaries' )
+      if( corpus is None ):
+        cooccurrences = countCooccurrences( threads, codes )
+      else:
+        cooccurrences = listCooccurrences( corpus.quotePairs, corpus.interviewPairs, codes )
+      if( not args['app'] ):
+        # Generate a histogram HTML page
+        genHistograms( threads, outputdir, codeCounts, project_title )
+        # And a page of the codes that appear together
+        genCooccurrenceHTML( cooccurrences, outputdir, project_title )
+
+      # Write code_counts.csv and code_cooccurrence.csv
       genCodeCounts( codeCounts, outputdir )
-
-    # Write out a master CSV
-    genMasterCSV( outputdir + '/csv/master.csv', threads )
-
-    # Write out individual posters' pages. TODO: make it an instance method?
-    genPosterHTML(posters, outputdir)
-
-    # Write out an interview HTML page
-    for interview in threads:
-      interview.toHTML()
-
-    # Write out individual HTML for each code
-    for code in codes:
-      genCodeHTML( threads, outputdir, code, project_title )
-
-    # Write out individual CSV's for each code
-    for code in codes:
-      genCodeCSV( threads, outputdir, code )
-
-    # Write out individual HTML for each code, interview pair
-    for code in codes:
-      genCodePerTransHTML( threads, outputdir, code )
+      genCooccurrenceCSV( cooccurrences, outputdir )
+
+      # Interview pages are split as they render themselves
+      for thread in threads:
+        thread.pageSize = args['page_size']
+
+      # Save the threads that changed to the store
+      profiling.stage( 'csv' )
+      if( args['store'] ):
+        genMasterDB( masterFilename, threads, changedThreads )
+
+      # Write out the CSVs of each code and interview, and a master CSV, in one pass over the posts. Stores keep
+      # the master instead, and streamed builds wrote theirs as they went. App builds only write the master
+      csvMaster = masterFilename if not args['store'] and corpus is None else None
+      if( args['app'] ):
+        genCSVs( threads, outputdir, masterFilename=csvMaster )
+      else:
+        genCSVs( threads, outputdir, renderCodes, renderThreads, csvMaster )
+
+      # Write the single-page app instead of the HTML pages
+      if( args['app'] ):
+        profiling.stage( 'app' )
+        genAppBundle( threads, posters, codes, codeCounts, codePosts, outputdir, project_title )
+        closeOutput()
+        if( args['profile'] ):
+          profiling.finish( args['profile'] )
+        if( archiveFilename is not None ):
+          print('\nDone! Output packed into: {}, view app/index.html in it'.format(os.path.abspath(archiveFilename)))
+        else:
+          print('\nDone! View output at: {}'.format(os.path.abspath(outputdir+'/app/index.html')))
+        return
+
+      # Render the pages, costed by the number of rows on them
+      phases = [
+        # Write out individual posters' pages. TODO: make it an instance method?
+        [(len(poster.posts), 'poster', name) for name, poster in renderPosters.items()],
+        # Write out an interview HTML page
+        [(len(interview.posts), 'thread', i) for i, interview in enumerate(renderThreads)],
+        # Write out individual HTML for each code
+        [(len(codePosts[code]) + len(threads), 'code', code) for code in renderCodes],
+        # Write out individual HTML for each code, interview pair. Pages of unchanged interviews stay valid
+        [(len(codePosts[code]), 'codePerTrans', code) for code in codes],
+      ]
+      state = {
+        'outputdir': outputdir,
+        'project_title': project_title,
+        'pageSize': args['page_size'],
+        'writers': writers,
+        'archive': archiveFilename is not None,
+        'codeIds': CODE_IDS,
+        'speakerIds': SPEAKER_IDS,
+      }
+      # Pages query the store for their posts, so the corpus isn't copied to every worker
+      if( args['store'] ):
+        state['store'] = masterFilename
+        state['renderTitles'] = [thread.title for thread in renderThreads]
+      else:
+        state['threads'] = threads
+        state['codePosts'] = codePosts
+        state['renderThreads'] = renderThreads
+        state['posters'] = renderPosters
+      profiling.stage( 'render' )
+      if( corpus is None ):
+        renderPages( phases, state, args['jobs'] )
+      else:
+        renderStreamed( corpus, codes, state )
+    finally:
+      if( corpus is not None ):
+        corpus.close()
 
     # Generate the main index.html
+    profiling.stage( 'index' )
     genIndex( threads, outputdir, codeCounts, project_title )
 
+    # Index the quotes for the search page. Indexing them would mean holding the whole corpus, which a
+    # streamed build never does, so it has no search page, and one from an earlier build is deleted
+    profiling.stage( 'search' )
+    if( corpus is None ):
+      genSearchIndex( threads, codes, posters, outputdir, project_title, args['page_size'] )
+    else:
+      removeSearchIndex( outputdir )
+
     # Generate the stylesheet from the main one
     genStylesheet( outputdir )
 
+    # Wait for the last pages to be written
+    closeOutput()
+
+    # Only now that all of it is written does the manifest say the output is current
+    if( nextManifest is not None ):
+      writeManifest( manifestFilename, nextManifest )
+
+    if( args['profile'] ):
+      profiling.finish( args['profile'] )
+
     # Print a direct link to the index file for viewing
-    print('\nDone! View output at: {}'.format(os.path.abspath(outputdir+'/html/index.html')))
+    if( archiveFilename is not None ):
+      print('\nDone! Output packed into: {}, view html/index.html in it'.format(os.path.abspath(archiveFilename)))
+    else:
+      print('\nDone! View output at: {}'.format(os.path.abspath(outputdir+'/html/index.html')))
 
 if __name__ == '__main__':
   main()
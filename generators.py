@@ -5,19 +5,29 @@ if sys.version_info[0] != 3:
 	print("This script requires Python version 3")
 	sys.exit(1)
 
-from collections import defaultdict
+from itertools import groupby
 import operator
 import markup
 import csv
-import shutil
+import io
+import json
+import os
 
+from output import openOutput, copyOutput, removeOutput, makedirsOutput, OutputPool
+from profiling import profiled
+from search import SearchIndex
 from util import urlSafe
 
+# Whether the menu of each page links to the search page. Builds that don't write the search index
+# turn it off with setSearchLink
+SEARCH_LINK = True
+
 ################################################################################
 # HTML generators
 ################################################################################
 
 
+@profiled
 def genIndex(threads, outputdir, codeCounts, project_title):
 	""" Generates an index linking to all the main pages.
 			Inputs:
@@ -39,9 +49,9 @@ def genIndex(threads, outputdir, codeCounts, project_title):
 
 	freqSortedCodes = sorted(codeCounts.items(), key=lambda tup: len(tup[1]['threads']), reverse=True)
 
-	with open(outputdir + '/html/' + 'index.html', 'w') as outFile:
+	with openOutput(outputdir + '/html/' + 'index.html', 'w') as outFile:
 		header = "{}: Coded Transcripts".format(project_title)
-		page = markup.page()
+		page = markup.page(stream=outFile)
 		page = genHeaderMenu(page, header)
 
 		page.table(style="width: 100%")
@@ -92,10 +102,11 @@ def genIndex(threads, outputdir, codeCounts, project_title):
 
 		page.table.close()
 
-		outFile.write(str(page))
+		page.finish()
 	outFile.close()
 
 
+@profiled
 def genHistograms(threads, outputdir, codeCounts, project_title):
 	""" Generates an index linking to all the main pages.
 			Inputs:
@@ -117,9 +128,9 @@ def genHistograms(threads, outputdir, codeCounts, project_title):
 	freqSortedCodeCounts = sorted(
 		codeCounts.items(), key=lambda tup: len(tup[1]['threads']), reverse=True)
 
-	with open(outputdir + '/html/' + 'histograms.html', mode='w+') as outFile:
+	with openOutput(outputdir + '/html/' + 'histograms.html', mode='w+') as outFile:
 		header = "{}: Histograms".format(project_title)
-		page = markup.page()
+		page = markup.page(stream=outFile)
 		page = genHeaderMenu(page, header)
 
 		page.table(style="width: 100%", id_="histograms-table")
@@ -150,51 +161,108 @@ def genHistograms(threads, outputdir, codeCounts, project_title):
 			page.tr.close()
 		page.table.close()
 
-		outFile.write(str(page))
+		page.finish()
 	outFile.close()
 
+@profiled
+def genCooccurrenceHTML(cooccurrences, outputdir, project_title):
+	""" Generates a page of the pairs of codes that appear together, in a table that sorts on any
+			column when its header is clicked.
+			Inputs:
+				cooccurrences <list>: (code, other code, # quotes with both, # interviews with both) tuples,
+					as returned by countCooccurrences
+				outputdir <str>: directory for output specified in arguments
+				project_title <str>: used to generate the page title
+	"""
+	with openOutput(outputdir + '/html/' + 'cooccurrence.html', mode='w+') as outFile:
+		header = "{}: Code co-occurrence".format(project_title)
+		page = markup.page(stream=outFile)
+		page = genHeaderMenu(page, header, ['sortable.js'])
+
+		page.table(style="width: 100%", id_="cooccurrence-table", class_="sortable")
+
+		page.tr(class_="table-header")
+		page.th('code')
+		page.th('code')
+		page.th('# quotes with both')
+		page.th('# interviews with both')
+		page.tr.close()
+		for code, other, quote_count, interview_count in cooccurrences:
+			page.tr()
+			page.td()
+			page.a(code, href="{}.html".format(urlSafe(code)))
+			page.td.close()
+			page.td()
+			page.a(other, href="{}.html".format(urlSafe(other)))
+			page.td.close()
+			page.td(str(quote_count))
+			page.td(str(interview_count))
+			page.tr.close()
+		page.table.close()
+
+		page.finish()
+
+
+@profiled
+def genCooccurrenceCSV(cooccurrences, outputdir):
+	""" Generates code_cooccurrence.csv """
+
+	with openOutput(outputdir + '/csv/code_cooccurrence.csv', mode='w') as outFile:
+		writer = csv.writer(outFile, dialect='excel')
+		writer.writerow(['code', 'other_code', 'quote_count', 'interview_count'])
+		writer.writerows(cooccurrences)
+
 # Generators for code page
 
 
-def genCodePostsHTML(threads, outputdir, code, project_title):
-	""" Generates the posts tab of a code page """
+@profiled
+def genCodePostsHTML(codePosts, outputdir, code, project_title, pageSize=0):
+	""" Generates the posts tab of a code page from codePosts, the posts tagged with code, split
+			into pages of pageSize quotes (0 for a single page)
+	"""
 
-	with open("{}/html/{}.html".format(outputdir, urlSafe(code)), mode="w") as outFile:
-		header = "All quotes in {} tagged with {}".format(project_title, code)
-		page = markup.page()
-		page = genHeaderMenu(page, header)
+	pages = paginate(codePosts, pageSize)
+	for pageNumber, pagePosts in enumerate(pages, 1):
+		with openOutput("{}/html/{}.html".format(outputdir, pageFileBase(urlSafe(code), pageNumber)), mode="w") as outFile:
+			header = "All quotes in {} tagged with {}".format(project_title, code)
+			page = markup.page(stream=outFile)
+			page = genHeaderMenu(page, header)
 
-		page.div(class_="submenu")
-		page.a("quotes", color="blue", href="{}.html".format(urlSafe(code)))
-		page.add("&nbsp;&nbsp;-&nbsp;&nbsp;")
-		page.a("interviews", color="blue",
-					 href="{}_interviews.html".format(urlSafe(code)))
-		page.div.close()
+			page.div(class_="submenu")
+			page.a("quotes", color="blue", href="{}.html".format(urlSafe(code)))
+			page.add("&nbsp;&nbsp;-&nbsp;&nbsp;")
+			page.a("interviews", color="blue",
+						 href="{}_interviews.html".format(urlSafe(code)))
+			page.div.close()
 
-		page.table(style="width: 100%; table-layout: fixed; max-width: 90vw")
+			genPageLinks(page, urlSafe(code), pageNumber, len(pages))
 
-		page.tr(class_="table-header")
-		page.th('speaker', width="15%")
-		page.th('quote', width="50%")
-		page.th('codes', width="20%")
-		page.tr.close()
+			page.table(style="width: 100%; table-layout: fixed; max-width: 90vw")
 
-		for thread in threads:
-			for post in thread.posts:
-				if(code in post.codes):
-					post.printHTML(page)
+			page.tr(class_="table-header")
+			page.th('speaker', width="15%")
+			page.th('quote', width="50%")
+			page.th('codes', width="20%")
+			page.tr.close()
 
-		page.table.close()
+			for post in pagePosts:
+				post.printHTML(page)
+
+			page.table.close()
 
-		outFile.write(str(page))
+			genPageLinks(page, urlSafe(code), pageNumber, len(pages))
 
+			page.finish()
 
-def genCodePostsHTMLReddit(threads, outputdir, code, project_title):
-	""" Generates the posts tab of a code page """
+	removeExtraPages(outputdir, urlSafe(code), len(pages))
 
-	with open("{}/html/{}.html".format(outputdir, urlSafe(code)), mode="w") as outFile:
+
+def genCodePostsHTMLReddit(codePosts, outputdir, code, project_title):
+	""" Generates the posts tab of a code page from codePosts, the posts tagged with code """
+
+	with openOutput("{}/html/{}.html".format(outputdir, urlSafe(code)), mode="w") as outFile:
 		header = "All posts in {} tagged with {}".format(project_title, code)
-		page = markup.page()
+		page = markup.page(stream=outFile)
 		page = genHeaderMenu(page, header)
 
 		page.div(class_="submenu")
@@ -212,22 +280,21 @@ def genCodePostsHTMLReddit(threads, outputdir, code, project_title):
 		page.th('codes', width="20%")
 		page.tr.close()
 
-		for thread in threads:
-			for post in thread.posts:
-				if(code in post.codes):
-					post.printHTML(page)
+		for post in codePosts:
+			post.printHTML(page)
 
 		page.table.close()
 
-		outFile.write(str(page))
+		page.finish()
 
 
+@profiled
 def genCodeThreadsHTML(threads, outputdir, code, project_title):
 	""" Generates the threads tab of a code page """
 
-	with open("{}/html/{}_interviews.html".format(outputdir, urlSafe(code)), mode="w") as outFile:
+	with openOutput("{}/html/{}_interviews.html".format(outputdir, urlSafe(code)), mode="w") as outFile:
 		header = "All threads in {} tagged with {}".format(project_title, code)
-		page = markup.page()
+		page = markup.page(stream=outFile)
 		page = genHeaderMenu(page, header)
 
 		sorted_threads = sorted([thread for thread in threads if code in thread.codeHistogram], key=lambda thread: thread.codeHistogram[code], reverse=True)
@@ -258,51 +325,59 @@ def genCodeThreadsHTML(threads, outputdir, code, project_title):
 
 		page.table.close()
 
-		outFile.write(str(page))
+		page.finish()
 
 
-def genCodeHTML(threads, outputdir, code, project_title):
-	""" Searches through all threads and extracts all references to each code, writes to an HTML output """
-	genCodePostsHTML(threads, outputdir, code, project_title)
+@profiled
+def genCodeHTML(threads, codePosts, outputdir, code, project_title, pageSize=0):
+	""" Writes the HTML pages for a code, given codePosts, the posts tagged with it """
+	genCodePostsHTML(codePosts, outputdir, code, project_title, pageSize)
 	genCodeThreadsHTML(threads, outputdir, code, project_title)
 
 
-def genCodeHTMLReddit(threads, outputdir, code, project_title):
-	""" Searches through all threads and extracts all references to each code, writes to an HTML output """
-	genCodePostsHTMLReddit(threads, outputdir, code, project_title)
+def genCodeHTMLReddit(threads, codePosts, outputdir, code, project_title):
+	""" Writes the HTML pages for a code, given codePosts, the posts tagged with it """
+	genCodePostsHTMLReddit(codePosts, outputdir, code, project_title)
 	genCodeThreadsHTML(threads, outputdir, code, project_title)
 
 
-def genCodePerTransHTML(threads, outputdir, code):
-	""" For each thread, output a page for each code with all the posts coded as such """
+@profiled
+def genCodePerTransHTML(threads, codePosts, outputdir, code):
+	""" For each thread that uses code, output a page with all the posts coded as such. Threads
+			without the code in their codeHistogram get no page, and nothing links to one. codePosts
+			are in thread order, so each thread's posts are written out as they are read
+	"""
 
-	for thread in threads:
-		with open(outputdir + '/html/' + urlSafe(code) + '_' + thread.title + '.html', 'w') as outFile:
+	renderThreads = set(threads)
+	for thread, threadPosts in groupby(codePosts, key=operator.attrgetter('thread')):
+		if thread not in renderThreads:
+			continue
+		with openOutput(outputdir + '/html/' + urlSafe(code) + '_' + thread.title + '.html', 'w') as outFile:
 			header = "All references to {} in interview {}".format(code, thread.title)
-			page = markup.page()
+			page = markup.page(stream=outFile)
 			page = genHeaderMenu(page, header)
 
 			page.table(style="width: 100%")
 
-			for post in thread.posts:
-				if(code in post.codes):
-					post.printHTML(page)
+			for post in threadPosts:
+				post.printHTML(page)
 
 			page.table.close()
 
-			outFile.write(str(page))
+			page.finish()
 
 ################################################################################
 # Poster page generators
 ################################################################################
 
 
+@profiled
 def genPosterCodesHTML(poster, outputdir):
 	""" For a given poster, generate their codes page """
 	username = urlSafe(poster.name)
-	with open("{}/html/{}.html".format(outputdir, username), mode="w+") as outfile:
+	with openOutput("{}/html/{}.html".format(outputdir, username), mode="w+") as outfile:
 		header = "All coded activity for poster {}".format(username)
-		page = markup.page()
+		page = markup.page(stream=outfile)
 		page = genHeaderMenu(page, header)
 
 		page.div(class_="submenu")
@@ -337,16 +412,17 @@ def genPosterCodesHTML(poster, outputdir):
 			page.tr.close()
 
 		page.table.close()
-		outfile.write(str(page))
+		page.finish()
 	outfile.close()
 
 
+@profiled
 def genPosterThreadsHTML(poster, outputdir):
 	""" For a given poster, generate their threads page """
 	username = urlSafe(poster.name)
-	with open("{}/html/{}_interviews.html".format(outputdir, username), mode="w+") as outfile:
+	with openOutput("{}/html/{}_interviews.html".format(outputdir, username), mode="w+") as outfile:
 		header = "All coded activity for poster {}".format(username)
-		page = markup.page()
+		page = markup.page(stream=outfile)
 		page = genHeaderMenu(page, header)
 
 		page.div(class_="submenu")
@@ -373,76 +449,143 @@ def genPosterThreadsHTML(poster, outputdir):
 			page.tr.close()
 
 		page.table.close()
-		outfile.write(str(page))
+		page.finish()
 	outfile.close()
 
 
-def genPosterPostsHTML(poster, outputdir):
-	""" For a given poster, generate their posts page """
+@profiled
+def genPosterPostsHTML(poster, outputdir, pageSize=0):
+	""" For a given poster, generate their posts page, split into pages of pageSize quotes (0 for a single page) """
 	username = urlSafe(poster.name)
-	with open("{}/html/{}_quotes.html".format(outputdir, username), mode="w+") as outfile:
-		header = "All coded activity for poster {}".format(username)
-		page = markup.page()
-		page = genHeaderMenu(page, header)
+	pages = paginate(poster.posts, pageSize)
+	for pageNumber, pagePosts in enumerate(pages, 1):
+		with openOutput("{}/html/{}.html".format(outputdir, pageFileBase(username + "_quotes", pageNumber)), mode="w+") as outfile:
+			header = "All coded activity for poster {}".format(username)
+			page = markup.page(stream=outfile)
+			page = genHeaderMenu(page, header)
 
-		page.div(class_="submenu")
-		page.a("codes", color="blue", href="{}.html".format(username))
-		page.add("&nbsp;&nbsp;-&nbsp;&nbsp;")
-		page.a("interviews", color="blue", href="{}_interviews.html".format(username))
-		page.add("&nbsp;&nbsp;-&nbsp;&nbsp;")
-		page.a("quotes", color="blue", href="{}_quotes.html".format(username))
-		page.div.close()
+			page.div(class_="submenu")
+			page.a("codes", color="blue", href="{}.html".format(username))
+			page.add("&nbsp;&nbsp;-&nbsp;&nbsp;")
+			page.a("interviews", color="blue", href="{}_interviews.html".format(username))
+			page.add("&nbsp;&nbsp;-&nbsp;&nbsp;")
+			page.a("quotes", color="blue", href="{}_quotes.html".format(username))
+			page.div.close()
 
-		page.table(style="width: 100%; table-layout: fixed")
+			genPageLinks(page, username + "_quotes", pageNumber, len(pages))
 
-		# First write a block for all the codes the poster engages with, and how often they posted something with that code
+			page.table(style="width: 100%; table-layout: fixed")
 
-		page.tr(class_="table-header")
-		page.add("<h1>quotes (n={})</h1>".format(len(poster.threads)))
-		page.tr.close()
+			# First write a block for all the codes the poster engages with, and how often they posted something with that code
 
-		for post in poster.posts:
-			post.printHTML(page, codeLinkTo="this_interview")
+			page.tr(class_="table-header")
+			page.add("<h1>quotes (n={})</h1>".format(len(poster.threads)))
+			page.tr.close()
 
-		page.table.close()
-		outfile.write(str(page))
-	outfile.close()
+			for post in pagePosts:
+				post.printHTML(page, codeLinkTo="this_interview")
+
+			page.table.close()
+
+			genPageLinks(page, username + "_quotes", pageNumber, len(pages))
 
+			page.finish()
+		outfile.close()
 
-def genPosterHTML(posters, outputdir):
+	removeExtraPages(outputdir, username + "_quotes", len(pages))
+
+
+@profiled
+def genPosterHTML(posters, outputdir, pageSize=0):
 	""" For each poster, output a page showing their codes, threads and posts """
 	for poster_name, poster in posters.items():
 		genPosterCodesHTML(poster, outputdir)
 		genPosterThreadsHTML(poster, outputdir)
-		genPosterPostsHTML(poster, outputdir)
+		genPosterPostsHTML(poster, outputdir, pageSize)
 
 
 ################################################################################
 # CSV generators
 ################################################################################
 
-def genCodeCSV(threads, outputdir, code):
-	""" Searches through all threads and extracts all references to each code, writes to a CSV output """
+@profiled
+def genCodeCSV(codePosts, outputdir, code):
+	""" Writes codePosts, the posts tagged with code, to a CSV output in csv/codes """
 
-	with open(outputdir + '/csv/' + urlSafe(code) + '.csv', 'w') as outFile:
+	makedirsOutput(outputdir + '/csv/codes')
+	with openOutput(outputdir + '/csv/codes/' + urlSafe(code) + '.csv', 'w') as outFile:
 		fields = ['thread', 'postID', 'speaker', 'text', 'code']
 
 		writer = csv.writer(outFile, dialect='excel')
 
 		writer.writerow(fields)
 
+		for post in codePosts:
+			row = [post.thread.title, post.postID, post.poster, post.text]
+			row.extend(post.codes)
+			writer.writerow(row)
+
+
+@profiled
+def genCSVs(threads, outputdir, codes=(), csvThreads=(), masterFilename=None, maxOpen=128):
+	""" Writes the CSVs of the posts of threads in a single pass over them. Each post's row is
+	formatted once and written to the CSV in csv/codes of each of codes it is tagged with, as
+	genCodeCSV writes them, to its thread's CSV in csv/interviews if the thread is one of
+	csvThreads, and to the master CSV masterFilename, if given. At most maxOpen of the CSVs are
+	open at once. Raises ValueError if two of them have the same filename """
+
+	rowBuffer = io.StringIO()
+	writer = csv.writer(rowBuffer, dialect='excel')
+	def formatRow(row):
+		rowBuffer.seek(0)
+		rowBuffer.truncate()
+		writer.writerow(row)
+		return rowBuffer.getvalue()
+
+	pool = OutputPool(maxOpen)
+	# The master CSV is written to disk whatever the sink, for later updates to read
+	if masterFilename is not None:
+		pool.add(masterFilename, formatRow(['threadTitle', 'postID', 'poster', 'text']), loose=True)
+	# Interviews and codes have a directory each, so they can't share a name with each other or with
+	# the master and the summary CSVs
+	threadFiles = {}
+	if csvThreads:
+		makedirsOutput(outputdir + '/csv/interviews')
+	for thread in csvThreads:
+		threadFiles[thread] = outputdir + '/csv/interviews/' + thread.outFileBase + '.csv'
+		pool.add(threadFiles[thread], formatRow(['interview', 'postID', 'poster', 'text', 'code']))
+	codeFiles = {}
+	if codes:
+		makedirsOutput(outputdir + '/csv/codes')
+	for code in codes:
+		codeFiles[code] = outputdir + '/csv/codes/' + urlSafe(code) + '.csv'
+		pool.add(codeFiles[code], formatRow(['thread', 'postID', 'speaker', 'text', 'code']))
+
+	try:
 		for thread in threads:
+			threadFile = threadFiles.get(thread)
 			for post in thread.posts:
-				if(code in post.codes):
-					row = [thread.title, post.postID, post.poster, post.text]
-					row.extend(post.codes)
-					writer.writerow(row)
-
-
+				postCodes = post.codes
+				row = [thread.title, post.postID, post.poster, post.text]
+				row.extend(postCodes)
+				line = formatRow(row)
+				if masterFilename is not None:
+					pool.write(masterFilename, line)
+				if threadFile is not None:
+					pool.write(threadFile, line)
+				# A post tagged twice with a code is in its CSV once
+				for code in set(postCodes):
+					if code in codeFiles:
+						pool.write(codeFiles[code], line)
+	finally:
+		pool.close()
+
+
+@profiled
 def genCodeCounts(codeCounts, outputdir):
 	""" Generates code_counts.csv """
 
-	with open(outputdir + '/csv/code_counts.csv', mode="w") as outfile:
+	with openOutput(outputdir + '/csv/code_counts.csv', mode="w") as outfile:
 		outfile.write('code,interview_count,quote_count,speaker_count\n')
 		freq_sorted_code_counts = sorted(codeCounts.items(), key=lambda tup: len(tup[1]), reverse=True)
 		for code, counts in freq_sorted_code_counts:
@@ -453,33 +596,236 @@ def genCodeCounts(codeCounts, outputdir):
 											code, interview_count, quote_count, speaker_count))
 	outfile.close()
 
+################################################################################
+# Single-page app generators. Instead of one page per code, interview and
+# speaker, these write a data bundle that app.js renders in the browser. See
+# app.js for the format of the bundle
+################################################################################
+
+
+@profiled
+def genAppShard(appdir, key, data):
+	""" Writes one file of the data bundle, as a script that hands data to the app """
+	with openOutput("{}/data/{}.js".format(appdir, key), mode="w") as outFile:
+		outFile.write("QCV.receive({}, {});\n".format(json.dumps(key), json.dumps(data, separators=(',', ':'))))
+
+
+@profiled
+def genAppBundle(threads, posters, codes, codeCounts, codePosts, outputdir, project_title):
+	""" Writes the single-page app into outputdir/app: the app shell, the stylesheet, an index of
+			codes, interviews and speakers, and one shard per interview, code and speaker. Posts are
+			stored once, in their interview's shard, and referred to elsewhere as [interview id, post index]
+	"""
+	appdir = outputdir + '/app'
+	for shard in ['threads', 'codes', 'speakers']:
+		makedirsOutput("{}/data/{}".format(appdir, shard))
+
+	codeIds = {code: i for i, code in enumerate(codes)}
+	threadIds = {thread: i for i, thread in enumerate(threads)}
+	speakerIds = {name: i for i, name in enumerate(posters)}
+	postRefs = {}
+
+	for thread, threadId in threadIds.items():
+		rows = []
+		for i, post in enumerate(thread.posts):
+			postRefs[post] = [threadId, i]
+			rows.append([post.postID, speakerIds[post.poster], post.text, [codeIds[code] for code in post.codes]])
+		genAppShard(appdir, "threads/{}".format(threadId), rows)
+
+	for code, codeId in codeIds.items():
+		counts = sorted(((threadIds[thread], thread.codeHistogram[code]) for thread in threads if code in thread.codeHistogram),
+										key=lambda pair: pair[1], reverse=True)
+		genAppShard(appdir, "codes/{}".format(codeId), {
+			'posts': [postRefs[post] for post in codePosts[code]],
+			'threads': counts,
+		})
+
+	titleIds = {thread.title: threadId for thread, threadId in threadIds.items()}
+	for name, speakerId in speakerIds.items():
+		poster = posters[name]
+		genAppShard(appdir, "speakers/{}".format(speakerId), {
+			'codes': sorted(([codeIds[code], count] for code, count in poster.codes.items()), key=lambda pair: pair[1], reverse=True),
+			'threads': sorted(titleIds[title] for title in poster.threads),
+			'posts': [postRefs[post] for post in poster.posts],
+		})
+
+	genAppShard(appdir, 'index', {
+		'project': project_title,
+		'codes': [[code, codeCounts[code]['posts'], len(codeCounts[code]['threads']), sorted(speakerIds[name] for name in codeCounts[code]['posters'])] for code in codes],
+		'threads': [[thread.title, len(thread.posts)] for thread in threads],
+		'speakers': list(posters),
+	})
+
+	copyOutput('app.html', appdir + '/index.html')
+	copyOutput('app.js', appdir + '/app.js')
+	copyOutput('layout.css', appdir + '/layout.css')
+
+
+################################################################################
+# Search generators. The search page answers queries in the browser from an
+# index of the quotes' words, written as shards next to the HTML. See
+# search.py and search.js for the format of the index
+################################################################################
+
+
+SEARCH_SHARD_DIRS = ['words', 'positions', 'quotes', 'codes', 'speakers']
+
+
+@profiled
+def genSearchShard(searchdir, key, data):
+	""" Writes one shard of the search index, as a script that hands data to the search page """
+	with openOutput("{}/{}.js".format(searchdir, key), mode="w") as outFile:
+		outFile.write("QCVSearch.receive({}, {});\n".format(json.dumps(key), json.dumps(data, separators=(',', ':'))))
+
+
+@profiled
+def genSearchIndex(threads, codes, posters, outputdir, project_title, pageSize=0):
+	""" Writes the search index of the quotes of threads into outputdir/html/search, and the search
+			page that reads it. Shards left over from an earlier build that this one doesn't write are deleted
+	"""
+	searchdir = outputdir + '/html/search'
+	for shardDir in SEARCH_SHARD_DIRS:
+		makedirsOutput("{}/{}".format(searchdir, shardDir))
+
+	written = set()
+	for key, data in SearchIndex(threads, codes, posters).shards(project_title, pageSize):
+		genSearchShard(searchdir, key, data)
+		written.add(key)
+	removeSearchShards(searchdir, written)
+
+	genSearchHTML(outputdir, project_title)
+	copyOutput('search.js', outputdir + '/html/search.js')
+
+
+def removeSearchIndex(outputdir):
+	""" Deletes the search page and its index left over from an earlier build, for builds that don't write them """
+	searchdir = outputdir + '/html/search'
+	removeSearchShards(searchdir, set())
+	for filename in [searchdir + '/index.js', outputdir + '/html/search.html', outputdir + '/html/search.js']:
+		if os.path.exists(filename):
+			removeOutput(filename)
+
+
+def removeSearchShards(searchdir, written):
+	""" Deletes the shards in searchdir whose keys aren't in written """
+	for shardDir in SEARCH_SHARD_DIRS:
+		if not os.path.isdir("{}/{}".format(searchdir, shardDir)):
+			continue
+		for filename in os.listdir("{}/{}".format(searchdir, shardDir)):
+			if "{}/{}".format(shardDir, os.path.splitext(filename)[0]) not in written:
+				removeOutput("{}/{}/{}".format(searchdir, shardDir, filename))
+
+
+@profiled
+def genSearchHTML(outputdir, project_title):
+	""" Generates the search page. search.js fills in the filters and the results """
+	with openOutput(outputdir + '/html/search.html', mode='w') as outFile:
+		header = "{}: Search quotes".format(project_title)
+		page = markup.page(stream=outFile)
+		page = genHeaderMenu(page, header, ['search.js'])
+
+		page.form(id_="search-form")
+		page.input(type="search", id_="search-query", size="50",
+							 placeholder='words, or "a phrase"', autofocus="autofocus")
+		for name in ['code', 'interview', 'speaker']:
+			page.select(id_="search-" + name)
+			page.option("any " + name, value="")
+			page.select.close()
+		page.button("search", type="submit")
+		page.form.close()
+
+		page.p("", id_="search-status")
+		page.table(style="width: 100%; table-layout: fixed; max-width: 90vw", id_="search-results")
+		page.table.close()
+		page.div("", id_="search-more")
+
+		page.finish()
+
+
 ################################################################################
 # HTML formatting generators
 ################################################################################
 
 
+@profiled
 def genStylesheet(outputdir):
-	""" Copies the main stylesheet into the output's html folder """
+	""" Copies the main stylesheet, and the scripts pages load, into the output's html folder """
 	master_layout_file = 'layout.css'
 	print('writing stylesheet from master: {}'.format(master_layout_file))
 
 	output_file = "{}/html/{}".format(outputdir, "layout.css")
 
-	shutil.copyfile(master_layout_file, output_file)
+	copyOutput(master_layout_file, output_file)
+	copyOutput('sortable.js', "{}/html/{}".format(outputdir, "sortable.js"))
+
 
+def paginate(items, pageSize):
+	""" Splits items into pages of pageSize items. A pageSize of 0 puts them all on one page """
+	if pageSize <= 0 or len(items) <= pageSize:
+		return [items]
+	return [items[i:i + pageSize] for i in range(0, len(items), pageSize)]
 
-def genHeaderMenu(page, header):
+
+def pageFileBase(baseName, pageNumber):
+	""" Returns the file basename of page pageNumber, counted from 1, of a paginated page. The first
+			page keeps the unpaginated name so existing links land on it
+	"""
+	if pageNumber == 1:
+		return baseName
+	return "{}_page{}".format(baseName, pageNumber)
+
+
+def removeExtraPages(outputdir, baseName, numPages):
+	""" Deletes pages of baseName after numPages left over from an earlier build, when there were more of them """
+	pageNumber = max(numPages, 1) + 1
+	while True:
+		filename = "{}/html/{}.html".format(outputdir, pageFileBase(baseName, pageNumber))
+		if not os.path.exists(filename):
+			return
+		removeOutput(filename)
+		pageNumber += 1
+
+
+def genPageLinks(page, baseName, pageNumber, numPages):
+	""" Writes prev/next and numbered links between the pages of a paginated page, if it has more than one """
+	if numPages <= 1:
+		return
+	page.div(class_="pagination")
+	if pageNumber > 1:
+		page.a("prev", href="{}.html".format(pageFileBase(baseName, pageNumber - 1)))
+	for number in range(1, numPages + 1):
+		if number == pageNumber:
+			page.span(str(number), class_="current-page")
+		else:
+			page.a(str(number), href="{}.html".format(pageFileBase(baseName, number)))
+	if pageNumber < numPages:
+		page.a("next", href="{}.html".format(pageFileBase(baseName, pageNumber + 1)))
+	page.div.close()
+
+
+def setSearchLink(enabled):
+	""" Sets whether the menu of each page links to the search page """
+	global SEARCH_LINK
+	SEARCH_LINK = enabled
+
+
+def genHeaderMenu(page, header, scripts=None):
 	""" Writes the header and menu to the top of each page. Returns the page instance.
+			scripts optionally lists scripts for the page to load.
 	"""
 	styles = ('layout.css')
-	page = markup.page()
-	page.init(title=header, css=styles, charset='utf-8')
+	page.init(title=header, css=styles, charset='utf-8', script=scripts)
 	page.div(id_="index-header")
 	page.add("<h1>{}</h1>".format(header))
 	page.div(id_="index-menu")
 	page.a("index", color="blue", href="index.html")
 	page.add("&nbsp;&nbsp;-&nbsp;&nbsp;")
 	page.a("histograms", color="blue", href="histograms.html")
+	page.add("&nbsp;&nbsp;-&nbsp;&nbsp;")
+	page.a("co-occurrence", color="blue", href="cooccurrence.html")
+	if SEARCH_LINK:
+		page.add("&nbsp;&nbsp;-&nbsp;&nbsp;")
+		page.a("search", color="blue", href="search.html")
 	page.div.close()
 	page.div.close()
 	return page
@@ -0,0 +1,123 @@
+"""
+incidence.py
+------------
+
+A sparse post x code incidence matrix over the posts of a build, with the thread and speaker of
+each post, from which the counts behind the index, histograms, code counts and poster pages are
+derived by reductions over whole arrays rather than one code at a time.
+
+The reductions use NumPy when it is installed, and plain Python arrays otherwise. Either way they
+return plain Python ints, in the order the posts were read. Matrix products use SciPy's sparse
+matrices when SciPy is installed too.
+
+"""
+
+from array import array
+from collections import Counter, defaultdict
+from itertools import chain, repeat
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+try:
+  from scipy import sparse
+except ImportError:
+  sparse = None
+
+
+class Incidence(object):
+  """ The post x code incidence matrix of threads, in coordinate form: entry k says that post
+      entryPost[k] was tagged with code entryCode[k]. A post tagged twice with a code has two
+      entries. Posts are numbered in thread order, then post order.
+
+      Attributes:
+        numPosts <int>: the number of posts
+        postThread <array int>: the index in threads of the thread of each post
+        postSpeaker <array int>: the speaker id of each post
+        entryPost <array int>: the post of each entry
+        entryCode <array int>: the code id of each entry
+  """
+
+  def __init__( self, threads ):
+    """ Builds the matrix from the posts of threads, which hold their speakers and codes as ids """
+    posts = [post for thread in threads for post in thread.posts]
+    threadLengths = array( 'l', (len(thread.posts) for thread in threads) )
+    postLengths = array( 'l', (len(post.codeIds) for post in posts) )
+
+    self.numPosts = len(posts)
+    self.postThread = self._repeat( threadLengths )
+    self.postSpeaker = self._vector( array('l', (post.posterId for post in posts)) )
+    self.entryPost = self._repeat( postLengths )
+    self.entryCode = self._vector( array('l', chain.from_iterable(post.codeIds for post in posts)) )
+
+  def _vector( self, values ):
+    if( numpy is None ):
+      return values
+    return numpy.frombuffer( values, dtype=values.typecode ).astype( numpy.int64 )
+
+  def _repeat( self, lengths ):
+    # i repeated lengths[i] times, for each i
+    if( numpy is None ):
+      return array( 'l', chain.from_iterable(map(repeat, range(len(lengths)), lengths)) )
+    return numpy.repeat( numpy.arange(len(lengths), dtype=numpy.int64), self._vector(lengths) )
+
+  def entries( self, postVector ):
+    """ Spreads a vector over posts, such as postThread, to a vector over entries """
+    if( numpy is None ):
+      return array( 'l', map(postVector.__getitem__, self.entryPost) )
+    return postVector[self.entryPost]
+
+  def counts( self, keys ):
+    """ Returns [(key, count)] of the distinct values of the vector keys, in the order they first appear """
+    if( numpy is None ):
+      return list(Counter(keys).items())
+
+    if( len(keys) == 0 ):
+      return []
+    distinct, first, counts = numpy.unique( keys, return_index=True, return_counts=True )
+    order = numpy.argsort( first, kind='stable' )
+    return list(zip( distinct[order].tolist(), counts[order].tolist() ))
+
+  def pairCounts( self, rows, columns ):
+    """ Reduces two vectors of the same length, such as the thread and code of every entry, to
+        [(row, column, count)] for each distinct pair, in the order the pairs first appear
+    """
+    if( len(columns) == 0 ):
+      return []
+    if( numpy is None ):
+      return [(row, column, count) for (row, column), count in self.counts( zip(rows, columns) )]
+
+    numColumns = int(columns.max()) + 1
+    distinct, first, counts = numpy.unique( rows * numColumns + columns, return_index=True, return_counts=True )
+    order = numpy.argsort( first, kind='stable' )
+    distinct = distinct[order]
+    return list(zip( (distinct // numColumns).tolist(), (distinct % numColumns).tolist(), counts[order].tolist() ))
+
+  def cooccurrence( self, rows ):
+    """ Counts how often codes appear together. rows gives the row of every entry, such as
+        entryPost for quotes or entries(postThread) for interviews, and the counts are those of the
+        sparse product B'B of the 0/1 row x code matrix B. Returns {(code, other code): number of
+        rows with both} for code < other code, leaving out pairs that never appear together.
+    """
+    if( len(rows) == 0 ):
+      return {}
+    if( sparse is None or numpy is None ):
+      # The product one row at a time: each row adds one to every pair of its codes
+      rowCodes = defaultdict(set)
+      for row, code in zip(rows, self.entryCode):
+        rowCodes[row].add( code )
+      pairs = Counter()
+      for codes in rowCodes.values():
+        codes = sorted(codes)
+        for i, code in enumerate(codes):
+          pairs.update( (code, other) for other in codes[i + 1:] )
+      return dict(pairs)
+
+    shape = (int(rows.max()) + 1, int(self.entryCode.max()) + 1)
+    rowCode = sparse.csr_matrix( (numpy.ones(len(rows), dtype=numpy.int64), (rows, self.entryCode)), shape=shape )
+    # Converting to CSR sums repeated tags, count each row once
+    rowCode.data[:] = 1
+    product = sparse.triu( rowCode.T @ rowCode, k=1 ).tocoo()
+    return dict(zip( zip(product.row.tolist(), product.col.tolist()), product.data.tolist() ))
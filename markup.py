@@ -35,6 +35,31 @@ except:
 # to by a leading underscore otherwise we end up with a syntax error
 import keyword
 
+_valid_onetags = [ "AREA", "BASE", "BR", "COL", "FRAME", "HR", "IMG", "INPUT", "LINK", "META", "PARAM" ]
+_valid_twotags = [ "A", "ABBR", "ACRONYM", "ADDRESS", "B", "BDO", "BIG", "BLOCKQUOTE", "BODY", "BUTTON",
+        "CAPTION", "CITE", "CODE", "COLGROUP", "DD", "DEL", "DFN", "DIV", "DL", "DT", "EM", "FIELDSET",
+        "FORM", "FRAMESET", "H1", "H2", "H3", "H4", "H5", "H6", "HEAD", "HTML", "I", "IFRAME", "INS",
+        "KBD", "LABEL", "LEGEND", "LI", "MAP", "NOFRAMES", "NOSCRIPT", "OBJECT", "OL", "OPTGROUP",
+        "OPTION", "P", "PRE", "Q", "SAMP", "SCRIPT", "SELECT", "SMALL", "SPAN", "STRONG", "STYLE",
+        "SUB", "SUP", "TABLE", "TBODY", "TD", "TEXTAREA", "TFOOT", "TH", "THEAD", "TITLE", "TR",
+        "TT", "UL", "VAR" ]
+_deprecated_onetags = [ "BASEFONT", "ISINDEX" ]
+_deprecated_twotags = [ "APPLET", "CENTER", "DIR", "FONT", "MENU", "S", "STRIKE", "U" ]
+
+def _bothcases( tags ):
+    """Returns a frozenset of tags in both upper and lower case."""
+    return frozenset( tags ) | frozenset( map( string.lower, tags ) )
+
+# tag tables are computed once and shared by every page, membership tests are O(1)
+_strict_onetags = _bothcases( _valid_onetags )
+_strict_twotags = _bothcases( _valid_twotags )
+_deptags = _bothcases( _deprecated_onetags + _deprecated_twotags )
+_loose_onetags = _bothcases( _valid_onetags + _deprecated_onetags )
+_loose_twotags = _bothcases( _valid_twotags + _deprecated_twotags )
+
+# argument types that _totuple turns into a single value
+_scalars = ( basestring, int, long, float )
+
 class element:
     """This class handles the addition of a new element."""
 
@@ -59,6 +84,21 @@ class element:
             if 'class_' not in kwargs:
                 kwargs['class_'] = self.parent.class_
             
+        # fast path for the common case of at most one scalar argument and scalar
+        # keyword values, where _argsdicts would only ever yield a single element
+        if self.parent is not None and ( len( args ) == 0 or isinstance( args[0], _scalars ) ):
+            for value in kwargs.values( ):
+                if value is not None and not isinstance( value, _scalars ):
+                    break
+            else:
+                tag = self.tag
+                if tag in self.parent.twotags:
+                    self.render( tag, False, args[0] if args else None, kwargs )
+                    return
+                elif tag in self.parent.onetags and len( args ) == 0:
+                    self.render( tag, True, None, kwargs )
+                    return
+
         if self.parent is None and len( args ) == 1:
             x = [ self.render( self.tag, False, myarg, mydict ) for myarg, mydict in _argsdicts( args, kwargs ) ]
             return '\n'.join( x )
@@ -128,7 +168,7 @@ class page:
     """This is our main class representing a document. Elements are added
     as attributes of an instance of this class."""
 
-    def __init__( self, mode='strict_html', case='lower', onetags=None, twotags=None, separator='\n', class_=None ):
+    def __init__( self, mode='strict_html', case='lower', onetags=None, twotags=None, separator='\n', class_=None, stream=None, buffersize=65536 ):
         """Stuff that effects the whole document.
 
         mode -- 'strict_html'   for HTML 4.01 (default)
@@ -148,22 +188,21 @@ class page:
         
         separator --            string to place between added elements, defaults to newline
         
-        class_ --               a class that will be added to every element if defined"""
+        class_ --               a class that will be added to every element if defined
+
+        stream --               a file object to write the document to as it is built, instead of
+                                keeping it in memory; call finish( ) once the document is complete.
+                                Header text has to be added before any content in this mode
+
+        buffersize --           how many characters to collect before writing them to stream"""
         
-        valid_onetags = [ "AREA", "BASE", "BR", "COL", "FRAME", "HR", "IMG", "INPUT", "LINK", "META", "PARAM" ]
-        valid_twotags = [ "A", "ABBR", "ACRONYM", "ADDRESS", "B", "BDO", "BIG", "BLOCKQUOTE", "BODY", "BUTTON",
-                "CAPTION", "CITE", "CODE", "COLGROUP", "DD", "DEL", "DFN", "DIV", "DL", "DT", "EM", "FIELDSET",
-                "FORM", "FRAMESET", "H1", "H2", "H3", "H4", "H5", "H6", "HEAD", "HTML", "I", "IFRAME", "INS",
-                "KBD", "LABEL", "LEGEND", "LI", "MAP", "NOFRAMES", "NOSCRIPT", "OBJECT", "OL", "OPTGROUP",
-                "OPTION", "P", "PRE", "Q", "SAMP", "SCRIPT", "SELECT", "SMALL", "SPAN", "STRONG", "STYLE",
-                "SUB", "SUP", "TABLE", "TBODY", "TD", "TEXTAREA", "TFOOT", "TH", "THEAD", "TITLE", "TR",
-                "TT", "UL", "VAR" ]
-        deprecated_onetags = [ "BASEFONT", "ISINDEX" ]
-        deprecated_twotags = [ "APPLET", "CENTER", "DIR", "FONT", "MENU", "S", "STRIKE", "U" ]
-
-        self.header = [ ]
-        self.content = [ ]
+        if stream is not None:
+            self.header = self.content = _streamer( stream, separator, buffersize )
+        else:
+            self.header = [ ]
+            self.content = [ ]
         self.footer = [ ]
+        self._stream = stream
         self.case = case
         self.separator = separator
 
@@ -172,18 +211,13 @@ class page:
         self.class_= class_
 
         if mode == 'strict_html' or mode == 'html':
-            self.onetags = valid_onetags
-            self.onetags += list( map( string.lower, self.onetags ) )
-            self.twotags = valid_twotags
-            self.twotags += list( map( string.lower, self.twotags ) )
-            self.deptags = deprecated_onetags + deprecated_twotags
-            self.deptags += list( map( string.lower, self.deptags ) )
+            self.onetags = _strict_onetags
+            self.twotags = _strict_twotags
+            self.deptags = _deptags
             self.mode = 'strict_html'
         elif mode == 'loose_html':
-            self.onetags = valid_onetags + deprecated_onetags 
-            self.onetags += list( map( string.lower, self.onetags ) )
-            self.twotags = valid_twotags + deprecated_twotags
-            self.twotags += list( map( string.lower, self.twotags ) )
+            self.onetags = _loose_onetags
+            self.twotags = _loose_twotags
             self.mode = mode
         elif mode == 'xml':
             if onetags and twotags:
@@ -200,6 +234,7 @@ class page:
 
     def __getattr__( self, attr ):
 
+        name = attr
         # tags should start with double underscore
         if attr.startswith("__") and attr.endswith("__"):
             raise AttributeError( attr )
@@ -209,16 +244,34 @@ class page:
             if attr not in keyword.kwlist:
                 raise AttributeError( attr )
 
-        return element( attr, case=self.case, parent=self )
+        # elements hold no state of their own, so cache them on the instance
+        # and later lookups of the same tag won't come through here at all
+        myelement = element( attr, case=self.case, parent=self )
+        self.__dict__[ name ] = myelement
+        return myelement
 
-    def __str__( self ):
-        
+    def _end( self ):
         if self._full and ( self.mode == 'strict_html' or self.mode == 'loose_html' ):
-            end = [ '</body>', '</html>' ]
+            return [ '</body>', '</html>' ]
         else:
-            end = [ ]
+            return [ ]
+
+    def __str__( self ):
+        
+        if self._stream is not None:
+            raise StreamError( )
 
-        return self.separator.join( self.header + self.content + self.footer + end )
+        return self.separator.join( self.header + self.content + self.footer + self._end( ) )
+
+    def finish( self ):
+        """Write the footer and closing tags of a streamed document and flush it to the stream."""
+
+        if self._stream is None:
+            raise StreamError( )
+        for text in self.footer + self._end( ):
+            self.content.append( text )
+        self.footer = [ ]
+        self.content.flush( )
 
     def __call__( self, escape=False ):
         """Return the document as a string.
@@ -370,6 +423,33 @@ class page:
                 raise TypeError( "Script should be given a dictionary of src:type pairs or a list of javascript src's." )
 
 
+class _streamer:
+    """Stands in for a page's header and content lists in streaming mode, writing
+    fragments through to a file object in buffered chunks as they are appended."""
+
+    def __init__( self, stream, separator, buffersize ):
+        self.stream = stream
+        self.separator = separator
+        self.buffersize = buffersize
+        self.buffer = [ ]
+        self.buffered = 0
+        self.started = False
+
+    def append( self, text ):
+        if self.started:
+            self.buffer.append( self.separator )
+        else:
+            self.started = True
+        self.buffer.append( text )
+        self.buffered += len( text )
+        if self.buffered >= self.buffersize:
+            self.flush( )
+
+    def flush( self ):
+        self.stream.write( ''.join( self.buffer ) )
+        self.buffer = [ ]
+        self.buffered = 0
+
 class _oneliner:
     """An instance of oneliner returns a string corresponding to one element.
     This class can be used to write 'oneliners' that return a string
@@ -520,6 +600,10 @@ class ModeError( MarkupError ):
     def __init__( self, mode ):
         self.message = "Mode '%s' is invalid, possible values: strict_html, html (alias for strict_html), loose_html, xml." % mode
 
+class StreamError( MarkupError ):
+    def __init__( self ):
+        self.message = "A streamed page is written to its stream with finish( ) and can not be turned into a string, a page that isn't streamed has nothing to finish."
+
 class CustomizationError( MarkupError ):
     def __init__( self ):
         self.message = "If you customize the allowed elements, you must define both types 'onetags' and 'twotags'."
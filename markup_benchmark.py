@@ -0,0 +1,85 @@
+#!/usr/bin/python3
+import sys
+
+if sys.version_info[0] != 3:
+    print("This script requires Python version 3")
+    sys.exit(1)
+
+"""
+markup_benchmark.py
+-------------------
+
+Micro-benchmark for markup.py. Builds pages of table rows shaped like the ones
+Post.printHTML writes and reports how many elements per second markup renders.
+
+Pass --compare with the path to another copy of markup.py (for instance one
+extracted with `git show <commit>:markup.py > old_markup.py`) to time both.
+
+"""
+
+import argparse
+import importlib.util
+import time
+
+import markup
+
+
+def load_markup(path):
+    """ Imports a copy of markup.py from path under its own module name """
+    spec = importlib.util.spec_from_file_location('markup_compare', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def build_page(markup_module, rows, codes_per_row):
+    """ Builds one page of rows, returns the number of elements written """
+    page = markup_module.page()
+    page.init(title='benchmark', css='layout.css', charset='utf-8')
+    page.table(style="width: 100%")
+    elements = 1
+    for i in range(rows):
+        page.tr(id=str(i))
+        page.td()
+        page.a('Speaker', href="Speaker.html")
+        page.td.close()
+        page.td()
+        page.a('Some quoted speech & <markup>', href='Interview.html#' + str(i))
+        page.td.close()
+        page.td()
+        for j in range(codes_per_row):
+            if j > 0:
+                page.br()
+                page.br()
+                elements += 2
+            page.a('Code_{}'.format(j), href='Code_{}.html'.format(j))
+        page.td.close()
+        page.tr.close()
+        elements += 11 + codes_per_row
+    page.table.close()
+    str(page)
+    return elements + 1
+
+
+def benchmark(markup_module, pages, rows, codes_per_row):
+    """ Returns elements rendered per second """
+    start = time.perf_counter()
+    elements = 0
+    for i in range(pages):
+        elements += build_page(markup_module, rows, codes_per_row)
+    return elements / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Time markup.py element rendering.')
+    parser.add_argument('-p', '--pages', type=int, default=200, help="number of pages to build (default: 200)")
+    parser.add_argument('-r', '--rows', type=int, default=100, help="table rows per page (default: 100)")
+    parser.add_argument('-c', '--codes', type=int, default=3, help="codes per row (default: 3)")
+    parser.add_argument('--compare', type=str, help="path to another markup.py to time against this one")
+    args = vars(parser.parse_args())
+
+    if args['compare']:
+        rate = benchmark(load_markup(args['compare']), args['pages'], args['rows'], args['codes'])
+        print('{}: {:.0f} elements/sec'.format(args['compare'], rate))
+    rate = benchmark(markup, args['pages'], args['rows'], args['codes'])
+    print('markup.py: {:.0f} elements/sec'.format(rate))
@@ -0,0 +1,84 @@
+#!/usr/bin/python3
+import sys
+
+if sys.version_info[0] != 3:
+    print("This script requires Python version 3")
+    sys.exit(1)
+
+"""
+memory_benchmark.py
+-------------------
+
+Reports how much memory code-extract.py's model takes per post. Writes a
+synthetic corpus, reads it with readOriginalCSVs and measures what stays
+allocated: the threads, posts, posters, code counts and code -> posts index.
+
+Pass --compare with the path to another copy of code-extract.py (for instance
+one extracted with `git show <commit>:code-extract.py > old_extract.py`) to
+measure both.
+
+"""
+
+import argparse
+import contextlib
+import gc
+import importlib.util
+import io
+import os
+import tempfile
+import tracemalloc
+
+from synthetic import write_corpus
+from util import CodeMatcher, CodeCorrections
+
+
+def load_extractor(path, name):
+    """ Imports a copy of code-extract.py from path under its own module name """
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def measure(extractor, codebook, transcripts):
+    """ Returns (posts read, bytes allocated per post, bytes of text per post) """
+    codes = [line.split(',')[0] for line in open(codebook)]
+    originalCSVs = sorted(os.path.join(transcripts, name) for name in os.listdir(transcripts))
+    codeCounts = {code: {'posters': set(), 'threads': set(), 'posts': 0} for code in codes}
+    matcher = CodeMatcher(codes)
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    with contextlib.redirect_stdout(io.StringIO()):
+        model = extractor.readOriginalCSVs(originalCSVs, matcher, 'output', codeCounts, CodeCorrections())
+    gc.collect()
+    allocated = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    threads = model[0]
+    num_posts = sum(len(thread.posts) for thread in threads)
+    text = sum(sys.getsizeof(post.text) for thread in threads for post in thread.posts)
+    return num_posts, allocated / num_posts, text / num_posts
+
+
+def report(label, result):
+    num_posts, per_post, text = result
+    print('{}: {:.0f} bytes/post, {:.0f} without the quote text ({} posts)'.format(label, per_post, per_post - text, num_posts))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Measure the memory code-extract.py takes per post.')
+    parser.add_argument('-c', '--codes', type=int, default=100, help="codes in the codebook (default: 100)")
+    parser.add_argument('-n', '--interviews', type=int, default=100, help="number of interviews (default: 100)")
+    parser.add_argument('-q', '--quotes', type=int, default=2000, help="quotes per interview (default: 2000)")
+    parser.add_argument('--compare', type=str, help="path to another code-extract.py to measure against this one")
+    args = vars(parser.parse_args())
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        codebook = write_corpus(work_dir, args['codes'], args['interviews'], args['quotes'])
+        transcripts = os.path.join(work_dir, 'transcripts')
+        if args['compare']:
+            report(args['compare'], measure(load_extractor(args['compare'], 'extract_compare'), codebook, transcripts))
+        this = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'code-extract.py')
+        report('code-extract.py', measure(load_extractor(this, 'extract'), codebook, transcripts))
@@ -0,0 +1,412 @@
+"""
+output.py
+---------
+
+Where the generators write the pages of a build. Rather than opening files themselves, they open
+them with openOutput(), which hands back a file to write a page to, copy and delete pages with
+copyOutput() and removeOutput(), and make the directories they go in with makedirsOutput(). These
+go to the sink set for this process with setSink(): by default a FileSink, which writes to disk there and then, or a ThreadedSink, which writes on a pool
+of background threads so that rendering the next page overlaps writing the last one, or an
+ArchiveSink, which packs the pages into a single zip or tar archive instead of loose files.
+Worker processes hand their pages back to the process that owns the sink with a CollectingSink.
+Files written to a piece at a time, many at once, are kept open in an OutputPool.
+
+"""
+
+import io
+import os
+import queue
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+from collections import OrderedDict
+
+
+class FileSink(object):
+  """ Writes each file to disk as soon as it is written """
+
+  def open( self, filename, mode='w' ):
+    return io.open( filename, mode )
+
+  def write( self, filename, data, mode='w' ):
+    with io.open( filename, mode ) as outFile:
+      outFile.write( data )
+
+  def copy( self, source, filename ):
+    shutil.copyfile( source, filename )
+
+  def remove( self, filename ):
+    os.remove( filename )
+
+  def makedirs( self, dirname ):
+    os.makedirs( dirname, exist_ok=True )
+
+  def flush( self ):
+    """ Returns once every file handed to the sink is on disk, raising the first error writing one """
+
+  def close( self ):
+    self.flush()
+
+
+class PageBuffer(io.StringIO):
+  """ A file opened on a sink that doesn't write to disk there and then. What is written to it is
+      handed to the sink when it is closed, to be written out to filename later
+  """
+
+  def __init__( self, sink, filename, mode ):
+    io.StringIO.__init__( self )
+    self.sink = sink
+    self.filename = filename
+    self.mode = mode
+
+  def close( self ):
+    if( not self.closed ):
+      data = self.getvalue()
+      io.StringIO.close( self )
+      self.sink.write( self.filename, data, self.mode )
+
+
+class ThreadedSink(FileSink):
+  """ Writes files on a pool of writer threads. The files waiting to be written are held in memory
+      up to queueBytes in all, and handing over another that doesn't fit waits for the writers to
+      catch up, so rendering never gets more than that far ahead of the disk. A file bigger than
+      queueBytes is handed over once the writers have nothing else to write. A given filename
+      always goes to the same writer, so writes to it and deletes of it happen in the order they
+      were made.
+
+      The first error a writer hits is raised by the next call on the sink, and by flush().
+
+      Attributes:
+        error <Exception>: the first error writing a file, or None
+        queueBytes <int>: the most bytes of files waiting to be written
+  """
+
+  def __init__( self, writers=4, queueBytes=1 << 23 ):
+    self.error = None
+    self.queueBytes = queueBytes
+    self._pending = 0
+    self._space = threading.Condition()
+    self._queues = [queue.Queue() for i in range(writers)]
+    self._threads = [threading.Thread( target=self._run, args=(tasks,), daemon=True ) for tasks in self._queues]
+    for thread in self._threads:
+      thread.start()
+
+  def _run( self, tasks ):
+    while True:
+      task = tasks.get()
+      try:
+        if( task is None ):
+          return
+        # Once a write has failed the build is lost, so the rest are dropped
+        if( self.error is None ):
+          function, args, size = task
+          function( *args )
+      except Exception as error:
+        if( self.error is None ):
+          self.error = error
+      finally:
+        if( task is not None ):
+          with self._space:
+            self._pending -= task[2]
+            self._space.notify_all()
+        tasks.task_done()
+
+  def _submit( self, filename, size, function, *args ):
+    """ Hands function(*args) to filename's writer, once size more bytes of files fit in the queues """
+    if( self.error is not None ):
+      raise self.error
+    with self._space:
+      while( self._pending > 0 and self._pending + size > self.queueBytes ):
+        self._space.wait()
+      self._pending += size
+    self._queues[hash(filename) % len(self._queues)].put( (function, args, size) )
+
+  def open( self, filename, mode='w' ):
+    return PageBuffer( self, filename, mode )
+
+  def write( self, filename, data, mode='w' ):
+    self._submit( filename, len(data), FileSink.write, self, filename, data, mode )
+
+  def copy( self, source, filename ):
+    self._submit( filename, 0, shutil.copyfile, source, filename )
+
+  def remove( self, filename ):
+    self._submit( filename, 0, os.remove, filename )
+
+  def flush( self ):
+    for tasks in self._queues:
+      tasks.join()
+    if( self.error is not None ):
+      raise self.error
+
+  def close( self ):
+    """ Writes out everything handed to the sink and stops the writers """
+    try:
+      self.flush()
+    finally:
+      for tasks in self._queues:
+        tasks.put( None )
+      for thread in self._threads:
+        thread.join()
+
+
+class StreamWriter(object):
+  """ A write-only view of a file, that can't seek or tell, so that an archive written to it is
+      written front to back without going back to patch up headers
+  """
+
+  def __init__( self, outFile ):
+    self._file = outFile
+
+  def write( self, data ):
+    return self._file.write( data )
+
+  def flush( self ):
+    self._file.flush()
+
+
+class ArchiveSink(ThreadedSink):
+  """ Packs the files of a build into a single archive, in place of writing them out. Each is
+      stored under its path relative to root. As files are handed to the sink, one writer thread
+      spools them to a temporary file next to the archive. When the sink is closed, each file is
+      packed from the spool into the archive, written front to back in one stream, in the order
+      the files were first handed to the sink.
+
+      Until then a file can be written again, appended to or removed as it could on disk, so the
+      archive holds each path once, with what the last writes to it left there, and none of the
+      paths removed.
+
+      Attributes:
+        filename <str>: the archive
+        root <str>: the directory the files' paths are taken relative to
+        format <str>: 'zip', deflated, or 'tar', uncompressed
+  """
+
+  FORMATS = ('zip', 'tar')
+
+  def __init__( self, filename, root, format='zip', queueBytes=1 << 23 ):
+    if( format not in self.FORMATS ):
+      raise ValueError( "unknown archive format: " + format )
+    self.filename = filename
+    self.root = root
+    self.format = format
+    self._time = time.time()
+    self._spool = tempfile.TemporaryFile( prefix='archive-', dir=os.path.dirname(os.path.abspath(filename)) )
+    # {name in the archive: [(offset, length) in the spool of each piece of the file]}
+    self._members = {}
+    ThreadedSink.__init__( self, 1, queueBytes )
+
+  def _name( self, filename ):
+    return os.path.relpath( filename, self.root ).replace( os.sep, '/' )
+
+  def _add( self, filename, data, mode='w' ):
+    name = self._name( filename )
+    if( isinstance(data, str) ):
+      data = data.encode( 'utf-8' )
+    offset = self._spool.seek( 0, io.SEEK_END )
+    self._spool.write( data )
+    if( mode == 'a' and name in self._members ):
+      self._members[name].append( (offset, len(data)) )
+    else:
+      self._members[name] = [(offset, len(data))]
+
+  def _copy( self, source, filename ):
+    with io.open( source, 'rb' ) as sourceFile:
+      self._add( filename, sourceFile.read() )
+
+  def _remove( self, filename ):
+    self._members.pop( self._name( filename ), None )
+
+  def write( self, filename, data, mode='w' ):
+    self._submit( filename, len(data), self._add, filename, data, mode )
+
+  def copy( self, source, filename ):
+    self._submit( filename, 0, self._copy, source, filename )
+
+  def remove( self, filename ):
+    self._submit( filename, 0, self._remove, filename )
+
+  def makedirs( self, dirname ):
+    """ Members are stored under their paths, so there are no directories to make """
+
+  def _pack( self ):
+    with io.open( self.filename, 'wb' ) as stream:
+      if( self.format == 'zip' ):
+        archive = zipfile.ZipFile( StreamWriter(stream), 'w', zipfile.ZIP_DEFLATED )
+      else:
+        archive = tarfile.open( fileobj=stream, mode='w|' )
+      with archive:
+        for name, pieces in self._members.items():
+          data = bytearray()
+          for offset, length in pieces:
+            self._spool.seek( offset )
+            data += self._spool.read( length )
+          if( self.format == 'zip' ):
+            info = zipfile.ZipInfo( name, date_time=time.localtime(self._time)[:6] )
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info.external_attr = 0o644 << 16
+            archive.writestr( info, bytes(data) )
+          else:
+            info = tarfile.TarInfo( name )
+            info.size = len(data)
+            info.mtime = int(self._time)
+            info.mode = 0o644
+            archive.addfile( info, io.BytesIO(data) )
+
+  def close( self ):
+    """ Spools everything handed to the sink, then packs it into the archive """
+    try:
+      ThreadedSink.close( self )
+      self._pack()
+    finally:
+      self._spool.close()
+
+
+class CollectingSink(FileSink):
+  """ Keeps the files written in a worker process, for the process that owns the real sink to
+      write out with replayOutput(), in the order they were written
+  """
+
+  def __init__( self ):
+    self._tasks = []
+
+  def open( self, filename, mode='w' ):
+    return PageBuffer( self, filename, mode )
+
+  def write( self, filename, data, mode='w' ):
+    self._tasks.append( ('write', filename, data, mode) )
+
+  def copy( self, source, filename ):
+    self._tasks.append( ('copy', source, filename) )
+
+  def remove( self, filename ):
+    self._tasks.append( ('remove', filename) )
+
+  def makedirs( self, dirname ):
+    self._tasks.append( ('makedirs', dirname) )
+
+  def take( self ):
+    tasks, self._tasks = self._tasks, []
+    return tasks
+
+
+class OutputPool(object):
+  """ Output files written to a piece at a time, in any order, of which at most maxOpen are open at
+      once. Writing to one that isn't open closes the one written to least recently, and writing
+      to that one again reopens it to append to, so any number of files can be written side by
+      side without running out of file handles, or, on a sink that holds files until they are
+      closed, memory. Files are opened with openOutput(), except loose ones, which are written
+      straight to disk whatever the sink.
+
+      Attributes:
+        maxOpen <int>: the most files open at once
+        opens <int>: the number of times a file was opened, counting reopens
+  """
+
+  def __init__( self, maxOpen=128 ):
+    self.maxOpen = maxOpen
+    self.opens = 0
+    # {filename: [text it starts with, loose, whether it has been opened]}
+    self._files = {}
+    self._open = OrderedDict()
+
+  def add( self, filename, start='', loose=False ):
+    """ Adds filename to the pool, starting with start. It is created when it is first written
+        to, or when the pool is closed if it never is. Raises ValueError if filename is already in
+        the pool, as what is written to each would end up mixed together in the one file
+    """
+    if( filename in self._files ):
+      raise ValueError( "{} is already being written".format(filename) )
+    self._files[filename] = [start, loose, False]
+
+  def _reopen( self, filename ):
+    if( len(self._open) >= self.maxOpen ):
+      oldest, oldestFile = self._open.popitem( last=False )
+      oldestFile.close()
+    entry = self._files[filename]
+    start, loose, opened = entry
+    mode = 'a' if opened else 'w'
+    outFile = io.open( filename, mode ) if loose else openOutput( filename, mode )
+    if( not opened ):
+      outFile.write( start )
+      entry[2] = True
+    self.opens += 1
+    self._open[filename] = outFile
+    return outFile
+
+  def write( self, filename, data ):
+    outFile = self._open.get( filename )
+    if( outFile is None ):
+      outFile = self._reopen( filename )
+    else:
+      self._open.move_to_end( filename )
+    outFile.write( data )
+
+  def close( self ):
+    """ Closes every file, creating those that were never written to """
+    try:
+      for filename, (start, loose, opened) in self._files.items():
+        if( not opened ):
+          self._reopen( filename )
+    finally:
+      while( self._open ):
+        filename, outFile = self._open.popitem( last=False )
+        outFile.close()
+
+
+# The sink of this process
+SINK = FileSink()
+
+
+def setSink( sink ):
+  """ Makes sink the one the generators write to in this process """
+  global SINK
+  SINK = sink
+
+
+def openOutput( filename, mode='w' ):
+  """ Returns a file to write the output file filename to, written out when it is closed """
+  return SINK.open( filename, mode )
+
+
+def copyOutput( source, filename ):
+  SINK.copy( source, filename )
+
+
+def removeOutput( filename ):
+  SINK.remove( filename )
+
+
+def makedirsOutput( dirname ):
+  """ Makes the directory dirname, and its parents, for output files, if the sink writes them to disk """
+  SINK.makedirs( dirname )
+
+
+def takeOutput():
+  """ Returns the files written in this process since the last call, if it is collecting them for
+      another process to write out, and otherwise nothing
+  """
+  if( isinstance(SINK, CollectingSink) ):
+    return SINK.take()
+  return []
+
+
+def replayOutput( tasks ):
+  """ Writes out the files that takeOutput() returned in another process """
+  for task in tasks:
+    getattr( SINK, task[0] )( *task[1:] )
+
+
+def flushOutput():
+  """ Waits for the files written so far to be on disk, raising the first error writing one """
+  SINK.flush()
+
+
+def closeOutput():
+  """ Writes out every file written so far and puts back the default sink, raising the first error writing one """
+  sink = SINK
+  setSink( FileSink() )
+  sink.close()
@@ -0,0 +1,173 @@
+"""
+profiling.py
+------------
+
+The --profile instrumentation of code-extract.py and reformat.py. A build is split into stages,
+each timed along with the files and bytes it wrote under the output directory, and the functions
+marked @profiled are timed and counted on every call, as are the pages rendered. The results are
+written as a JSON report, and the whole build can also be run under cProfile.
+
+Nothing is recorded until enable() is called, so the instrumentation left in place costs one
+check per call of a profiled function.
+
+"""
+
+import cProfile
+import functools
+import heapq
+import json
+import os
+import sys
+import time
+
+# The profile being recorded in this process, if any
+PROFILE = None
+
+
+class Profile(object):
+  """ The wall times and call counts recorded for one build.
+
+      Attributes:
+        outputdir <str>: directory the files written are counted under, None not to count them
+        slowest <int>: number of slowest pages to keep
+        stages <list dict>: the finished stages, in order, as {stage, seconds, files, bytes}
+        calls <dict>: {function name: [calls, seconds]} of the profiled functions
+        pages <list>: heap of the slowest (seconds, kind, page) rendered
+  """
+
+  def __init__( self, outputdir=None, slowest=10 ):
+    self.outputdir = outputdir
+    self.slowest = slowest
+    self.stages = []
+    self.calls = {}
+    self.pages = []
+    self.start = time.perf_counter()
+    self.startTime = time.time_ns()
+    self._stage = None
+    self._cprofile = None
+
+  def stage( self, name ):
+    """ Ends the stage running, if any, and starts the stage name """
+    now = time.perf_counter()
+    if( self._stage is not None ):
+      stageName, stageStart, stageTime = self._stage
+      files, size = self.written( stageTime )
+      self.stages.append( {'stage': stageName, 'seconds': now - stageStart, 'files': files, 'bytes': size} )
+    self._stage = None if name is None else (name, now, time.time_ns())
+
+  def written( self, since ):
+    """ Returns the number and total size of the files under outputdir modified since the time since, in ns """
+    if( self.outputdir is None ):
+      return 0, 0
+    files = size = 0
+    for directory, subdirectories, filenames in os.walk( self.outputdir ):
+      for filename in filenames:
+        try:
+          status = os.stat( os.path.join(directory, filename) )
+        except OSError:
+          continue
+        if( status.st_mtime_ns >= since ):
+          files += 1
+          size += status.st_size
+    return files, size
+
+  def call( self, name, seconds, count=1 ):
+    record = self.calls.setdefault( name, [0, 0.0] )
+    record[0] += count
+    record[1] += seconds
+
+  def takeCalls( self ):
+    """ Returns the calls recorded so far and starts counting afresh, for worker processes to
+        hand theirs back with each job
+    """
+    calls, self.calls = self.calls, {}
+    return calls
+
+  def mergeCalls( self, calls ):
+    for name, (count, seconds) in calls.items():
+      self.call( name, seconds, count )
+
+  def page( self, kind, name, seconds ):
+    if( len(self.pages) < self.slowest ):
+      heapq.heappush( self.pages, (seconds, kind, name) )
+    elif( self.pages and seconds > self.pages[0][0] ):
+      heapq.heapreplace( self.pages, (seconds, kind, name) )
+
+  def report( self ):
+    """ Returns the profile as a dict for the JSON report """
+    files, size = self.written( self.startTime )
+    calls = sorted( self.calls.items(), key=lambda item: -item[1][1] )
+    return {
+      'command': sys.argv,
+      'seconds': time.perf_counter() - self.start,
+      'files': files,
+      'bytes': size,
+      'stages': self.stages,
+      'calls': [{'function': name, 'calls': count, 'seconds': seconds} for name, (count, seconds) in calls],
+      'slowest_pages': [{'kind': kind, 'page': name, 'seconds': seconds} for seconds, kind, name in sorted(self.pages, reverse=True)],
+    }
+
+
+def enable( outputdir=None, slowest=10, cprofileFilename=None ):
+  """ Starts recording a profile in this process, under cProfile too if given a file to dump its
+      stats to, and returns it
+  """
+  global PROFILE
+  PROFILE = Profile( outputdir, slowest )
+  if( cprofileFilename is not None ):
+    PROFILE._cprofile = (cProfile.Profile(), cprofileFilename)
+    PROFILE._cprofile[0].enable()
+  return PROFILE
+
+
+def finish( reportFilename ):
+  """ Ends the profile, writes its report to reportFilename and prints a summary """
+  global PROFILE
+  profile = PROFILE
+  if( profile is None ):
+    return
+  profile.stage( None )
+  if( profile._cprofile is not None ):
+    profiler, cprofileFilename = profile._cprofile
+    profiler.disable()
+    profiler.dump_stats( cprofileFilename )
+  PROFILE = None
+
+  report = profile.report()
+  with open(reportFilename, 'w') as outFile:
+    json.dump( report, outFile, indent=1 )
+
+  print("\nProfile: {:.3f}s, {} files, {} bytes written".format(report['seconds'], report['files'], report['bytes']))
+  for stage in report['stages']:
+    print("  {:<24} {:>9.3f}s {:>7} files {:>12} bytes".format(stage['stage'], stage['seconds'], stage['files'], stage['bytes']))
+  for call in report['calls'][:10]:
+    print("  {:<24} {:>9.3f}s {:>7} calls".format(call['function'], call['seconds'], call['calls']))
+  print("Profile written to {}".format(reportFilename))
+
+
+def stage( name ):
+  """ Ends the stage running, if any, and starts the stage name, when profiling """
+  if( PROFILE is not None ):
+    PROFILE.stage( name )
+
+
+def page( kind, name, seconds ):
+  """ Records the time taken to render a page, when profiling """
+  if( PROFILE is not None ):
+    PROFILE.page( kind, name, seconds )
+
+
+def profiled( function ):
+  """ Decorates function to be timed and counted on every call, when profiling """
+  name = function.__qualname__
+
+  @functools.wraps( function )
+  def wrapper( *args, **kwargs ):
+    if( PROFILE is None ):
+      return function( *args, **kwargs )
+    start = time.perf_counter()
+    try:
+      return function( *args, **kwargs )
+    finally:
+      PROFILE.call( name, time.perf_counter() - start )
+  return wrapper
@@ -20,8 +20,16 @@ import os
 import errno
 import argparse
 import csv
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 
-from util import urlSafe, mergeCodes, stripQuotesSpace
+import profiling
+from profiling import profiled
+from util import urlSafe, mergeCodes, stripQuotesSpace, CodeMatcher, CodeCorrections, codebookHash
+
+# Learned code corrections are cached here in the output directory between runs
+CORRECTIONS_CACHE = 'code_corrections.json'
 
 
 def sanitize(txt):
@@ -35,66 +43,145 @@ def sanitize(txt):
     return txt
 
 
-def add_line(line, outfile_name, num_codes, allCodes, codeCorrections):
-    with open(outfile_name, mode="a+") as outfile:
-        comma_split = line.strip().split(',')
-        # Hacks for codes that contained commas for the Remote Clinic study
-        # Retaining to highlight an example of what to do if you code too liberally
-        if 'Consultant unfamiliarity with specific platforms' in line:
-            i = comma_split.index('"Consultant unfamiliarity with specific platforms (e.g. Android vs. iOS')
-            joined_code = " / ".join(comma_split[i:i+2])
-            comma_split[i] = joined_code
-            comma_split = comma_split[:i+1] + comma_split[i+2:]
-        # General code merging
-        codes = comma_split[-num_codes:]
-        merged_codes = list()
-        for code in codes:
-            if code.strip() == "":
-                merged_code = ""
+def add_line(line, outfile, num_codes, allCodes, codeCorrections):
+    # outfile is an open, buffered handle owned by reformat(), shared by every line of a transcript
+    comma_split = line.strip().split(',')
+    # Hacks for codes that contained commas for the Remote Clinic study
+    # Retaining to highlight an example of what to do if you code too liberally
+    if 'Consultant unfamiliarity with specific platforms' in line:
+        i = comma_split.index('"Consultant unfamiliarity with specific platforms (e.g. Android vs. iOS')
+        joined_code = " / ".join(comma_split[i:i+2])
+        comma_split[i] = joined_code
+        comma_split = comma_split[:i+1] + comma_split[i+2:]
+    # General code merging
+    codes = comma_split[-num_codes:]
+    merged_codes = list()
+    for code in codes:
+        if code.strip() == "":
+            merged_code = ""
+        else:
+            strippedCode = urlSafe(stripQuotesSpace( code ))
+            if strippedCode not in allCodes:
+                merged_code, codeCorrections = mergeCodes(strippedCode, allCodes, codeCorrections, skip=False)
             else:
-                strippedCode = urlSafe(stripQuotesSpace( code ))
-                if strippedCode not in allCodes:
-                    merged_code, codeCorrections = mergeCodes(strippedCode, allCodes, codeCorrections, skip=False)
-                else:
-                    merged_code = strippedCode
-            merged_codes.append(merged_code)
-        speaker = comma_split[0]
-        utt = sanitize(",".join(comma_split[1:-num_codes]))
-        if speaker != '' and utt != '':
-            outfile_line = '{} =DELIM= {} =DELIM= '.format(speaker, utt)
-            for merged_code in merged_codes:
-                outfile_line += '{}, '.format(merged_code)
-            outfile.write(outfile_line+'\n')
-    outfile.close()
+                merged_code = strippedCode
+        merged_codes.append(merged_code)
+    speaker = comma_split[0]
+    utt = sanitize(",".join(comma_split[1:-num_codes]))
+    if speaker != '' and utt != '':
+        outfile_line = '{} =DELIM= {} =DELIM= '.format(speaker, utt)
+        for merged_code in merged_codes:
+            outfile_line += '{}, '.format(merged_code)
+        outfile.write(outfile_line+'\n')
     return codeCorrections
 
 
-def reformat(in_folder_name, out_folder_name, codes, codeCorrections):
-    for filename in os.listdir(in_folder_name):
-        participantID = filename[:-4]
-        if filename == '.DS_Store':
-            pass
-        elif '.csv' not in filename:  # it's a directory, so recursively call
-            reformat(in_folder_name + filename + '/', out_folder_name, codes, codeCorrections)
-        else:  # it's a file
-            infile_name = in_folder_name + filename
-            with open(infile_name) as infile:
-                num_codes = 0
-                outfile_name = out_folder_name + \
-                    urlSafe("{}.csv".format(participantID))
-                with open(outfile_name, mode="w+") as outfile:
-                    print("\ncreating " + outfile_name)
-                outfile.close()
-                for i, line in enumerate(infile):
-                    if line.replace(',', '').strip() == '':
-                        continue
-                    elif i == 0:
-                    # Use the first line to get the number of commas in the header row to get the variable number of tags.
-                        num_codes = len(line.split(',')[1:]) - 1
-                        print(outfile_name + ' num_codes: {}'.format(num_codes))
-                    else:
-                        codeCorrections = add_line(line, outfile_name, num_codes, codes, codeCorrections)
-            infile.close()
+def find_transcripts(in_folder_name):
+    """ Yields the path of every transcript CSV under in_folder_name, recursing into subdirectories """
+    with os.scandir(in_folder_name) as entries:
+        for entry in entries:
+            if entry.name == '.DS_Store':
+                continue
+            elif entry.is_dir():
+                yield from find_transcripts(in_folder_name + entry.name + '/')
+            elif '.csv' in entry.name:
+                yield in_folder_name + entry.name
+
+
+@profiled
+def reformat_file(infile_name, out_folder_name, codes, codeCorrections, buffer_size=-1):
+    """
+    Reformats a single transcript, writing it through one buffered handle.
+
+    :return: (number of input rows processed, codeCorrections)
+    """
+    participantID = os.path.basename(infile_name)[:-4]
+    outfile_name = out_folder_name + urlSafe("{}.csv".format(participantID))
+    num_rows = 0
+    with open(infile_name) as infile:
+        num_codes = 0
+        with open(outfile_name, mode="w", buffering=buffer_size) as outfile:
+            print("\ncreating " + outfile_name)
+            start = time.perf_counter()
+            for i, line in enumerate(infile):
+                if line.replace(',', '').strip() == '':
+                    continue
+                elif i == 0:
+                # Use the first line to get the number of commas in the header row to get the variable number of tags.
+                    num_codes = len(line.split(',')[1:]) - 1
+                    print(outfile_name + ' num_codes: {}'.format(num_codes))
+                else:
+                    codeCorrections = add_line(line, outfile, num_codes, codes, codeCorrections)
+                    num_rows += 1
+        print(outfile_name + ' ' + throughput(num_rows, time.perf_counter() - start))
+    return num_rows, codeCorrections
+
+
+def profile_file(*args):
+    """
+    Reformats a single transcript in a worker process, see reformat_file.
+
+    :return: (number of input rows processed, codeCorrections, seconds taken, calls profiling recorded)
+    """
+    start = time.perf_counter()
+    num_rows, codeCorrections = reformat_file(*args)
+    return num_rows, codeCorrections, time.perf_counter() - start, profiling.PROFILE.takeCalls()
+
+
+def reformat(in_folder_name, out_folder_name, codes, codeCorrections, buffer_size=-1, jobs=1):
+    """
+    Reformats every transcript under in_folder_name.
+
+    With jobs > 1, transcripts are fanned out to a pool of worker processes. Each worker starts
+    from a copy of codeCorrections, and the corrections they learn are merged back into it in
+    transcript order, first one wins, which is what a serial run would have recorded.
+
+    When profiling, the time each transcript took is recorded, along with the calls recorded by
+    the workers that reformatted them.
+
+    :param buffer_size: output buffer size in bytes, -1 for the io default
+    :param jobs: number of worker processes
+    :return: number of input rows processed
+    """
+    transcripts = list(find_transcripts(in_folder_name))
+    num_rows = 0
+    profile = profiling.PROFILE
+    if jobs <= 1:
+        for infile_name in transcripts:
+            start = time.perf_counter()
+            file_rows, codeCorrections = reformat_file(infile_name, out_folder_name, codes, codeCorrections, buffer_size)
+            profiling.page('transcript', infile_name, time.perf_counter() - start)
+            num_rows += file_rows
+        return num_rows
+
+    # Workers get a snapshot with fresh hit/miss counters, which are summed back in
+    snapshot = CodeCorrections(codeCorrections)
+    if profile is None:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(reformat_file, transcripts, repeat(out_folder_name), repeat(codes),
+                                        repeat(snapshot), repeat(buffer_size)))
+    else:
+        # Each worker records a profile of its own, handed back with every transcript
+        with ProcessPoolExecutor(max_workers=jobs, initializer=profiling.enable) as executor:
+            results = []
+            for infile_name, (file_rows, fileCorrections, seconds, calls) in zip(transcripts, executor.map(
+                    profile_file, transcripts, repeat(out_folder_name), repeat(codes), repeat(snapshot), repeat(buffer_size))):
+                profile.page('transcript', infile_name, seconds)
+                profile.mergeCalls(calls)
+                results.append((file_rows, fileCorrections))
+    for file_rows, fileCorrections in results:
+        num_rows += file_rows
+        codeCorrections.hits += fileCorrections.hits
+        codeCorrections.misses += fileCorrections.misses
+        for code, correction in fileCorrections.items():
+            codeCorrections.setdefault(code, correction)
+    return num_rows
+
+
+def throughput(num_rows, seconds):
+    """ Formats a rows/sec summary """
+    rate = num_rows / seconds if seconds > 0 else float('inf')
+    return '{} rows in {:.3f}s ({:.0f} rows/sec)'.format(num_rows, seconds, rate)
 
 
 if __name__ == "__main__":
@@ -105,8 +192,22 @@ if __name__ == "__main__":
     parser.add_argument(
         '-o', type=str, help="directory where the reformatted data will be sent. If it doesn't exist, it will be created.")
     parser.add_argument('-c', type=str, help="codebook to use for merging")
+    parser.add_argument(
+        '-b', '--buffer-size', type=int, default=-1, help="output buffer size in bytes (default: the io default)")
+    parser.add_argument(
+        '-d', '--max-distance', type=int, default=None, help="only merge unrecognized codes within this edit distance of a codebook code")
+    parser.add_argument(
+        '-j', '--jobs', type=int, default=1, help="number of transcripts to reformat in parallel (default: 1)")
+    parser.add_argument(
+        '--profile', type=str, metavar='REPORT', help="time each stage, function and transcript, and write the timings to this JSON file")
+    parser.add_argument(
+        '--profile-slowest', type=int, default=10, metavar='N', help="number of slowest transcripts to list in the --profile report (default: 10)")
+    parser.add_argument(
+        '--cprofile', type=str, metavar='STATS', help="with --profile, also run under cProfile and dump its stats to this file. Transcripts reformatted by -j workers aren't included")
 
     args = vars(parser.parse_args())
+    if args['cprofile'] and not args['profile']:
+        parser.error("--cprofile needs --profile")
     inputdir = args['i']
     if inputdir[-1] != '/':
         inputdir = inputdir + '/'
@@ -114,6 +215,10 @@ if __name__ == "__main__":
     if outputdir[-1] != '/':
         outputdir = outputdir + '/'
 
+    if args['profile']:
+        profiling.enable(outputdir, args['profile_slowest'], args['cprofile'])
+    profiling.stage('codebook')
+
     # First check the outputdir
     try:
         os.makedirs(outputdir)
@@ -134,7 +239,6 @@ if __name__ == "__main__":
 
     # Then extract codes from the codebook
     codes = []
-    codeCorrections = {}
     with open(args['c'], 'r') as codeFile:
         # Read in the codes
         codeReader = csv.reader(codeFile, dialect='excel')
@@ -144,4 +248,20 @@ if __name__ == "__main__":
             if( code != '' ):
                 codes.append( code )
 
-    reformat(inputdir, outputdir, codes, codeCorrections)
+    codes = CodeMatcher(codes, maxDistance=args['max_distance'])
+
+    # Reuse the corrections learned by earlier runs against the same codebook
+    cache_name = outputdir + CORRECTIONS_CACHE
+    cache_key = codebookHash(codes, args['max_distance'])
+    codeCorrections = CodeCorrections.load(cache_name, cache_key)
+
+    profiling.stage('reformat')
+    start = time.perf_counter()
+    num_rows = reformat(inputdir, outputdir, codes, codeCorrections, args['buffer_size'], args['jobs'])
+    print('\nReformatted ' + throughput(num_rows, time.perf_counter() - start))
+
+    codeCorrections.save(cache_name, cache_key)
+    print(codeCorrections.report())
+
+    if args['profile']:
+        profiling.finish(args['profile'])
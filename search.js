@@ -0,0 +1,474 @@
+// Search page of the HTML output of code-extract.py. Answers queries in the
+// browser from the search index in search/, written by search.py.
+//
+// The index lives in search/ as small script files, each of which calls
+// QCVSearch.receive(key, data) when loaded, so the page also works when opened
+// straight from disk. Quotes are numbered from 0 in the order of their
+// interviews. Only the shards a query needs are loaded:
+//
+//   index               {project, quotes, wordShards, quotesPerShard, pageSize, codes: [name],
+//                        threads: [[title, page basename, number of first quote]],
+//                        speakers: [[name, page basename]]}
+//   words/<shard>       [[word, quotes]], for the words that wordShard() puts in the shard
+//   positions/<shard>   [[word, positions]], for the same words
+//   quotes/<shard>      [[postID, speaker id, [code ids], text]], quotesPerShard quotes a shard
+//   codes/<code id>     the quotes tagged with the code
+//   speakers/<id>       the quotes of the speaker
+//
+// Lists of quotes are increasing, and stored as the difference of each quote
+// from the one before. A word's positions list, for each of its quotes in
+// turn, the number of times the word is in the quote, then its positions in
+// the quote, each as the difference from the last. Only phrases load them.
+//
+// A query is words and "quoted phrases", all of which a quote must contain.
+// Words are runs of letters, digits and underscores, lowercased, so a word
+// such as "don't" is searched for as the phrase "don t".
+
+var QCVSearch = (function () {
+  var shards = {};
+  var waiting = {};
+  // The word and position shards loaded so far, as Maps of word -> list
+  var wordMaps = {};
+  var index = null;
+  var WORD = /[\p{L}\p{N}_]+/gu;
+  // Results are shown this many at a time
+  var RESULTS_PER_PAGE = 100;
+
+  function receive(key, data) {
+    shards[key] = data;
+    var callbacks = waiting[key] || [];
+    delete waiting[key];
+    callbacks.forEach(function (callback) { callback(data); });
+  }
+
+  // Calls callback with the shard, or with null if it can't be loaded
+  function load(key, callback) {
+    if (key in shards) {
+      callback(shards[key]);
+      return;
+    }
+    if (key in waiting) {
+      waiting[key].push(callback);
+      return;
+    }
+    waiting[key] = [callback];
+    var script = document.createElement('script');
+    script.src = 'search/' + key + '.js';
+    script.onerror = function () { receive(key, null); };
+    document.head.appendChild(script);
+  }
+
+  function loadAll(keys, callback) {
+    var results = {};
+    var remaining = keys.length;
+    if (remaining === 0) {
+      callback(results);
+      return;
+    }
+    keys.forEach(function (key) {
+      load(key, function (data) {
+        results[key] = data;
+        remaining -= 1;
+        if (remaining === 0) {
+          callback(results);
+        }
+      });
+    });
+  }
+
+  //////////////////////////////////////////////////////////////////////////////
+  // Words and postings. tokenize() and wordShard() match search.py's
+  //////////////////////////////////////////////////////////////////////////////
+
+  function tokenize(text) {
+    return text.toLowerCase().match(WORD) || [];
+  }
+
+  function wordShard(word) {
+    var h = 0;
+    for (var character of word) {
+      h = (Math.imul(h, 31) + character.codePointAt(0)) >>> 0;
+    }
+    return h % index.wordShards;
+  }
+
+  // Returns the list of word in the loaded shard of kind, words or positions,
+  // empty if it isn't in any quote
+  function wordList(kind, word, loaded) {
+    var key = kind + '/' + wordShard(word);
+    if (!(key in wordMaps)) {
+      wordMaps[key] = new Map(loaded[key] || []);
+    }
+    return wordMaps[key].get(word) || [];
+  }
+
+  // Returns where the positions of a word in each of its quotes start in its
+  // positions list
+  function positionStarts(positions) {
+    var starts = [];
+    var i = 0;
+    while (i < positions.length) {
+      starts.push(i);
+      i += 1 + positions[i];
+    }
+    return starts;
+  }
+
+  // Returns the positions of a decoded word, {quotes, positions, starts}, in the k-th of its quotes
+  function positionsAt(word, k) {
+    var start = word.starts[k];
+    var positions = new Array(word.positions[start]);
+    var position = 0;
+    for (var j = 0; j < positions.length; j++) {
+      position += word.positions[start + 1 + j];
+      positions[j] = position;
+    }
+    return positions;
+  }
+
+  function decodeQuotes(differences) {
+    var quote = 0;
+    return differences.map(function (difference) {
+      quote += difference;
+      return quote;
+    });
+  }
+
+  // Splits a query into clauses, each a list of words that must appear one
+  // after another. A quoted phrase is one clause, as is each unquoted word
+  function parseQuery(query) {
+    var clauses = [];
+    var term = /"([^"]*)"?|[^\s"]+/g;
+    var match;
+    while ((match = term.exec(query)) !== null) {
+      var words = tokenize(match[1] !== undefined ? match[1] : match[0]);
+      if (words.length > 0) {
+        clauses.push(words);
+      }
+    }
+    return clauses;
+  }
+
+  // Returns the quotes, in increasing order, that contain the words of a clause
+  // one after another. Every word's quotes are walked through together, as
+  // they are all in increasing order. postings maps each word to its decoded
+  // {quotes, positions, starts}, with positions only for words in phrases
+  function clauseQuotes(clause, postings) {
+    var words = clause.map(function (word) { return postings[word]; });
+    if (words.length === 1) {
+      return words[0].quotes;
+    }
+    var next = words.map(function () { return 0; });
+    var quotes = [];
+    words[0].quotes.forEach(function (quote, k) {
+      var found = [k];
+      for (var i = 1; i < words.length; i++) {
+        var otherQuotes = words[i].quotes;
+        while (next[i] < otherQuotes.length && otherQuotes[next[i]] < quote) {
+          next[i] += 1;
+        }
+        if (otherQuotes[next[i]] !== quote) {
+          return;
+        }
+        found.push(next[i]);
+      }
+      var following = found.slice(1).map(function (other, i) { return new Set(positionsAt(words[i + 1], other)); });
+      var matches = positionsAt(words[0], k).some(function (position) {
+        return following.every(function (positions, i) { return positions.has(position + i + 1); });
+      });
+      if (matches) {
+        quotes.push(quote);
+      }
+    });
+    return quotes;
+  }
+
+  // Returns the quotes in both of two increasing lists
+  function intersect(quotes, others) {
+    var both = [];
+    var j = 0;
+    quotes.forEach(function (quote) {
+      while (j < others.length && others[j] < quote) {
+        j += 1;
+      }
+      if (others[j] === quote) {
+        both.push(quote);
+      }
+    });
+    return both;
+  }
+
+  function range(start, end) {
+    var quotes = [];
+    for (var quote = start; quote < end; quote++) {
+      quotes.push(quote);
+    }
+    return quotes;
+  }
+
+  function threadQuotes(threadId) {
+    var end = threadId + 1 < index.threads.length ? index.threads[threadId + 1][2] : index.quotes;
+    return [index.threads[threadId][2], end];
+  }
+
+  // Calls callback with the quotes, in increasing order, matching query and
+  // filters, {code, interview, speaker} ids or '' for any
+  function search(query, filters, callback) {
+    var clauses = parseQuery(query);
+    var words = [];
+    clauses.forEach(function (clause) {
+      clause.forEach(function (word) {
+        if (words.indexOf(word) < 0) {
+          words.push(word);
+        }
+      });
+    });
+    // Positions are only needed to tell whether the words of a phrase are in order
+    var phraseWords = [];
+    clauses.forEach(function (clause) {
+      if (clause.length > 1) {
+        phraseWords = phraseWords.concat(clause);
+      }
+    });
+    var keys = [];
+    function need(key) {
+      if (keys.indexOf(key) < 0) {
+        keys.push(key);
+      }
+    }
+    words.forEach(function (word) { need('words/' + wordShard(word)); });
+    phraseWords.forEach(function (word) { need('positions/' + wordShard(word)); });
+    if (filters.code !== '') {
+      keys.push('codes/' + filters.code);
+    }
+    if (filters.speaker !== '') {
+      keys.push('speakers/' + filters.speaker);
+    }
+
+    loadAll(keys, function (loaded) {
+      var postings = {};
+      words.forEach(function (word) {
+        postings[word] = {quotes: decodeQuotes(wordList('words', word, loaded))};
+        if (phraseWords.indexOf(word) >= 0) {
+          postings[word].positions = wordList('positions', word, loaded);
+          postings[word].starts = positionStarts(postings[word].positions);
+        }
+      });
+      // Starting from the rarest clause keeps the lists intersected short
+      clauses.sort(function (a, b) { return postings[a[0]].quotes.length - postings[b[0]].quotes.length; });
+
+      var quotes = null;
+      clauses.forEach(function (clause) {
+        var matching = clauseQuotes(clause, postings);
+        quotes = quotes === null ? matching : intersect(quotes, matching);
+      });
+      // An interview's quotes are numbered one after another
+      if (filters.interview !== '') {
+        var bounds = threadQuotes(parseInt(filters.interview, 10));
+        quotes = quotes === null ? range(bounds[0], bounds[1]) :
+          quotes.filter(function (quote) { return quote >= bounds[0] && quote < bounds[1]; });
+      }
+      ['code', 'speaker'].forEach(function (name) {
+        if (filters[name] === '') {
+          return;
+        }
+        var allowed = decodeQuotes(loaded[(name === 'code' ? 'codes/' : 'speakers/') + filters[name]] || []);
+        quotes = quotes === null ? allowed : intersect(quotes, allowed);
+      });
+      callback(quotes || [], words);
+    });
+  }
+
+  //////////////////////////////////////////////////////////////////////////////
+  // Results
+  //////////////////////////////////////////////////////////////////////////////
+
+  function el(tag, attrs, children) {
+    var node = document.createElement(tag);
+    Object.keys(attrs || {}).forEach(function (name) {
+      node.setAttribute(name, attrs[name]);
+    });
+    (children || []).forEach(function (child) {
+      node.appendChild(typeof child === 'string' || typeof child === 'number' ?
+        document.createTextNode(String(child)) : child);
+    });
+    return node;
+  }
+
+  // Returns the nodes of text, with the words searched for marked
+  function highlight(text, words) {
+    var nodes = [];
+    var last = 0;
+    var match;
+    var word = new RegExp(WORD.source, 'gu');
+    while ((match = word.exec(text)) !== null) {
+      if (words.indexOf(match[0].toLowerCase()) >= 0) {
+        nodes.push(text.slice(last, match.index));
+        nodes.push(el('mark', {}, [match[0]]));
+        last = match.index + match[0].length;
+      }
+    }
+    nodes.push(text.slice(last));
+    return nodes;
+  }
+
+  // Returns the id of the interview quote is in
+  function quoteThread(quote) {
+    var low = 0;
+    var high = index.threads.length - 1;
+    while (low < high) {
+      var middle = (low + high + 1) >> 1;
+      if (index.threads[middle][2] <= quote) {
+        low = middle;
+      } else {
+        high = middle - 1;
+      }
+    }
+    return low;
+  }
+
+  // The page of the interview that a quote is on, as Thread.postPage names it
+  function quotePage(thread, postID) {
+    var pageNumber = index.pageSize > 0 ? Math.floor((postID - 1) / index.pageSize) + 1 : 1;
+    return thread[1] + (pageNumber > 1 ? '_page' + pageNumber : '') + '.html#' + postID;
+  }
+
+  function resultRow(quote, row, words) {
+    var thread = index.threads[quoteThread(quote)];
+    var speaker = index.speakers[row[1]];
+    var codes = [];
+    row[2].forEach(function (codeId, i) {
+      if (i > 0) {
+        codes.push(el('br'));
+        codes.push(el('br'));
+      }
+      codes.push(el('a', {href: index.codes[codeId] + '.html'}, [index.codes[codeId]]));
+    });
+    return el('tr', {}, [
+      el('td', {}, [el('a', {href: thread[1] + '.html'}, [thread[0]])]),
+      el('td', {}, [el('a', {href: speaker[1] + '.html'}, [speaker[0]])]),
+      el('td', {}, [el('a', {href: quotePage(thread, row[0])}, highlight(row[3], words))]),
+      el('td', {}, codes)
+    ]);
+  }
+
+  // Appends the results from start on, a page of them, loading the shards of their quotes
+  function showResults(quotes, words, start) {
+    var table = document.getElementById('search-results');
+    var more = document.getElementById('search-more');
+    var shown = quotes.slice(start, start + RESULTS_PER_PAGE);
+    var keys = [];
+    shown.forEach(function (quote) {
+      var key = 'quotes/' + Math.floor(quote / index.quotesPerShard);
+      if (keys.indexOf(key) < 0) {
+        keys.push(key);
+      }
+    });
+    loadAll(keys, function (loaded) {
+      if (start === 0) {
+        table.innerHTML = '';
+        table.appendChild(el('tr', {'class': 'table-header'}, [
+          el('th', {width: '15%'}, ['interview']),
+          el('th', {width: '15%'}, ['speaker']),
+          el('th', {width: '50%'}, ['quote']),
+          el('th', {width: '20%'}, ['codes'])
+        ]));
+      }
+      shown.forEach(function (quote) {
+        var rows = loaded['quotes/' + Math.floor(quote / index.quotesPerShard)];
+        table.appendChild(resultRow(quote, rows[quote % index.quotesPerShard], words));
+      });
+      more.innerHTML = '';
+      if (start + RESULTS_PER_PAGE < quotes.length) {
+        var button = el('button', {type: 'button'}, ['more results']);
+        button.addEventListener('click', function () { showResults(quotes, words, start + RESULTS_PER_PAGE); });
+        more.appendChild(button);
+      }
+    });
+  }
+
+  //////////////////////////////////////////////////////////////////////////////
+  // The form. Its state is kept in the location's hash, so searches can be
+  // linked to and gone back to
+  //////////////////////////////////////////////////////////////////////////////
+
+  var FILTERS = ['code', 'interview', 'speaker'];
+
+  function fillFilters() {
+    var names = {
+      code: index.codes,
+      interview: index.threads.map(function (thread) { return thread[0]; }),
+      speaker: index.speakers.map(function (speaker) { return speaker[0]; })
+    };
+    FILTERS.forEach(function (filter) {
+      var select = document.getElementById('search-' + filter);
+      names[filter].forEach(function (name, id) {
+        select.appendChild(el('option', {value: id}, [name]));
+      });
+    });
+  }
+
+  function run() {
+    var params = new URLSearchParams(window.location.hash.replace(/^#/, ''));
+    var query = params.get('q') || '';
+    var filters = {};
+    document.getElementById('search-query').value = query;
+    FILTERS.forEach(function (filter) {
+      filters[filter] = params.get(filter) || '';
+      document.getElementById('search-' + filter).value = filters[filter];
+    });
+    var status = document.getElementById('search-status');
+    document.getElementById('search-results').innerHTML = '';
+    document.getElementById('search-more').innerHTML = '';
+    if (parseQuery(query).length === 0 && FILTERS.every(function (filter) { return filters[filter] === ''; })) {
+      status.textContent = 'Search the ' + index.quotes + ' quotes for words and "quoted phrases".';
+      return;
+    }
+    var started = performance.now();
+    status.textContent = 'Searching...';
+    search(query, filters, function (quotes, words) {
+      status.textContent = quotes.length + (quotes.length === 1 ? ' quote' : ' quotes') +
+        ' found in ' + Math.round(performance.now() - started) + ' ms';
+      if (quotes.length > 0) {
+        showResults(quotes, words, 0);
+      }
+    });
+  }
+
+  function submit(event) {
+    event.preventDefault();
+    var params = new URLSearchParams();
+    params.set('q', document.getElementById('search-query').value);
+    FILTERS.forEach(function (filter) {
+      var value = document.getElementById('search-' + filter).value;
+      if (value !== '') {
+        params.set(filter, value);
+      }
+    });
+    var hash = '#' + params.toString();
+    if (window.location.hash === hash) {
+      run();
+    } else {
+      window.location.hash = hash;
+    }
+  }
+
+  function start() {
+    load('index', function (data) {
+      if (data === null) {
+        document.getElementById('search-status').textContent =
+          'This build has no search index. Builds with --memory-budget don\'t write one.';
+        return;
+      }
+      index = data;
+      fillFilters();
+      document.getElementById('search-form').addEventListener('submit', submit);
+      window.addEventListener('hashchange', run);
+      run();
+    });
+  }
+
+  document.addEventListener('DOMContentLoaded', start);
+
+  return {receive: receive, search: search, tokenize: tokenize};
+})();
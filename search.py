@@ -0,0 +1,164 @@
+"""
+search.py
+---------
+
+The full-text search index of a build, over the text of every quote. The quotes are numbered in
+the order of their interviews, and their text is split into words, lowercased, each with its
+position in the quote. A word's postings, the quotes it is in and its positions in each, are
+stored with those of the other words that hash to the same shard, so the search page only loads
+the shards of the words in a query. The positions are kept in shards apart from the quotes, as
+only phrases need them. The quotes themselves, and the quotes of each code and speaker to filter
+on, are stored in shards of their own.
+
+search.js reads the index, and documents the format of its shards. Its tokenize() and wordShard()
+have to split and hash words exactly as these do.
+
+"""
+
+import re
+from array import array
+
+from util import urlSafe
+
+# Words are runs of letters, digits and underscores, the \w of Python and [\p{L}\p{N}_] in search.js
+WORD = re.compile( r'\w+' )
+
+# The postings are split into as many shards as it takes, in powers of two, to keep each to about
+# this many numbers
+SHARD_SIZE = 1 << 15
+
+# Quotes per shard of quotes
+QUOTES_PER_SHARD = 256
+
+
+def tokenize( text ):
+  """ Returns the words of text, lowercased, in order """
+  return WORD.findall( text.lower() )
+
+
+def wordShard( word, shards ):
+  """ Returns the shard of word's postings, from a 32-bit hash of its code points """
+  h = 0
+  for character in word:
+    h = (h * 31 + ord(character)) & 0xffffffff
+  return h % shards
+
+
+def deltas( values ):
+  """ Returns increasing values as the differences between each and the one before it """
+  previous = 0
+  result = []
+  for value in values:
+    result.append( value - previous )
+    previous = value
+  return result
+
+
+class SearchIndex(object):
+  """ The inverted index of the quotes of a build.
+
+      Attributes:
+        codes <list str>: the codes, numbered in codebook order
+        speakers <list str>: the speakers, numbered in the order they first speak
+        threads <list>: (thread, number of its first quote) of each interview, in order
+        quotes <int>: number of quotes indexed
+        postings <dict>: {word: (quotes, positions)}, arrays of the quotes the word is in, each as the
+          difference from the last, and for each of those quotes the number of positions of the
+          word in it, then the positions as differences from the last
+        codeQuotes <list list int>: the numbers of the quotes of each code
+        speakerQuotes <list list int>: the numbers of the quotes of each speaker
+  """
+
+  def __init__( self, threads, codes, speakers ):
+    self.codes = list(codes)
+    self.speakers = list(speakers)
+    self.threads = []
+    self.quotes = 0
+    self.postings = {}
+    self._lastQuote = {}
+    codeIds = {code: i for i, code in enumerate(self.codes)}
+    speakerIds = {name: i for i, name in enumerate(self.speakers)}
+    self.codeQuotes = [[] for code in self.codes]
+    self.speakerQuotes = [[] for name in self.speakers]
+    self._quoteRows = []
+
+    for thread in threads:
+      self.threads.append( (thread, self.quotes) )
+      for post in thread.posts:
+        quote = self.quotes
+        self.quotes += 1
+        self._addWords( quote, tokenize(post.text) )
+        postCodes = [codeIds[code] for code in post.codes if code in codeIds]
+        for codeId in postCodes:
+          self.codeQuotes[codeId].append( quote )
+        speakerId = speakerIds[post.poster]
+        self.speakerQuotes[speakerId].append( quote )
+        self._quoteRows.append( [int(post.postID), speakerId, postCodes, post.text] )
+
+  def _addWords( self, quote, words ):
+    # Most words are in a quote once, so only the ones repeated get a list of their positions
+    firstPositions = {}
+    repeated = {}
+    for position, word in enumerate(words):
+      if( word not in firstPositions ):
+        firstPositions[word] = position
+      elif( word in repeated ):
+        repeated[word].append( position )
+      else:
+        repeated[word] = [firstPositions[word], position]
+
+    allPostings = self.postings
+    lastQuote = self._lastQuote
+    for word, position in firstPositions.items():
+      postings = allPostings.get( word )
+      if( postings is None ):
+        postings = allPostings[word] = (array( 'i' ), array( 'i' ))
+        lastQuote[word] = 0
+      quotes, positions = postings
+      quotes.append( quote - lastQuote[word] )
+      if( word in repeated ):
+        positions.append( len(repeated[word]) )
+        positions.extend( deltas(repeated[word]) )
+      else:
+        positions.extend( (1, position) )
+      lastQuote[word] = quote
+
+  def numShards( self ):
+    """ Returns the number of shards to split the postings into """
+    size = sum( len(quotes) + len(positions) for quotes, positions in self.postings.values() )
+    shards = 1
+    while( size > shards * SHARD_SIZE ):
+      shards *= 2
+    return shards
+
+  def shards( self, project_title, pageSize=0 ):
+    """ Yields (key, data) for every shard of the index, as search.js reads them """
+    shards = self.numShards()
+    yield 'index', {
+      'project': project_title,
+      'quotes': self.quotes,
+      'wordShards': shards,
+      'quotesPerShard': QUOTES_PER_SHARD,
+      'pageSize': pageSize,
+      'codes': self.codes,
+      'threads': [[thread.title, thread.outFileBase, first] for thread, first in self.threads],
+      'speakers': [[name, urlSafe(name)] for name in self.speakers],
+    }
+
+    # As [word, list] pairs, since a word can be any key, even one special to a JavaScript object
+    words = [[] for shard in range(shards)]
+    positions = [[] for shard in range(shards)]
+    for word, (wordQuotes, wordPositions) in self.postings.items():
+      shard = wordShard( word, shards )
+      words[shard].append( [word, wordQuotes.tolist()] )
+      positions[shard].append( [word, wordPositions.tolist()] )
+    for shard in range(shards):
+      yield 'words/{}'.format(shard), words[shard]
+      yield 'positions/{}'.format(shard), positions[shard]
+
+    for start in range(0, self.quotes, QUOTES_PER_SHARD):
+      yield 'quotes/{}'.format(start // QUOTES_PER_SHARD), self._quoteRows[start:start + QUOTES_PER_SHARD]
+    for codeId, quotes in enumerate(self.codeQuotes):
+      yield 'codes/{}'.format(codeId), deltas(quotes)
+    for speakerId, quotes in enumerate(self.speakerQuotes):
+      yield 'speakers/{}'.format(speakerId), deltas(quotes)
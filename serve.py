@@ -0,0 +1,377 @@
+#!/usr/bin/python3
+import sys
+
+if sys.version_info[0] != 3:
+    print("This script requires Python version 3")
+    sys.exit(1)
+
+"""
+serve.py
+--------
+
+Serves a project's pages from a local web server, rendering each one only
+when it is asked for, instead of building the whole site to look at a few
+codes. The codebook and transcripts are read once at startup, the same way
+code-extract.py reads them, and nothing is rendered until a page is
+requested. Each page is then rendered from the parsed posts by the same
+generators a build uses, and kept in a cache of recently viewed pages of a
+bounded size.
+
+The codebook and transcripts are checked for changes on every request. When
+any has changed they are read again and the cache is emptied, so reloading a
+page shows the edited transcripts.
+
+"""
+
+import argparse
+import contextlib
+import csv
+import importlib.util
+import io
+import mimetypes
+import os
+import re
+import tempfile
+import time
+import traceback
+from collections import OrderedDict
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from pathlib import Path
+from urllib.parse import urlsplit, unquote
+
+from output import setSink, takeOutput, FileSink, CollectingSink
+from util import urlSafe, stripQuotesSpace, CodeMatcher, CodeCorrections
+from generators import genIndex, genHistograms, genCooccurrenceHTML, genCodeCounts, genCooccurrenceCSV, genStylesheet, genSearchIndex
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Later pages of a split page share the route of the first
+PAGE_SUFFIX = re.compile(r'^(.*)_page[0-9]+(\.html)$')
+
+
+def load_extractor():
+    """ Imports code-extract.py, whose name isn't a module name """
+    spec = importlib.util.spec_from_file_location('code_extract', os.path.join(HERE, 'code-extract.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def list_transcripts(transcripts):
+    """ Returns the transcript CSVs to read, given the files or directory passed, in the order
+        code-extract.py reads them
+    """
+    if Path(transcripts[0]).is_dir():
+        return [os.path.join(transcripts[0], path.name) for path in Path(transcripts[0]).glob('*.csv')]
+    return list(transcripts)
+
+
+def read_codebook(codebook):
+    """ Returns the codes of the codebook, in order """
+    codes = []
+    with open(codebook, 'r') as code_file:
+        for row in csv.reader(code_file, dialect='excel'):
+            code = urlSafe(stripQuotesSpace(row[0]))
+            if code != '':
+                codes.append(code)
+    return codes
+
+
+class PageCache(object):
+    """ The most recently used rendered files, {path: bytes}, holding at most max_bytes of them """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._files = OrderedDict()
+
+    def get(self, path):
+        data = self._files.get(path)
+        if data is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._files.move_to_end(path)
+        return data
+
+    def put(self, path, data):
+        if path in self._files:
+            self.size -= len(self._files.pop(path))
+        self._files[path] = data
+        self.size += len(data)
+        # The file just put is kept even if it is bigger than the cache on its own
+        while self.size > self.max_bytes and len(self._files) > 1:
+            path, evicted = self._files.popitem(last=False)
+            self.size -= len(evicted)
+
+    def clear(self):
+        self._files.clear()
+        self.size = 0
+
+    def __len__(self):
+        return len(self._files)
+
+
+class Site(object):
+    """ The parsed project, and the pages rendered from it on demand.
+
+        Each page job is rendered into a CollectingSink rooted at a scratch
+        directory, so the paths of the files it writes, relative to that
+        directory, are the paths they are served at, e.g. html/index.html.
+    """
+
+    def __init__(self, extract, project_title, codebook, transcripts, page_size, cache_bytes, root):
+        self.extract = extract
+        self.project_title = project_title
+        self.codebook = codebook
+        self.transcripts = transcripts
+        self.page_size = page_size
+        self.root = root
+        self.cache = PageCache(cache_bytes)
+        self.inputs = None
+        self.read()
+
+    def input_state(self):
+        """ Returns the modification time and size of every input file, to tell when one changes """
+        files = [self.codebook] + list_transcripts(self.transcripts)
+        state = []
+        for filename in files:
+            try:
+                status = os.stat(filename)
+            except OSError:
+                state.append((filename, None))
+                continue
+            state.append((filename, status.st_mtime_ns, status.st_size))
+        return state
+
+    def read(self):
+        """ Parses the codebook and transcripts into the model pages are rendered from """
+        start = time.perf_counter()
+        inputs = self.input_state()
+        extract = self.extract
+        codes = read_codebook(self.codebook)
+        code_counts = {code: {'posters': set(), 'threads': set(), 'posts': 0} for code in codes}
+        with contextlib.redirect_stdout(io.StringIO()):
+            threads, code_counts, posters, code_posts = extract.readOriginalCSVs(
+                list_transcripts(self.transcripts), CodeMatcher(codes), self.root, code_counts, CodeCorrections())
+        for thread in threads:
+            thread.pageSize = self.page_size
+
+        self.inputs = inputs
+        self.codes = codes
+        self.code_counts = code_counts
+        self.threads = threads
+        self.posters = posters
+        self.cooccurrences = None
+        extract.initRenderer({
+            'outputdir': self.root,
+            'project_title': self.project_title,
+            'pageSize': self.page_size,
+            'renderThreads': threads,
+            'posters': posters,
+            'threads': threads,
+            'codePosts': code_posts,
+            'codeIds': extract.CODE_IDS,
+            'speakerIds': extract.SPEAKER_IDS,
+        })
+        self.routes = self.page_routes(codes, code_counts, threads, posters)
+        self.cache.clear()
+        print('Read {} interviews, {} speakers and {} codes in {:.3f}s'.format(
+            len(threads), len(posters), len(codes), time.perf_counter() - start))
+
+    def page_routes(self, codes, code_counts, threads, posters):
+        """ Returns {path: page job} for every file a build would write. They are listed in the
+            order a build writes them, so a path two pages share goes to the one written last,
+            as it would on disk
+        """
+        routes = {}
+        for name in posters:
+            username = urlSafe(name)
+            for base in (username, username + '_interviews', username + '_quotes'):
+                routes['html/' + base + '.html'] = ('poster', name)
+        for i, thread in enumerate(threads):
+            routes['html/' + thread.outFileBase + '.html'] = ('thread', i)
+        for code in codes:
+            routes['html/' + code + '.html'] = ('code', code)
+            routes['html/' + code + '_interviews.html'] = ('code', code)
+        for i, thread in enumerate(threads):
+            routes['csv/interviews/' + thread.outFileBase + '.csv'] = ('threadCSV', i)
+        for code in codes:
+            routes['csv/codes/' + code + '.csv'] = ('codeCSV', code)
+        for code in codes:
+            for title in code_counts[code]['threads']:
+                routes['html/' + code + '_' + title + '.html'] = ('codePerTrans', code)
+        for name in ('index', 'histograms', 'cooccurrence'):
+            routes['html/' + name + '.html'] = (name, None)
+        routes['csv/code_counts.csv'] = ('codeCounts', None)
+        routes['csv/code_cooccurrence.csv'] = ('cooccurrenceCSV', None)
+        routes['html/search.html'] = ('search', None)
+        routes['html/search.js'] = ('search', None)
+        routes['html/layout.css'] = ('stylesheet', None)
+        routes['html/sortable.js'] = ('stylesheet', None)
+        return routes
+
+    def route(self, path):
+        """ Returns the page job that writes path, or None """
+        if path in self.routes:
+            return self.routes[path]
+        # The shards of the search index are written along with the search page
+        if path.startswith('html/search/'):
+            return ('search', None)
+        paged = PAGE_SUFFIX.match(path)
+        if paged is not None:
+            return self.routes.get(paged.group(1) + paged.group(2))
+        return None
+
+    def render(self, kind, key):
+        """ Renders a page job, returning the files it wrote as {path: bytes} """
+        outputdir = self.root
+        setSink(CollectingSink())
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                if kind == 'index':
+                    genIndex(self.threads, outputdir, self.code_counts, self.project_title)
+                elif kind == 'histograms':
+                    genHistograms(self.threads, outputdir, self.code_counts, self.project_title)
+                elif kind == 'cooccurrence':
+                    genCooccurrenceHTML(self.cooccurrence_counts(), outputdir, self.project_title)
+                elif kind == 'codeCounts':
+                    genCodeCounts(self.code_counts, outputdir)
+                elif kind == 'cooccurrenceCSV':
+                    genCooccurrenceCSV(self.cooccurrence_counts(), outputdir)
+                elif kind == 'stylesheet':
+                    genStylesheet(outputdir)
+                elif kind == 'search':
+                    genSearchIndex(self.threads, self.codes, self.posters, outputdir, self.project_title, self.page_size)
+                else:
+                    self.extract.renderPage(kind, key)
+            tasks = takeOutput()
+        finally:
+            setSink(FileSink())
+        files = {}
+        for task in tasks:
+            if task[0] == 'write':
+                filename, data, mode = task[1:]
+                path = os.path.relpath(filename, outputdir)
+                # A file written a piece at a time, like a CSV from an OutputPool, is appended to
+                if mode == 'a':
+                    files[path] = files.get(path, b'') + data.encode('utf-8')
+                else:
+                    files[path] = data.encode('utf-8')
+            elif task[0] == 'copy':
+                with open(task[1], 'rb') as source_file:
+                    files[os.path.relpath(task[2], outputdir)] = source_file.read()
+        return files
+
+    def cooccurrence_counts(self):
+        if self.cooccurrences is None:
+            self.cooccurrences = self.extract.countCooccurrences(self.threads, self.codes)
+        return self.cooccurrences
+
+    def get(self, path):
+        """ Returns the contents of the file at path, rendering it if it isn't cached, or None if
+            no page job writes it. Reads the inputs again first if any of them changed
+        """
+        if self.input_state() != self.inputs:
+            print('Inputs changed, reading them again')
+            self.read()
+        data = self.cache.get(path)
+        if data is not None:
+            return data
+        job = self.route(path)
+        if job is None:
+            return None
+        files = self.render(*job)
+        # The page asked for goes in last, as the most recently used. A file whose path is another
+        # job's, such as a speaker page named like an interview, isn't the one served at that path
+        data = files.pop(path, None)
+        for filename, contents in files.items():
+            if self.route(filename) == job:
+                self.cache.put(filename, contents)
+        if data is not None:
+            self.cache.put(path, data)
+        return data
+
+
+class PageHandler(BaseHTTPRequestHandler):
+    """ Serves the files of the server's site, with / going to the index page """
+
+    def do_GET(self):
+        path = unquote(urlsplit(self.path).path).lstrip('/')
+        if path == '':
+            self.send_response(302)
+            self.send_header('Location', '/html/index.html')
+            self.end_headers()
+            return
+        start = time.perf_counter()
+        try:
+            data = self.server.site.get(path)
+        except Exception as error:
+            traceback.print_exc()
+            self.send_error(500, 'Error rendering {}: {}'.format(path, error))
+            return
+        if data is None:
+            self.send_error(404, 'No page {}'.format(path))
+            return
+        content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        if content_type.startswith('text/') or content_type.endswith('javascript'):
+            content_type += '; charset=utf-8'
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        # Pages change when the transcripts do, so browsers ask again every time
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(data)
+        self.server.site_log('{} {:.1f}ms'.format(path, (time.perf_counter() - start) * 1000))
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SiteServer(HTTPServer):
+    """ Serves one request at a time, since pages are rendered through the process's global sink
+        and renderer state
+    """
+
+    def __init__(self, address, site, quiet=False):
+        HTTPServer.__init__(self, address, PageHandler)
+        self.site = site
+        self.quiet = quiet
+
+    def site_log(self, message):
+        if not self.quiet:
+            cache = self.site.cache
+            print('{} [cache: {} files, {} bytes, {} hits, {} misses]'.format(
+                message, len(cache), cache.size, cache.hits, cache.misses))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Serve the pages of a project, rendering each one when it is first asked for.')
+    parser.add_argument('-p', '--page-size', type=int, default=0, help="split code, interview and speaker quote pages into pages of this many quotes (default: 0, no splitting)")
+    parser.add_argument('--host', type=str, default='127.0.0.1', help="address to listen on (default: 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=8000, help="port to listen on (default: 8000)")
+    parser.add_argument('--cache-size', type=float, default=64, metavar='MB', help="megabytes of rendered pages to keep (default: 64)")
+    parser.add_argument('-q', '--quiet', action='store_true', help="don't print a line for every request")
+    parser.add_argument('project', metavar='project', help="name of project")
+    parser.add_argument('codebook', metavar='codebook', help='the codebook CSV file')
+    parser.add_argument('transcripts', metavar='transcripts', help='one or more transcript CSV files, or a directory', nargs='+')
+    args = vars(parser.parse_args())
+
+    # The pages are never written out, but the generators build their paths from an output
+    # directory, and look in it for pages left over from earlier builds
+    with tempfile.TemporaryDirectory(prefix='serve-') as root:
+        os.makedirs(os.path.join(root, 'html'))
+        os.makedirs(os.path.join(root, 'csv'))
+        site = Site(load_extractor(), args['project'], args['codebook'], args['transcripts'],
+                    args['page_size'], int(args['cache_size'] * 2**20), root)
+        server = SiteServer((args['host'], args['port']), site, args['quiet'])
+        print('Serving {} at http://{}:{}/'.format(args['project'], args['host'], server.server_port))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,48 @@
+// Sorts the rows of every table.sortable on a column when its header is clicked. Clicking the
+// same header again reverses the order. Columns of numbers sort largest first, others A to Z.
+
+(function () {
+  function cellValue(row, column) {
+    var text = row.cells[column].textContent.trim();
+    var number = Number(text);
+    return text !== '' && !isNaN(number) ? number : text.toLowerCase();
+  }
+
+  function compare(a, b) {
+    if (typeof a === 'number' && typeof b === 'number') {
+      return b - a;
+    }
+    return String(a).localeCompare(String(b));
+  }
+
+  function sortTable(table, column, reverse) {
+    var header = table.rows[0];
+    var rows = Array.prototype.slice.call(table.rows, 1);
+    rows.sort(function (a, b) {
+      var order = compare(cellValue(a, column), cellValue(b, column));
+      return reverse ? -order : order;
+    });
+    rows.forEach(function (row) {
+      header.parentNode.appendChild(row);
+    });
+  }
+
+  function makeSortable(table) {
+    var header = table.rows[0];
+    var sortedOn = null;
+    var reversed = false;
+    Array.prototype.forEach.call(header.cells, function (cell, column) {
+      cell.style.cursor = 'pointer';
+      cell.title = 'sort on this column';
+      cell.addEventListener('click', function () {
+        reversed = sortedOn === column ? !reversed : false;
+        sortedOn = column;
+        sortTable(table, column, reversed);
+      });
+    });
+  }
+
+  document.addEventListener('DOMContentLoaded', function () {
+    Array.prototype.forEach.call(document.querySelectorAll('table.sortable'), makeSortable);
+  });
+})();
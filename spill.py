@@ -0,0 +1,164 @@
+"""
+spill.py
+--------
+
+Disk-backed structures for builds whose posts don't fit in memory: sorted runs of (key, value)
+pairs that are spilled to disk once they outgrow a memory budget and merged back by key, and a
+reader for the rows of a CSV by their byte offsets.
+
+"""
+
+import csv
+import heapq
+import os
+from array import array
+
+# A pair is packed into one 64-bit int, with the value in the low VALUE_BITS bits
+VALUE_BITS = 40
+
+
+class SortedRuns(object):
+  """ (key, value) pairs of non-negative ints, such as (code id, offset of a post), that are
+      buffered in memory and written out as a sorted run whenever the buffer outgrows budget.
+      groups() merges the runs and the buffer back into one stream sorted by key, then value.
+
+      Attributes:
+        directory <str>: where the runs are written
+        budget <int>: bytes the buffered pairs may take before they are spilled
+        name <str>: prefix of the runs' filenames
+        runs <list str>: the filenames of the runs spilled so far
+  """
+
+  # Roughly what one buffered pair takes: an int object and the list slot pointing to it
+  PAIR_BYTES = 40
+
+  # Runs are merged into one once there are this many, so groups() never opens more files
+  MAX_RUNS = 64
+
+  def __init__( self, directory, budget, name='run' ):
+    self.directory = directory
+    self.budget = budget
+    self.name = name
+    self.runs = []
+    self._buffer = []
+
+  def __len__( self ):
+    return len(self._buffer) + sum(os.path.getsize(run) for run in self.runs) // 8
+
+  def add( self, key, value ):
+    if( value >> VALUE_BITS ):
+      raise ValueError( "value {} too large to spill".format(value) )
+    self._buffer.append( (key << VALUE_BITS) | value )
+    if( len(self._buffer) * self.PAIR_BYTES > self.budget ):
+      self.spill()
+
+  def spill( self ):
+    """ Writes the buffered pairs out as a sorted run """
+    if( not self._buffer ):
+      return
+    self._buffer.sort()
+    filename = os.path.join( self.directory, "{}{}.bin".format(self.name, len(self.runs)) )
+    with open(filename, 'wb') as runFile:
+      array( 'q', self._buffer ).tofile( runFile )
+    self.runs.append( filename )
+    self._buffer = []
+    if( len(self.runs) >= self.MAX_RUNS ):
+      self._mergeRuns()
+
+  def _mergeRuns( self, chunk=1 << 13 ):
+    filename = os.path.join( self.directory, "{}-merged.bin".format(self.name) )
+    with open(filename, 'wb') as runFile:
+      values = array( 'q' )
+      for pair in heapq.merge( *[self._readRun(run) for run in self.runs] ):
+        values.append( pair )
+        if( len(values) == chunk ):
+          values.tofile( runFile )
+          values = array( 'q' )
+      values.tofile( runFile )
+    for run in self.runs:
+      os.remove( run )
+    merged = os.path.join( self.directory, "{}0.bin".format(self.name) )
+    os.replace( filename, merged )
+    self.runs = [merged]
+
+  def _readRun( self, filename, chunk=1 << 13 ):
+    with open(filename, 'rb') as runFile:
+      while True:
+        values = array( 'q' )
+        values.frombytes( runFile.read(chunk * 8) )
+        if( not values ):
+          return
+        yield from values
+
+  def groups( self ):
+    """ Yields (key, array of its values) for every key, in increasing order of key, with the
+        values in increasing order. Only one key's values are held in memory at a time, plus a
+        chunk of each run
+    """
+    self._buffer.sort()
+    merged = heapq.merge( self._buffer, *[self._readRun(run) for run in self.runs] )
+    mask = (1 << VALUE_BITS) - 1
+    key = None
+    values = array( 'q' )
+    for pair in merged:
+      if( pair >> VALUE_BITS != key ):
+        if( key is not None ):
+          yield key, values
+        key = pair >> VALUE_BITS
+        values = array( 'q' )
+      values.append( pair & mask )
+    if( key is not None ):
+      yield key, values
+
+  def remove( self ):
+    """ Deletes the runs spilled to disk """
+    for run in self.runs:
+      os.remove( run )
+    self.runs = []
+    self._buffer = []
+
+
+class RowReader(object):
+  """ Reads the rows of a CSV that start at given byte offsets. The file is read through a buffer,
+      so reading rows in increasing order of offset reads the file forwards, a buffer at a time.
+
+      Attributes:
+        filename <str>: the CSV file
+        bufferSize <int>: bytes read at a time
+  """
+
+  def __init__( self, filename, bufferSize=1 << 16 ):
+    self.filename = filename
+    self.bufferSize = bufferSize
+    self._file = open( filename, 'rb' )
+    self._start = 0
+    self._buffer = b''
+
+  def row( self, offset ):
+    """ Returns the row at offset, as a list of strings """
+    return next( csv.reader(self._lines(offset), dialect='excel') )
+
+  def _lines( self, offset ):
+    # Yields the lines of the file from offset, for csv.reader to take as many as a row spans
+    while True:
+      position = offset - self._start
+      size = self.bufferSize
+      if( 0 <= position <= len(self._buffer) ):
+        end = self._buffer.find( b'\n', position )
+        if( end >= 0 ):
+          yield self._buffer[position:end + 1].decode( 'utf-8' )
+          offset = self._start + end + 1
+          continue
+        # The line runs past the end of the buffer, so refill it with room for the whole line
+        size = max( size, 2 * (len(self._buffer) - position) )
+      self._file.seek( offset )
+      self._start = offset
+      self._buffer = self._file.read( size )
+      if( b'\n' not in self._buffer and len(self._buffer) < size ):
+        # The rest of the file is one line without a line break, or nothing
+        if( self._buffer ):
+          yield self._buffer.decode( 'utf-8' )
+        return
+
+  def close( self ):
+    self._file.close()
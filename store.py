@@ -0,0 +1,147 @@
+"""
+store.py
+--------
+
+An optional SQLite store for a coded dataset, kept as an alternative to master.csv. It holds the
+threads, posts and speakers of a build and the links between posts and codes, indexed by code and
+by thread, so that update mode and the page generators can fetch the posts of one code, thread or
+speaker without loading the whole corpus.
+
+"""
+
+import sqlite3
+from itertools import groupby
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS threads (
+  id INTEGER PRIMARY KEY,
+  title TEXT NOT NULL UNIQUE,
+  position INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS speakers (
+  id INTEGER PRIMARY KEY,
+  name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS posts (
+  id INTEGER PRIMARY KEY,
+  thread INTEGER NOT NULL REFERENCES threads(id),
+  postID INTEGER NOT NULL,
+  speaker INTEGER NOT NULL REFERENCES speakers(id),
+  text TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS post_codes (
+  post INTEGER NOT NULL REFERENCES posts(id),
+  position INTEGER NOT NULL,
+  code TEXT NOT NULL,
+  PRIMARY KEY (post, position)
+);
+CREATE UNIQUE INDEX IF NOT EXISTS posts_by_thread ON posts (thread, postID);
+CREATE INDEX IF NOT EXISTS posts_by_speaker ON posts (speaker);
+CREATE INDEX IF NOT EXISTS post_codes_by_code ON post_codes (code, post);
+"""
+
+# Rows come back in build order: threads in the order they were saved, posts by postID, and the
+# codes of a post in the order they were tagged
+POST_ROWS = """
+SELECT posts.id, threads.title, posts.postID, speakers.name, posts.text, post_codes.code
+FROM posts
+JOIN threads ON threads.id = posts.thread
+JOIN speakers ON speakers.id = posts.speaker
+LEFT JOIN post_codes ON post_codes.post = posts.id
+{where}
+ORDER BY threads.position, posts.postID, post_codes.position
+"""
+
+
+class DatasetStore(object):
+  """ A coded dataset in an SQLite database. Posts are read back as
+      (thread title, postID, speaker, text, [codes]) rows.
+
+      Attributes:
+        filename <str>: the database file
+  """
+
+  def __init__( self, filename ):
+    """ Opens the database in filename, creating the tables if they don't exist yet """
+    self.filename = filename
+    self.connection = sqlite3.connect( filename )
+    self.connection.executescript( SCHEMA )
+
+  def close( self ):
+    self.connection.close()
+
+  def __enter__( self ):
+    return self
+
+  def __exit__( self, *exc ):
+    self.close()
+
+  def saveThreads( self, threads, changed=None ):
+    """ Makes the store hold threads, in that order, in one transaction. Only the posts of the
+        threads in changed are rewritten, all of them if changed is None. Threads that aren't in
+        threads are dropped, along with speakers who no longer have any posts.
+    """
+    cursor = self.connection.cursor()
+    with self.connection:
+      existing = dict( cursor.execute( "SELECT title, id FROM threads" ) )
+      titles = set( thread.title for thread in threads )
+      dropped = [threadId for title, threadId in existing.items() if title not in titles]
+      if( changed is None ):
+        changed = threads
+        dropped = list(existing.values())
+      self._deletePosts( cursor, dropped + [existing[thread.title] for thread in changed if thread.title in existing] )
+      cursor.executemany( "DELETE FROM threads WHERE id = ?", [(threadId,) for threadId in dropped] )
+
+      for position, thread in enumerate(threads):
+        cursor.execute( "INSERT INTO threads (title, position) VALUES (?, ?) ON CONFLICT (title) DO UPDATE SET position = excluded.position",
+                        (thread.title, position) )
+
+      threadIds = dict( cursor.execute( "SELECT title, id FROM threads" ) )
+      cursor.executemany( "INSERT OR IGNORE INTO speakers (name) VALUES (?)",
+                          set( (post.poster,) for thread in changed for post in thread.posts ) )
+      speakerIds = dict( cursor.execute( "SELECT name, id FROM speakers" ) )
+
+      postId = cursor.execute( "SELECT coalesce(max(id), 0) FROM posts" ).fetchone()[0]
+      postRows = []
+      codeRows = []
+      for thread in changed:
+        threadId = threadIds[thread.title]
+        for post in thread.posts:
+          postId += 1
+          postRows.append( (postId, threadId, int(post.postID), speakerIds[post.poster], post.text) )
+          codeRows.extend( (postId, position, code) for position, code in enumerate(post.codes) )
+      cursor.executemany( "INSERT INTO posts (id, thread, postID, speaker, text) VALUES (?, ?, ?, ?, ?)", postRows )
+      cursor.executemany( "INSERT INTO post_codes (post, position, code) VALUES (?, ?, ?)", codeRows )
+      cursor.execute( "DELETE FROM speakers WHERE id NOT IN (SELECT speaker FROM posts)" )
+
+  def _deletePosts( self, cursor, threadIds ):
+    for threadId in threadIds:
+      cursor.execute( "DELETE FROM post_codes WHERE post IN (SELECT id FROM posts WHERE thread = ?)", (threadId,) )
+      cursor.execute( "DELETE FROM posts WHERE thread = ?", (threadId,) )
+
+  def _rows( self, where='', params=() ):
+    cursor = self.connection.execute( POST_ROWS.format(where=where), params )
+    for postId, rows in groupby( cursor, key=lambda row: row[0] ):
+      first = next(rows)
+      codes = [first[5]] if first[5] is not None else []
+      codes.extend( row[5] for row in rows )
+      yield (first[1], first[2], first[3], first[4], codes)
+
+  def threadTitles( self ):
+    """ Returns the titles of the threads in the store, in order """
+    return [title for (title,) in self.connection.execute( "SELECT title FROM threads ORDER BY position" )]
+
+  def threadRows( self, titles=None ):
+    """ Yields the posts of the threads with the given titles, of every thread if titles is None """
+    if( titles is None ):
+      return self._rows()
+    titles = list(titles)
+    return self._rows( "WHERE threads.title IN ({})".format(', '.join('?' * len(titles))), titles )
+
+  def codeRows( self, code ):
+    """ Yields the posts tagged with code """
+    return self._rows( "WHERE posts.id IN (SELECT post FROM post_codes WHERE code = ?)", (code,) )
+
+  def speakerRows( self, name ):
+    """ Yields the posts of the speaker called name """
+    return self._rows( "WHERE speakers.name = ?", (name,) )
@@ -0,0 +1,93 @@
+"""
+synthetic.py
+------------
+
+Writes synthetic codebooks and transcripts for the benchmarks: raw transcripts in the form
+reformat.py reads, or transcripts already in the form reformat.py writes and code-extract.py reads.
+Everything is drawn from a seeded random generator, so the same arguments give the same corpus.
+
+"""
+
+import os
+import random
+
+WORDS = ['account', 'phone', 'clinic', 'password', 'location', 'app', 'message', 'family',
+         'trust', 'setting', 'worry', 'help', 'access', 'friend', 'email', 'camera']
+SPEAKERS = ['Interviewer', 'Consultant', 'Note taker']
+
+
+def make_codes(num_codes, seed=0):
+    """ Returns num_codes distinct code names of two or three words, like a real codebook's """
+    rng = random.Random(seed)
+    codes = []
+    seen = set()
+    while len(codes) < num_codes:
+        code = ' '.join(word.capitalize() for word in rng.sample(WORDS, rng.randint(2, 3)))
+        code = '{} {}'.format(code, len(codes))
+        if code not in seen:
+            seen.add(code)
+            codes.append(code)
+    return codes
+
+
+def write_codebook(path, codes):
+    """ Writes codes as a codebook CSV of code, description rows """
+    with open(path, 'w') as outfile:
+        for code in codes:
+            outfile.write('{},description of {}\n'.format(code, code.lower()))
+
+
+def misspell(code, rng):
+    """ Returns code with one letter dropped, doubled or swapped with the next """
+    i = rng.randrange(len(code) - 1)
+    edit = rng.randrange(3)
+    if edit == 0:
+        return code[:i] + code[i + 1:]
+    elif edit == 1:
+        return code[:i] + code[i] + code[i:]
+    return code[:i] + code[i + 1] + code[i] + code[i + 2:]
+
+
+def utterance(rng, length):
+    return ' '.join(rng.choice(WORDS) for i in range(length))
+
+
+def write_raw_corpus(raw_dir, codes, num_interviews, quotes, codes_per_quote=3, misspell_rate=0.0, seed=0):
+    """
+    Writes raw transcripts, P0.csv, P1.csv, ..., in the form reformat.py reads: a header row, then
+    speaker, utterance and codes_per_quote code columns, some of them blank.
+
+    :param misspell_rate: the fraction of tags that are misspelled, for reformat.py to correct
+    :return: number of quotes written
+    """
+    rng = random.Random(seed)
+    os.makedirs(raw_dir, exist_ok=True)
+    header = 'Name,text' + ',code' * codes_per_quote + '\n'
+    for i in range(num_interviews):
+        speakers = SPEAKERS + ['P{}'.format(i)]
+        with open(os.path.join(raw_dir, 'P{}.csv'.format(i)), 'w') as outfile:
+            outfile.write(header)
+            for j in range(quotes):
+                tags = rng.sample(codes, rng.randint(0, codes_per_quote))
+                tags = [misspell(tag, rng) if rng.random() < misspell_rate else tag for tag in tags]
+                tags += [''] * (codes_per_quote - len(tags))
+                outfile.write('{},{},{}\n'.format(rng.choice(speakers), utterance(rng, rng.randint(5, 40)), ','.join(tags)))
+    return num_interviews * quotes
+
+
+def write_corpus(corpus_dir, num_codes, num_interviews, quotes, seed=0):
+    """ Writes a codebook and transcripts in reformat.py's output form, returns the codebook path """
+    rng = random.Random(seed)
+    codes = ['Code_{}'.format(i) for i in range(num_codes)]
+    codebook = os.path.join(corpus_dir, 'codebook.csv')
+    write_codebook(codebook, codes)
+    transcripts = os.path.join(corpus_dir, 'transcripts')
+    os.makedirs(transcripts)
+    for i in range(num_interviews):
+        with open(os.path.join(transcripts, 'P{}.csv'.format(i)), 'w') as outfile:
+            for j in range(quotes):
+                speaker = rng.choice(['Interviewer', 'P{}'.format(i), 'Consultant'])
+                tags = rng.sample(codes, rng.randint(0, 3))
+                outfile.write('{} =DELIM= quote {} of interview {} =DELIM= {}\n'.format(
+                    speaker, j, i, ''.join(tag + ', ' for tag in tags)))
+    return codebook
@@ -0,0 +1,200 @@
+"""
+test_build.py
+-------------
+
+End to end tests of code-extract.py, run on small synthetic corpora written by synthetic.py.
+
+"""
+
+import csv
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+import zipfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from synthetic import write_corpus
+
+CODE_EXTRACT = os.path.join(ROOT, 'code-extract.py')
+
+
+def run(*args):
+    """ Runs code-extract.py from the repo, returns what it printed. Some pages list sets, so every
+        run has the same hash seed for builds to be compared byte for byte
+    """
+    result = subprocess.run([sys.executable, CODE_EXTRACT] + list(args), cwd=ROOT, check=True,
+                            env=dict(os.environ, PYTHONHASHSEED='0'),
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    return result.stdout
+
+
+def read_rows(filename):
+    with open(filename) as infile:
+        return list(csv.reader(infile))
+
+
+class BuildTest(unittest.TestCase):
+    """ Builds a corpus of a few interviews into a fresh output directory for each test """
+
+    def setUp(self):
+        self.work_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.work_dir.cleanup)
+        self.codebook = write_corpus(self.work_dir.name, 8, 4, 30)
+        self.transcripts = os.path.join(self.work_dir.name, 'transcripts') + '/'
+        self.output_dir = os.path.join(self.work_dir.name, 'output')
+        self.csv_dir = os.path.join(self.output_dir, 'csv')
+        self.master = os.path.join(self.csv_dir, 'master.csv')
+
+    def build(self, *flags):
+        return run(*(list(flags) + ['Test', self.output_dir, self.codebook, self.transcripts]))
+
+    def update(self, *generated):
+        return run(*(['-u', self.master, 'Test', self.output_dir, self.codebook] + list(generated)))
+
+    def test_update_from_build_csv_directory(self):
+        self.build()
+        master = read_rows(self.master)
+        output = self.update(self.csv_dir + '/')
+        self.assertNotIn("couldn't find post", output)
+        self.assertIn('Updating 0 posts', output)
+        self.assertEqual(read_rows(self.master), master)
+
+    def test_update_applies_edit_in_build_csv_directory(self):
+        self.build()
+        code_csv = os.path.join(self.csv_dir, 'codes', 'Code_0.csv')
+        rows = read_rows(code_csv)
+        rows[1][3] = 'an edited quote'
+        with open(code_csv, 'w') as outfile:
+            csv.writer(outfile, dialect='excel').writerows(rows)
+        output = self.update(self.csv_dir + '/')
+        self.assertNotIn("couldn't find post", output)
+        self.assertIn('Updating 1 posts', output)
+        edited = [row for row in read_rows(self.master) if row[:2] == rows[1][:2]]
+        self.assertEqual(edited[0][3], 'an edited quote')
+
+    def test_update_with_codebook_that_dropped_a_code(self):
+        self.build()
+        with open(self.codebook) as infile:
+            rows = list(csv.reader(infile))
+        self.assertEqual(rows[-1][0], 'Code_7')
+        with open(self.codebook, 'w') as outfile:
+            csv.writer(outfile, dialect='excel').writerows(rows[:-1])
+        output = self.update(self.csv_dir + '/')
+        self.assertIn('regenerating every page', output)
+        for row in read_rows(self.master)[1:]:
+            self.assertNotIn('Code_7', row[4:])
+        for name in os.listdir(os.path.join(self.output_dir, 'html')):
+            self.assertFalse(name.startswith('Code_7_P'), name)
+            if name.startswith('P') and name.endswith('.html'):
+                with open(os.path.join(self.output_dir, 'html', name)) as page:
+                    self.assertNotIn('Code_7', page.read(), name)
+
+    def test_archive_holds_last_write_of_each_page(self):
+        # The synthetic speakers P0, P1, ... share their page names with the interviews
+        self.build()
+        archive_dir = os.path.join(self.work_dir.name, 'archive')
+        run('-z', 'zip', 'Test', archive_dir, self.codebook, self.transcripts)
+        loose = sorted(os.path.relpath(os.path.join(root, name), archive_dir)
+                       for root, dirs, files in os.walk(archive_dir) for name in dirs + files)
+        self.assertEqual(loose, ['csv', os.path.join('csv', 'master.csv'), 'site.zip'])
+        with zipfile.ZipFile(os.path.join(archive_dir, 'site.zip')) as archive:
+            names = archive.namelist()
+            self.assertEqual(len(names), len(set(names)))
+            for name in names:
+                with open(os.path.join(self.output_dir, name), 'rb') as loose:
+                    self.assertEqual(archive.read(name), loose.read(), name)
+
+    def test_incremental_build_sees_edit_that_keeps_size_and_mtime(self):
+        self.build('-i')
+        transcript = os.path.join(self.transcripts, 'P0.csv')
+        stat = os.stat(transcript)
+        with open(transcript) as infile:
+            text = infile.read()
+        with open(transcript, 'w') as outfile:
+            outfile.write(text.replace('quote 0 of interview 0', 'QUOTE 0 OF INTERVIEW 0', 1))
+        os.utime(transcript, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        self.assertEqual(os.stat(transcript).st_size, stat.st_size)
+        output = self.build('-i')
+        self.assertIn('1 of 4 transcripts changed', output)
+        interview_rows = read_rows(os.path.join(self.csv_dir, 'interviews', 'P0.csv'))
+        self.assertIn('QUOTE 0 OF INTERVIEW 0', [row[3].strip() for row in interview_rows])
+
+    def test_incremental_build_after_failed_build_redoes_it(self):
+        self.build('-i')
+        transcript = os.path.join(self.transcripts, 'P1.csv')
+        with open(transcript) as infile:
+            text = infile.read()
+        with open(transcript, 'w') as outfile:
+            outfile.write(text.replace('quote 0 of interview 1', 'an edited quote', 1))
+        # A directory in place of the interview's page stops the build as it renders
+        page = os.path.join(self.output_dir, 'html', 'P1.html')
+        os.remove(page)
+        os.mkdir(page)
+        with self.assertRaises(subprocess.CalledProcessError):
+            self.build('-i')
+        self.assertFalse(os.path.exists(os.path.join(self.output_dir, 'manifest.json')))
+        os.rmdir(page)
+        output = self.build('-i')
+        self.assertIn('No usable manifest', output)
+        with open(page) as infile:
+            self.assertIn('an edited quote', infile.read())
+        self.assertTrue(os.path.exists(os.path.join(self.output_dir, 'manifest.json')))
+        self.assertIn('0 of 4 transcripts changed', self.build('-i'))
+
+    def test_streamed_build_has_no_search_page(self):
+        self.build()
+        self.build('-m', '1')
+        html_dir = os.path.join(self.output_dir, 'html')
+        self.assertFalse(os.path.exists(os.path.join(html_dir, 'search.html')))
+        self.assertFalse(os.path.exists(os.path.join(html_dir, 'search.js')))
+        for root, dirs, files in os.walk(os.path.join(html_dir, 'search')):
+            self.assertEqual(files, [], root)
+        for name in os.listdir(html_dir):
+            if name.endswith('.html'):
+                with open(os.path.join(html_dir, name)) as page:
+                    self.assertNotIn('search.html', page.read(), name)
+
+    def test_failed_streamed_build_deletes_spilled_runs(self):
+        self.build()
+        page = os.path.join(self.output_dir, 'html', 'Code_0.html')
+        os.remove(page)
+        os.mkdir(page)
+        with self.assertRaises(subprocess.CalledProcessError):
+            self.build('-m', '0.001')
+        self.assertEqual([name for name in os.listdir(self.output_dir) if name.startswith('spill-')], [])
+
+    def test_codes_named_like_summary_csvs(self):
+        names = {'Code_0': 'master', 'Code_1': 'code_counts', 'Code_2': 'code_cooccurrence'}
+        for filename in [self.codebook] + [os.path.join(self.transcripts, name) for name in os.listdir(self.transcripts)]:
+            with open(filename) as infile:
+                text = infile.read()
+            for code, name in names.items():
+                text = text.replace(code + ',', name + ',')
+            with open(filename, 'w') as outfile:
+                outfile.write(text)
+        self.build()
+        self.assertEqual(read_rows(self.master)[0], ['threadTitle', 'postID', 'poster', 'text'])
+        self.assertEqual(read_rows(os.path.join(self.csv_dir, 'code_counts.csv'))[0],
+                         ['code', 'interview_count', 'quote_count', 'speaker_count'])
+        self.assertEqual(read_rows(os.path.join(self.csv_dir, 'code_cooccurrence.csv'))[0][0], 'code')
+        for name in names.values():
+            rows = read_rows(os.path.join(self.csv_dir, 'codes', name + '.csv'))
+            self.assertEqual(rows[0], ['thread', 'postID', 'speaker', 'text', 'code'])
+            self.assertTrue(all(name in row[4:] for row in rows[1:]), name)
+
+    def test_interview_named_like_a_summary_csv(self):
+        os.rename(os.path.join(self.transcripts, 'P0.csv'), os.path.join(self.transcripts, 'master.csv'))
+        self.build()
+        interviews = set(row[0] for row in read_rows(self.master)[1:])
+        self.assertEqual(interviews, {'master', 'P1', 'P2', 'P3'})
+        interview_rows = read_rows(os.path.join(self.csv_dir, 'interviews', 'master.csv'))
+        self.assertEqual(interview_rows[0], ['interview', 'postID', 'poster', 'text', 'code'])
+        self.assertEqual(set(row[0] for row in interview_rows[1:]), {'master'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+#!/usr/bin/python3
+import sys
+
+if sys.version_info[0] != 3:
+    print("This script requires Python version 3")
+    sys.exit(1)
+
+"""
+update_benchmark.py
+-------------------
+
+Times code-extract.py's update mode against a full rebuild. Writes a synthetic
+corpus of reformatted transcripts to a temporary directory, builds it once, then
+edits a few quotes in one code's CSV and times applying the edits with -u
+against rebuilding everything from the transcripts.
+
+"""
+
+import argparse
+import csv
+import os
+import subprocess
+import tempfile
+import time
+
+from synthetic import write_corpus
+
+CODE_EXTRACT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'code-extract.py')
+
+
+def run(*args):
+    """ Runs code-extract.py, returns the wall time in seconds """
+    start = time.perf_counter()
+    subprocess.run([sys.executable, CODE_EXTRACT] + list(args), check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def edit_code_csv(code_csv, edited_csv, num_edits):
+    """ Copies a code's CSV with the text of its first num_edits quotes changed """
+    with open(code_csv) as infile:
+        rows = list(csv.reader(infile))
+    for row in rows[1:num_edits + 1]:
+        row[3] = row[3] + ' (edited)'
+    with open(edited_csv, 'w') as outfile:
+        csv.writer(outfile).writerows(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Time update mode against a full rebuild.')
+    parser.add_argument('-c', '--codes', type=int, default=50, help="codes in the codebook (default: 50)")
+    parser.add_argument('-n', '--interviews', type=int, default=50, help="number of interviews (default: 50)")
+    parser.add_argument('-q', '--quotes', type=int, default=400, help="quotes per interview (default: 400)")
+    parser.add_argument('-e', '--edits', type=int, default=5, help="quotes to edit (default: 5)")
+    parser.add_argument('-s', '--store', action='store_true', help="keep the dataset in the SQLite store")
+    args = vars(parser.parse_args())
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        codebook = write_corpus(work_dir, args['codes'], args['interviews'], args['quotes'])
+        transcripts = os.path.join(work_dir, 'transcripts') + '/'
+        output_dir = os.path.join(work_dir, 'output')
+        flags = ['--store'] if args['store'] else []
+        master = os.path.join(output_dir, 'master.db') if args['store'] else os.path.join(output_dir, 'csv', 'master.csv')
+
+        full = run(*(flags + ['Benchmark', output_dir, codebook, transcripts]))
+        edited_csv = os.path.join(work_dir, 'edited.csv')
+        edit_code_csv(os.path.join(output_dir, 'csv', 'Code_0.csv'), edited_csv, args['edits'])
+        update = run(*(flags + ['-u', master, 'Benchmark', output_dir, codebook, edited_csv]))
+
+    print('{} interviews x {} quotes, {} codes'.format(args['interviews'], args['quotes'], args['codes']))
+    print('full rebuild: {:.2f}s'.format(full))
+    print('update of {} quotes: {:.2f}s ({:.1f}x faster)'.format(args['edits'], update, full / update))
@@ -1,5 +1,10 @@
+import hashlib
+import heapq
+import json
 import editdistance
 
+from profiling import profiled
+
 def urlSafe( string ):
   urlSafe = string.strip()
   urlSafe = urlSafe.replace( '/', '_' )
@@ -18,21 +23,202 @@ def stripQuotesSpace( string ):
     return string[1:-1].strip()
   return string.strip()
 
+class CodeMatcher(object):
+  """ Nearest-code lookup over a codebook by edit distance.
+
+      The codebook is stored in a BK-tree, so a query only computes the edit distance to the
+      codes the triangle inequality can't rule out, rather than to every code.
+
+      Attributes:
+        codes <list>: the codebook, in order
+        maxDistance <int>: default cutoff for nearest(), None for no cutoff
+  """
+
+  def __init__( self, codes, maxDistance=None ):
+    """ Builds the tree once from the codebook """
+    self.codes = list(codes)
+    self.maxDistance = maxDistance
+    self._codeSet = set(self.codes)
+    self._root = None
+    for index, code in enumerate(self.codes):
+      self._insert( code, index )
+
+  def __contains__( self, code ):
+    return code in self._codeSet
+
+  def __iter__( self ):
+    return iter(self.codes)
+
+  def __len__( self ):
+    return len(self.codes)
+
+  def _insert( self, code, index ):
+    # Nodes are (code, codebook index, {distance: child node})
+    node = (code, index, {})
+    if( self._root is None ):
+      self._root = node
+      return
+    current = self._root
+    while True:
+      distance = editdistance.eval( code, current[0] )
+      if( distance == 0 ):
+        return  # duplicate code in the codebook
+      child = current[2].get(distance)
+      if( child is None ):
+        current[2][distance] = node
+        return
+      current = child
+
+  def nearest( self, code, k=1, maxDistance=None ):
+    """
+      Returns up to k (distance, code) pairs, closest first. Ties are ranked in codebook order.
+
+      :param code: slugified code to look up
+      :param k: number of candidates to return
+      :param maxDistance: ignore codes further away than this, defaults to self.maxDistance
+    """
+    if( maxDistance is None ):
+      maxDistance = self.maxDistance
+    if( self._root is None or k < 1 ):
+      return []
+
+    best = []  # heap of (-distance, -index, code), so the worst candidate is on top
+    stack = [self._root]
+    while stack:
+      candidate, index, children = stack.pop()
+      distance = editdistance.eval( code, candidate )
+      if( maxDistance is None or distance <= maxDistance ):
+        if( len(best) < k ):
+          heapq.heappush( best, (-distance, -index, candidate) )
+        elif( (-distance, -index) > best[0][:2] ):
+          heapq.heapreplace( best, (-distance, -index, candidate) )
+
+      # Only subtrees within radius of this node's distance can hold a better candidate
+      if( len(best) == k ):
+        radius = -best[0][0]
+      else:
+        radius = maxDistance
+      for childDistance, child in children.items():
+        if( radius is None or abs(childDistance - distance) <= radius ):
+          stack.append( child )
+
+    return [(-negDistance, candidate) for negDistance, negIndex, candidate in sorted(best, reverse=True)]
+
+
+def codebookHash( codes, *settings ):
+  """ Returns a hex digest of the codebook codes, plus any settings that change how codes are merged """
+  return hashlib.sha256( json.dumps([list(codes), list(settings)]).encode('utf-8') ).hexdigest()
+
+
+class Interner(object):
+  """ Interns strings as small integer ids, and sequences of them as shared tuples of ids, so that
+      the many objects that repeat the same few strings only hold ids. Each distinct tuple of ids is
+      stored once, as is the tuple of strings it stands for.
+
+      Attributes:
+        strings <list str>: the interned strings, indexed by id
+  """
+
+  __slots__ = ('strings', '_ids', '_tuples', '_names')
+
+  def __init__( self, strings=() ):
+    self.strings = []
+    self._ids = {}
+    self._tuples = {}
+    self._names = {}
+    for string in strings:
+      self.id( string )
+
+  def __len__( self ):
+    return len(self.strings)
+
+  def __getstate__( self ):
+    return self.strings
+
+  def __setstate__( self, strings ):
+    self.__init__( strings )
+
+  def load( self, other ):
+    """ Makes this the same table as other, for processes that receive ids interned elsewhere """
+    if( other is not self ):
+      self.__init__( other.strings )
+
+  def id( self, string ):
+    """ Returns the id of string, interning it if it is new """
+    try:
+      return self._ids[string]
+    except KeyError:
+      self._ids[string] = len(self.strings)
+      self.strings.append( string )
+      return self._ids[string]
+
+  def ids( self, strings ):
+    """ Returns the shared tuple of the ids of strings """
+    key = tuple( self.id(string) for string in strings )
+    return self._tuples.setdefault( key, key )
+
+  def names( self, ids ):
+    """ Returns the shared tuple of the strings ids stand for """
+    try:
+      return self._names[ids]
+    except KeyError:
+      names = self._names[ids] = tuple( self.strings[i] for i in ids )
+      return names
+
+
+class CodeCorrections(dict):
+  """ The corrections learned by mergeCodes, {unrecognized code: codebook code}, that can be
+      persisted between runs. A saved cache is tied to the codebookHash it was built with and is
+      ignored on load once the codebook changes.
+
+      Attributes:
+        hits <int>: lookups in mergeCodes answered by a cached correction
+        misses <int>: lookups in mergeCodes that had to be worked out
+  """
+
+  def __init__( self, *args, **kwargs ):
+    dict.__init__( self, *args, **kwargs )
+    self.hits = 0
+    self.misses = 0
+
+  @classmethod
+  def load( cls, filename, key ):
+    """ Returns the corrections saved in filename, or none if it is missing or was saved for another codebook """
+    try:
+      with open(filename, 'r') as cacheFile:
+        cache = json.load( cacheFile )
+    except (OSError, ValueError):
+      return cls()
+    if( not isinstance(cache, dict) or cache.get('codebook') != key ):
+      return cls()
+    return cls( cache.get('corrections', {}) )
+
+  def save( self, filename, key ):
+    with open(filename, 'w') as cacheFile:
+      json.dump( {'codebook': key, 'corrections': dict(sorted(self.items()))}, cacheFile, indent=1 )
+
+  def report( self ):
+    return "code corrections cache: {} hits, {} misses, {} corrections cached".format(self.hits, self.misses, len(self))
+
+
+@profiled
 def mergeCodes( code, codes, codeCorrections, skip=False ):
   """
     If an unrecognized code is found in a transcript file, check for nearby ones by edit distance.
     Customizable by project.
 
     :param code: slugified code
-    :param codes: list of all codes
-    :param codeCorrections: dict of corrections seen so far
+    :param codes: CodeMatcher built from all codes
+    :param codeCorrections: CodeCorrections seen so far
     :param skip: bool for whether to just skip codes you haven't seen or try to map them
   """
   # If you've seen this codeCorrection in your cache, use the cached correction
   if( code in codeCorrections ):
+    codeCorrections.hits += 1
     print("Using {} instead of {}".format(codeCorrections[code],code))
     code = codeCorrections[code]
     return code, codeCorrections
+  codeCorrections.misses += 1
 
   if skip:
     return '', codeCorrections
@@ -63,18 +249,12 @@ def mergeCodes( code, codes, codeCorrections, skip=False ):
       return new_code, codeCorrections
 
   #print("Unrecognized code: ", code)
-  distances = {}
-  for possibleCode in codes:
-    distances[editdistance.eval( code, possibleCode )] = possibleCode
-
-  for i, key in enumerate(sorted(distances)):
-    #if( i > 2 ):   # only bother the user to go through top 3 closest codes
-    #  break
-    #answer = raw_input("Should '" + code + "' have been '" + distances[key] + "'?  [y/N] ")
+  for i, (distance, possibleCode) in enumerate(codes.nearest( code, k=3 )):  # only bother the user to go through top 3 closest codes
+    #answer = raw_input("Should '" + code + "' have been '" + possibleCode + "'?  [y/N] ")
     #if( answer == 'y' or answer == 'Y' ):
-    print("Replacing {} with {}".format(code, distances[key]))
-    codeCorrections[code] = distances[key]
-    code = distances[key]
+    print("Replacing {} with {}".format(code, possibleCode))
+    codeCorrections[code] = possibleCode
+    code = possibleCode
     return code, codeCorrections  # It's always working well with edit distance, so let's just do it without asking
 
   return '', codeCorrections  # Signifies no suitable match found